@@ -7,18 +7,34 @@ from transpire.utils import get_image_tag, get_revision
 name = "ircbot"
 auto_sync = True
 
+# Caches the bot keeps between restarts (the turing model, xkcd mirror,
+# Google results and quota, ...), see ircbot/files.py
+cache_dir = "/var/cache/ircbot"
+cache_claim = "ircbot-cache"
+
 def dep_patches(dep):
     dep.obj.spec.template.spec.dns_policy = "ClusterFirst"
     dep.obj.spec.template.spec.dns_config = {"searches": ["ocf.berkeley.edu"]}
 
     dep.obj.spec.template.spec.volumes = [
         {"name": "config", "secret": {"secretName": "ircbot"}},
+        {"name": "cache", "persistentVolumeClaim": {"claimName": cache_claim}},
     ]
 
     dep.obj.spec.template.spec.containers[0].volume_mounts = [
         {"name": "config", "mountPath": "/etc/ocf-ircbot"},
+        {"name": "cache", "mountPath": cache_dir},
+    ]
+    dep.obj.spec.template.spec.containers[0].env = [
+        {"name": "IRCBOT_CACHE_DIR", "value": cache_dir},
     ]
 
+    # The bot runs as nobody, so let it write to the volume
+    dep.obj.spec.template.spec.security_context = {"fsGroup": 65534}
+    # The volume can only be mounted by one pod at a time, so stop the old
+    # pod before starting its replacement
+    dep.obj.spec.strategy = {"type": "Recreate"}
+
 
 def images():
     yield Image(name="ircbot", path=Path("/"))
@@ -33,6 +49,16 @@ def objects():
     )
     yield secret.build()
 
+    yield {
+        "apiVersion": "v1",
+        "kind": "PersistentVolumeClaim",
+        "metadata": {"name": cache_claim},
+        "spec": {
+            "accessModes": ["ReadWriteOnce"],
+            "resources": {"requests": {"storage": "1Gi"}},
+        },
+    }
+
     dep_bot = Deployment(
         name=name,
         image=get_image_tag("ircbot"),
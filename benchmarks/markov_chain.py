@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""Compare the turing plugin's CompactText with the markovify model it replaced.
+
+By default the corpus is made up, at about the size of the real one: a few
+thousand quotes and inspirations, and a few hundred rants, with words
+picked from a Zipf-like distribution. To use real data, pass a file with one
+sentence per line, like the output of `SELECT quote FROM quotes`.
+
+Run from the root of the repo:
+
+    python -m benchmarks.markov_chain [--corpus quotes.txt]
+"""
+import argparse
+import gc
+import random
+import time
+import tracemalloc
+
+import markovify
+
+from ircbot.markov import CompactText
+from ircbot.markov import MODEL_WEIGHTS
+from ircbot.markov import SENTENCE_TRIES
+
+NUM_QUOTES = 12000
+NUM_INSPIRATIONS = 2000
+NUM_RANTS = 600
+VOCABULARY_SIZE = 20000
+
+NUM_SENTENCES = 300
+
+
+def make_sentences(rand, count, min_words, max_words):
+    words = [f'w{i}' for i in range(VOCABULARY_SIZE)]
+    # Word i comes up about 1/(i+1) as often as the most common word
+    weights = [1 / (i + 1) for i in range(VOCABULARY_SIZE)]
+    return [
+        ' '.join(rand.choices(words, weights, k=rand.randint(min_words, max_words)))
+        for _ in range(count)
+    ]
+
+
+def make_corpus(path):
+    if path:
+        with open(path) as f:
+            return [[line.strip() for line in f if line.strip()], [], []]
+    rand = random.Random(0)
+    return [
+        make_sentences(rand, NUM_QUOTES, 3, 25),
+        make_sentences(rand, NUM_RANTS, 8, 40),
+        make_sentences(rand, NUM_INSPIRATIONS, 5, 20),
+    ]
+
+
+def build_markovify(corpus):
+    # Like build_model, without the database
+    models = [markovify.NewlineText('\n'.join(texts)) for texts in corpus if texts]
+    return markovify.combine(models, MODEL_WEIGHTS[:len(models)])
+
+
+def measure(build):
+    """Return what build returns, with how much memory it holds onto and used at peak."""
+    gc.collect()
+    tracemalloc.start()
+    model = build()
+    gc.collect()
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return model, retained, peak
+
+
+def generate(model, seed):
+    random.seed(seed)
+    start = time.perf_counter()
+    walked = [model.chain.walk() for _ in range(NUM_SENTENCES)]
+    walk_seconds = time.perf_counter() - start
+
+    random.seed(seed)
+    start = time.perf_counter()
+    sentences = [model.make_sentence(tries=SENTENCE_TRIES) for _ in range(NUM_SENTENCES)]
+    sentence_seconds = time.perf_counter() - start
+    return walked, walk_seconds, sentences, sentence_seconds
+
+
+def report(name, model, retained, peak):
+    walked, walk_seconds, sentences, sentence_seconds = generate(model, seed=0)
+    cache = model.to_json()
+
+    start = time.perf_counter()
+    type(model).from_json(cache)
+    load_seconds = time.perf_counter() - start
+
+    print(
+        f'{name:<12} {retained / 2**20:>10.1f} {peak / 2**20:>9.1f} '
+        f'{walk_seconds / NUM_SENTENCES * 1e6:>9.1f} {sentence_seconds / NUM_SENTENCES * 1e3:>12.2f} '
+        f'{sum(s is None for s in sentences):>7} {len(cache) / 2**20:>9.1f} {load_seconds:>7.2f}',
+    )
+    return walked
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Compare memory use and sentence generation of the turing models.',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument('--corpus', help='File of sentences to use instead of a made up corpus.')
+    args = parser.parse_args()
+
+    corpus = make_corpus(args.corpus)
+    print(
+        f'{sum(map(len, corpus))} sentences, {sum(len(text.split()) for texts in corpus for text in texts)} words; '
+        f'{NUM_SENTENCES} sentences generated with each model\n',
+    )
+    print(
+        f'{"":<12} {"held MiB":>10} {"peak MiB":>9} {"µs/walk":>9} {"ms/sentence":>12} '
+        f'{"failed":>7} {"cache MiB":>9} {"load s":>7}',
+    )
+
+    model, retained, peak = measure(lambda: build_markovify(corpus))
+    old_walks = report('markovify', model, retained, peak)
+    del model
+
+    # Includes building the markovify model first, since that's how it's done
+    model, retained, peak = measure(lambda: CompactText.from_text(build_markovify(corpus)))
+    new_walks = report('compact', model, retained, peak)
+
+    # The same random numbers should pick the same words
+    print(f'\nsame sentences from the same seed: {old_walks == new_walks}')
+
+
+if __name__ == '__main__':
+    main()
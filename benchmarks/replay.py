@@ -0,0 +1,385 @@
+#!/usr/bin/env python3
+"""Replay a recorded IRC log through CreateBot.handle_chat, without a network.
+
+Each line of the log is one message, with the channel, nick, oper flag, and
+text separated by tabs. The oper flag is 1 if the nick was an operator in the
+channel, otherwise 0.
+Blank lines are ignored. A sample log is in benchmarks/traffic.log.
+
+The bot is run against local stand-ins for IRC, MySQL (ircbot.db.cursor),
+HTTP (requests), LDAP and Celery, and any other attempt to use the network
+fails. Caches are kept in a temporary directory, and the turing sentence
+worker runs on a thread instead of in its own process, so that it uses the
+stand-ins too. Listeners run inline rather than on the worker pool, so that
+their CPU time and allocations can be measured.
+
+Run from the root of the repo:
+
+    python -m benchmarks.replay benchmarks/traffic.log
+"""
+import argparse
+import collections
+import contextlib
+import re
+import socket
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Any
+from typing import Dict
+from typing import Iterator
+from typing import List
+from typing import NamedTuple
+from unittest import mock
+
+import requests
+from ocflib.infra import ldap
+
+from ircbot import db
+from ircbot import files
+from ircbot import markov
+from ircbot.ircbot import CreateBot
+from ircbot.ircbot import IRC_CHANNELS_OPER
+from ircbot.ircbot import IRC_NICKNAME
+from ircbot.ircbot import Listener
+from ircbot.ircbot import MatchedMessage
+from ircbot.outbound import TokenBucket
+
+# The nickname the bot had when the log was recorded
+RECORDED_NICK = 'create'
+
+# Send as fast as we can, rather than at a rate the server will accept
+UNLIMITED_RATE = 10 ** 9
+
+
+class Event(NamedTuple):
+    channel: str
+    nick: str
+    is_oper: bool
+    text: str
+
+
+class ListenerStats:
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.cpu = 0.0
+        self.wall = 0.0
+        self.peak_bytes = 0
+        self.net_blocks = 0
+
+
+def read_log(path: str, recorded_nick: str) -> List[Event]:
+    mention = re.compile(rf'^{re.escape(recorded_nick)}(:? )', re.IGNORECASE)
+    events = []
+    with open(path) as f:
+        for line in f:
+            line = line.rstrip('\n')
+            if not line:
+                continue
+            channel, nick, oper, text = line.split('\t', 3)
+            # Address messages to the bot to whatever it's called now
+            text = mention.sub(rf'{IRC_NICKNAME}\1', text)
+            events.append(Event(channel=channel, nick=nick, is_oper=oper == '1', text=text))
+    return events
+
+
+class FakeConnection:
+    """Stands in for the bot's IRC connection, keeping count of what's sent."""
+
+    def __init__(self):
+        self.sent: collections.Counter = collections.Counter()
+
+    def send_raw(self, line: str):
+        self.sent[line.split(' ', 1)[0]] += 1
+
+    def is_connected(self) -> bool:
+        return True
+
+    def __getattr__(self, command: str):
+        # privmsg, join, topic, kick, etc.
+        return lambda *args, **kwargs: self.send_raw(command.upper())
+
+
+class FakeCursor:
+    """A database cursor serving canned rows, by the table being selected from."""
+
+    def __init__(self, tables: Dict[str, List[Dict[str, Any]]], queries: collections.Counter):
+        self.tables = tables
+        self.queries = queries
+        self.rows: List[Dict[str, Any]] = []
+        self.rowcount = 0
+        self.lastrowid = 0
+
+    def execute(self, query: str, args=None) -> int:
+        table = re.search(r'\b(?:FROM|INTO|UPDATE)\s+`?(\w+)', query, re.IGNORECASE)
+        name = table.group(1) if table else ''
+        self.queries[name] += 1
+        if query.lstrip().upper().startswith('SELECT'):
+            self.rows = list(self.tables.get(name, ()))
+        else:
+            self.rows = []
+        self.rowcount = len(self.rows)
+        return self.rowcount
+
+    def fetchone(self):
+        return self.rows[0] if self.rows else None
+
+    def fetchall(self):
+        return self.rows
+
+
+class FakeLdapConnection:
+    """An LDAP connection that never finds anything."""
+
+    def __init__(self):
+        self.entries: List[Any] = []
+        self.response: List[Any] = []
+
+    def search(self, *args, **kwargs) -> bool:
+        return False
+
+
+class FakeTask:
+
+    def __init__(self, calls: collections.Counter, name: str):
+        self.calls = calls
+        self.name = name
+
+    def delay(self, *args, **kwargs):
+        self.calls[self.name] += 1
+        return mock.Mock(**{'get.return_value': [], 'wait.return_value': []})
+
+
+class FakeTasks:
+    """Stands in for the Celery tasks the create plugin calls."""
+
+    def __init__(self):
+        self.calls: collections.Counter = collections.Counter()
+
+    def __getattr__(self, name: str) -> FakeTask:
+        return FakeTask(self.calls, name)
+
+
+class StandIns:
+    """Counts of what was asked of each stand-in."""
+
+    def __init__(self):
+        self.queries: collections.Counter = collections.Counter()
+        self.http: collections.Counter = collections.Counter()
+        self.ldap = 0
+        self.network = 0
+
+
+def _no_network(stand_ins: StandIns):
+    def refuse(*args, **kwargs):
+        stand_ins.network += 1
+        raise OSError('network access is disabled while replaying')
+    return refuse
+
+
+@contextlib.contextmanager
+def stand_ins(tables: Dict[str, List[Dict[str, Any]]]) -> Iterator[StandIns]:
+    stats = StandIns()
+
+    @contextlib.contextmanager
+    def cursor(**kwargs):
+        yield FakeCursor(tables, stats.queries)
+
+    def http_send(adapter, request, **kwargs):
+        stats.http[requests.utils.urlparse(request.url).hostname] += 1
+        response = requests.Response()
+        response.status_code = 404
+        response.url = request.url
+        response.request = request
+        response._content = b''
+        return response
+
+    @contextlib.contextmanager
+    def ldap_connection(*args, **kwargs):
+        stats.ldap += 1
+        yield FakeLdapConnection()
+
+    refuse = _no_network(stats)
+    with contextlib.ExitStack() as stack:
+        cache_dir = stack.enter_context(tempfile.TemporaryDirectory())
+        for target, attribute, replacement in (
+            (db, 'cursor', cursor),
+            (db, 'warm_up', lambda **kwargs: None),
+            (files, 'CACHE_DIR', cache_dir),
+            (markov, 'RUN_IN_PROCESS', False),
+            (requests.adapters.HTTPAdapter, 'send', http_send),
+            (ldap, 'ldap_connection', ldap_connection),
+            (socket.socket, 'connect', refuse),
+            (socket.socket, 'connect_ex', refuse),
+            (socket.socket, 'sendto', refuse),
+            (socket, 'getaddrinfo', refuse),
+        ):
+            stack.enter_context(mock.patch.object(target, attribute, replacement))
+        yield stats
+
+
+class ReplayBot(CreateBot):
+    """A CreateBot that runs listeners inline, measuring each one."""
+
+    def __init__(self, measure_allocations: bool):
+        self.measure_allocations = measure_allocations
+        self.stats: Dict[str, ListenerStats] = collections.defaultdict(ListenerStats)
+        self.failed_plugins: Dict[str, str] = {}
+        self.threads: List[str] = []
+        self.errors: List[str] = []
+        super().__init__(
+            celery_conf={'broker': '', 'backend': ''},
+            nickserv_password='',
+            rt_password='',
+            weather_apikey='',
+            mysql_password='',
+            googlesearch_key='',
+            googlesearch_cx='',
+            kanboard_apikey='',
+            twitter_apikeys=('', ''),
+        )
+        self.connection = FakeConnection()
+        self.tasks = FakeTasks()
+        self.outbound.bucket = TokenBucket(UNLIMITED_RATE, UNLIMITED_RATE)
+
+    def register_plugin(self, name, mod):
+        try:
+            super().register_plugin(name, mod)
+        except Exception as ex:
+            self.failed_plugins[name] = f'{type(ex).__name__}: {ex}'
+
+    def start_warmup(self):
+        # Warm up before replaying anything, so it isn't counted against listeners
+        self.warm_up()
+
+    def add_thread(self, func):
+        # Background threads (webserver, celery, timers) aren't replayed
+        self.threads.append(f'{func.__module__}.{func.__name__}')
+
+    def handle_error(self, error_message):
+        self.errors.append(error_message)
+
+    def schedule_listener(self, listener: Listener, msg: MatchedMessage) -> bool:
+        stats = self.stats[f'{listener.plugin_name}.{listener.function_name}']
+        errors = len(self.errors)
+        blocks = sys.getallocatedblocks()
+        if self.measure_allocations:
+            tracemalloc.reset_peak()
+            before, _ = tracemalloc.get_traced_memory()
+        cpu, wall = time.thread_time(), time.perf_counter()
+
+        self.run_listener(listener, msg, msg.respond)
+
+        stats.cpu += time.thread_time() - cpu
+        stats.wall += time.perf_counter() - wall
+        if self.measure_allocations:
+            _, peak = tracemalloc.get_traced_memory()
+            stats.peak_bytes = max(stats.peak_bytes, peak - before)
+        stats.net_blocks += sys.getallocatedblocks() - blocks
+        stats.calls += 1
+        stats.errors += len(self.errors) - errors
+        return True
+
+
+def replay(bot: ReplayBot, events: List[Event]) -> float:
+    """Feed events through the bot, returning how long it took in seconds."""
+    start = time.perf_counter()
+    for event in events:
+        def respond(raw_text, ping=True, event=event):
+            if event.channel.startswith('#') and ping:
+                raw_text = f'{event.nick}: {raw_text}'
+            bot.say(event.channel if event.channel.startswith('#') else event.nick, raw_text)
+
+        bot.handle_chat(
+            raw_text=event.text,
+            user=event.nick,
+            channel=event.channel,
+            is_oper=event.is_oper,
+            is_privileged_channel=event.channel in IRC_CHANNELS_OPER,
+            respond=respond,
+        )
+
+    # Wait for responses to make it out
+    while bot.outbound.depth():
+        time.sleep(0.001)
+    return time.perf_counter() - start
+
+
+def seed_tables(events: List[Event]) -> Dict[str, List[Dict[str, Any]]]:
+    """Fill in the tables that plugins need at startup from the log's own text."""
+    texts = [event.text for event in events if not event.text.startswith(('!', IRC_NICKNAME))]
+    return {
+        'quotes': [{'quote': f'<nick> {text}'} for text in texts],
+        'inspire': [{'text': f'{text} -- nick'} for text in texts],
+        'markov_rants': [{'text': text} for text in texts],
+        # Tables that exist, when asked (notify checks for notify_members)
+        'information_schema': [{'count': 1}],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Replay an IRC log through the bot offline, and report how it performed.',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument('log', help='Log to replay (channel, nick, oper, text; tab-separated).')
+    parser.add_argument('-n', '--repeat', type=int, default=1, help='Replay the log this many times.')
+    parser.add_argument(
+        '--recorded-nick', default=RECORDED_NICK,
+        help='Nickname of the bot in the log, so mentions of it can be rewritten.',
+    )
+    parser.add_argument(
+        '--allocations', action='store_true',
+        help='Trace peak memory allocated by each listener (slows everything down).',
+    )
+    parser.add_argument('-v', '--verbose', action='store_true', help='Print listener errors.')
+    args = parser.parse_args()
+
+    events = read_log(args.log, args.recorded_nick)
+    if args.allocations:
+        tracemalloc.start()
+
+    with stand_ins(seed_tables(events)) as stats:
+        start = time.perf_counter()
+        bot = ReplayBot(measure_allocations=args.allocations)
+        startup = time.perf_counter() - start
+        seconds = replay(bot, events * args.repeat)
+
+    num_messages = len(events) * args.repeat
+    listener_wall = sum(s.wall for s in bot.stats.values())
+    print(f'started up in {startup:.2f}s, with {len(bot.listeners)} listeners')
+    for name, error in sorted(bot.failed_plugins.items()):
+        print(f'  plugin {name} failed to register: {error}')
+    print(f'not started: {", ".join(bot.threads)}')
+    print()
+    print(
+        f'{num_messages} messages in {seconds:.3f}s: {num_messages / seconds:.0f} msgs/sec, '
+        f'{(seconds - listener_wall) / num_messages * 1e6:.1f}µs/msg outside listeners',
+    )
+    print(f'sent: {dict(bot.connection.sent)}')
+    print(f'queries: {dict(stats.queries)}')
+    print(f'http requests: {dict(stats.http)}, ldap connections: {stats.ldap}')
+    print(f'celery tasks: {dict(bot.tasks.calls)}, other network access refused: {stats.network}')
+    print()
+
+    print(
+        f'{"listener":<40} {"calls":>6} {"errors":>6} {"cpu ms":>9} {"µs/call":>9} '
+        f'{"peak KiB":>9} {"net blocks":>10}',
+    )
+    for name, s in sorted(bot.stats.items(), key=lambda item: -item[1].cpu):
+        print(
+            f'{name:<40} {s.calls:>6} {s.errors:>6} {s.cpu * 1e3:>9.2f} '
+            f'{s.cpu / s.calls * 1e6:>9.1f} '
+            f'{s.peak_bytes / 1024 if args.allocations else float("nan"):>9.1f} {s.net_blocks:>10}',
+        )
+
+    if args.verbose:
+        for error in bot.errors:
+            print(error)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""Compare message splitting in MessageCodec with the old split_utf8 generator.
+
+Run from the root of the repo:
+
+    python -m benchmarks.split_message
+"""
+import random
+import timeit
+
+from ircbot.codec import can_split_before
+from ircbot.codec import MessageCodec
+from ircbot.ircbot import IRC_NICKNAME
+from ircbot.ircbot import MAX_CLIENT_MSG
+
+TARGET = '#rebuild'
+NUM_MESSAGES = 500
+
+WORDS = (
+    'the', 'quick', 'brown', 'fox', 'https://www.ocf.berkeley.edu/docs/staff/procedures/',
+    'dns', 'wörd', 'naïve', 'café', '日本語のテキスト', 'emoji', '👩‍💻', '👍🏽', '🇺🇸',
+    '\x0304red\x0f', 'é', '中文',
+)
+
+
+# What CreateBot.say used to do
+def old_say(channel, message):
+    msg_len = len(f'PRIVMSG {channel} :{message}\r\n'.encode())
+    if msg_len > MAX_CLIENT_MSG:
+        return list(split_utf8(message.encode('utf-8'), MAX_CLIENT_MSG))
+    else:
+        return [message]
+
+
+def split_utf8(s, n):
+    while len(s) > n:
+        k = n
+        while (s[k] & 0xc0) == 0x80:
+            k -= 1
+
+        yield s[:k].decode('utf-8')
+        s = s[k:]
+    yield s.decode('utf-8')
+
+
+def new_say(codec, channel, message):
+    command = f'PRIVMSG {channel} :'
+    return [line[len(command):] for group in codec.encode(channel, message) for line in group]
+
+
+def make_messages():
+    rand = random.Random(0)
+    return [
+        ' '.join(rand.choice(WORDS) for _ in range(rand.randint(5, 300)))
+        for _ in range(NUM_MESSAGES)
+    ]
+
+
+def damage(message, chunks):
+    """Count words and characters broken across chunks."""
+    broken_words = broken_chars = 0
+    offset = 0
+    for chunk in chunks[:-1]:
+        offset = message.index(chunk, offset) + len(chunk)
+        if offset < len(message) and message[offset - 1] != ' ' and message[offset] != ' ':
+            broken_words += 1
+            if not can_split_before(message, offset):
+                broken_chars += 1
+    return broken_words, broken_chars
+
+
+def report(name, split, messages):
+    seconds = min(timeit.repeat(lambda: [split(m) for m in messages], number=5, repeat=3)) / 5
+    lines = bytes_sent = broken_words = broken_chars = too_long = 0
+    for message in messages:
+        chunks = split(message)
+        lines += len(chunks)
+        for chunk in chunks:
+            size = len(f'PRIVMSG {TARGET} :{chunk}\r\n'.encode())
+            bytes_sent += size
+            too_long += size > MAX_CLIENT_MSG
+        words, chars = damage(message, chunks)
+        broken_words += words
+        broken_chars += chars
+
+    print(
+        f'{name:<12} {seconds / len(messages) * 1e6:>10.1f} {lines:>7} {bytes_sent:>9} '
+        f'{broken_words:>12} {broken_chars:>13} {too_long:>9}',
+    )
+
+
+def main():
+    messages = make_messages()
+    codec = MessageCodec(IRC_NICKNAME, MAX_CLIENT_MSG)
+    print(f'{NUM_MESSAGES} messages to {TARGET}, {sum(len(m.encode()) for m in messages)} bytes total\n')
+    print(
+        f'{"":<12} {"µs/msg":>10} {"lines":>7} {"bytes":>9} '
+        f'{"broken words":>12} {"broken chars":>13} {"too long":>9}',
+    )
+    report('split_utf8', lambda message: old_say(TARGET, message), messages)
+    report('codec', lambda message: new_say(codec, TARGET, message), messages)
+
+
+if __name__ == '__main__':
+    main()
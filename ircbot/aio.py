@@ -0,0 +1,143 @@
+"""An asyncio-based bot core, which can also run `async def` listeners.
+
+Listeners written as coroutines run directly on the event loop, so lots of
+slow network lookups can be in flight at once without a thread for each.
+Ordinary listeners still run on the worker pool like they do with CreateBot.
+"""
+import asyncio
+import ssl
+import time
+from typing import Set
+
+import irc.client
+import irc.connection
+from irc.client_aio import AioConnection
+from irc.client_aio import AioReactor
+
+from ircbot.ircbot import CreateBot
+from ircbot.ircbot import Listener
+from ircbot.ircbot import MatchedMessage
+
+
+def _on_loop(loop) -> bool:
+    try:
+        return asyncio.get_running_loop() is loop
+    except RuntimeError:
+        return False
+
+
+class LoopScheduler:
+    """Just enough of irc.schedule.IScheduler to run on an event loop.
+
+    AioReactor doesn't come with a scheduler, but SingleServerIRCBot's
+    reconnect strategy needs one.
+    """
+
+    def __init__(self, loop):
+        self.loop = loop
+
+    def execute_after(self, delay, func):
+        self.loop.call_soon_threadsafe(self.loop.call_later, delay, func)
+
+    def execute_every(self, period, func):
+        def run():
+            func()
+            self.loop.call_later(period, run)
+        self.execute_after(period, run)
+
+    def run_pending(self):
+        pass
+
+
+class BotConnection(AioConnection):
+
+    def send_raw(self, string):
+        # asyncio transports aren't thread-safe, but plugins send messages
+        # from worker threads, so hand those over to the event loop.
+        if _on_loop(self.reactor.loop):
+            super().send_raw(string)
+        else:
+            self.reactor.loop.call_soon_threadsafe(super().send_raw, string)
+
+
+class BotReactor(AioReactor):
+    connection_class = BotConnection
+
+    def __init__(self):
+        super().__init__(loop=asyncio.new_event_loop())
+        self.scheduler = LoopScheduler(self.loop)
+
+
+class AsyncCreateBot(CreateBot):
+    reactor_class = BotReactor
+
+    def __init__(self, *args, **kwargs):
+        # Keep references to running listeners, the event loop only keeps weak ones
+        self.listener_tasks: Set[asyncio.Task] = set()
+        super().__init__(*args, **kwargs)
+
+    def connect_factory(self):
+        # Same (lack of) certificate checking as ssl.wrap_socket in CreateBot
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE
+        return irc.connection.AioFactory(ssl=context)
+
+    def connect(self, *args, **kwargs):
+        """Connect from the event loop, instead of blocking until connected."""
+        self.reactor.loop.call_soon_threadsafe(self.spawn, self.connect_async(*args, **kwargs))
+
+    async def connect_async(self, *args, **kwargs):
+        try:
+            await self.connection.connect(*args, **kwargs)
+        except OSError:
+            # Let the reconnect strategy try again, like SingleServerIRCBot does
+            self.connection._handle_event(
+                irc.client.Event('disconnect', self.connection.server, '', ['']),
+            )
+
+    def spawn(self, coro):
+        task = self.reactor.loop.create_task(coro)
+        self.listener_tasks.add(task)
+        task.add_done_callback(self.listener_tasks.discard)
+
+    def schedule_listener(self, listener: Listener, msg: MatchedMessage) -> bool:
+        if not listener.is_async:
+            return super().schedule_listener(listener, msg)
+
+        # Share the worker pool's orderer so responses in a channel stay in
+        # order no matter which kind of listener sends them.
+        orderer = self.executor.orderer
+        ticket = orderer.ticket(msg.channel)
+
+        async def run():
+            try:
+                await self.run_listener_async(
+                    listener,
+                    msg._replace(respond=orderer.wrap(msg.channel, ticket, msg.respond)),
+                )
+            finally:
+                orderer.finish(msg.channel, ticket)
+
+        self.spawn(run())
+        return True
+
+    async def run_listener_async(self, listener: Listener, msg: MatchedMessage):
+        start = time.perf_counter()
+        try:
+            await listener.fn(self, msg)
+        except Exception as ex:
+            self.listener_failed(listener, msg, ex)
+        finally:
+            self.metrics.observe(
+                'ircbot_listener_latency_seconds',
+                time.perf_counter() - start,
+                labels=listener.metric_labels,
+            )
+
+    def run_coroutine(self, coro):
+        """Run an `async def` listener on the bot's event loop and wait for it.
+
+        This must be called from a worker thread, not the event loop itself.
+        """
+        return asyncio.run_coroutine_threadsafe(coro, self.reactor.loop).result()
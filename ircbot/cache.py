@@ -0,0 +1,197 @@
+"""Caches for plugins' lookups of slow or rate-limited things.
+
+Each cache is a namespace with its own TTL and size, shared by everything
+using that name. Lookups that find nothing (None) can be cached too, for a
+different (usually shorter) time. If a key is being looked up when another
+thread asks for it, that thread waits for the same lookup instead of
+starting its own, so ten people asking the same thing at once cause one
+request upstream.
+
+    tweets = cache.namespace('twitter', ttl=10 * 60, negative_ttl=60)
+    tweet = tweets.get(status_id, lambda: fetch_tweet(status_id))
+
+or, for a function whose arguments are the key:
+
+    @cache.cached('kanboard', ttl=5 * 60)
+    def task(number): ...
+"""
+import collections
+import functools
+import threading
+import time
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import Hashable
+from typing import Optional
+from typing import Tuple
+
+# Entries kept in a namespace unless it says otherwise. Past this, the least
+# recently used are thrown away. This counts entries, not bytes, so it's only
+# a bound on memory because the values are small: a line of preview text, or
+# a few fields. Don't cache big things (whole API responses, lists of search
+# results) without boiling them down first, or a much smaller max_size.
+DEFAULT_MAX_SIZE = 256
+
+
+class _Flight:
+    """A lookup in progress, which other threads asking for the same key wait for."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class Cache:
+    """Values by key, kept for ttl seconds (or negative_ttl, if they're None).
+
+    :param max_size: Most entries to keep (however big they are).
+    :param negative_ttl: How long to remember that there's nothing for a
+                         key. 0 means not to.
+    """
+
+    def __init__(self, name: str, ttl: float, negative_ttl: float = 0, max_size: int = DEFAULT_MAX_SIZE):
+        self.name = name
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        # Values with when they expire, least recently used first
+        self.entries: 'collections.OrderedDict[Hashable, Tuple[float, Any]]' = collections.OrderedDict()
+        self.flights: Dict[Hashable, _Flight] = {}
+        # Totals, for metrics
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def _lookup(self, key: Hashable) -> Tuple[bool, Any]:
+        """Return whether key is cached, and its value (with lock held)."""
+        entry = self.entries.get(key)
+        if entry is None:
+            return False, None
+        if entry[0] <= time.monotonic():
+            del self.entries[key]
+            return False, None
+        self.entries.move_to_end(key)
+        return True, entry[1]
+
+    def peek(self, key: Hashable) -> Tuple[bool, Any]:
+        """Return whether key is cached, and its value, without looking it up."""
+        with self.lock:
+            found, value = self._lookup(key)
+            if found:
+                self.hits += 1
+            else:
+                self.misses += 1
+            return found, value
+
+    def put(self, key: Hashable, value: Any):
+        with self.lock:
+            self._put(key, value)
+
+    def _put(self, key: Hashable, value: Any):
+        """Cache value for key (with lock held)."""
+        ttl = self.ttl if value is not None else self.negative_ttl
+        if ttl <= 0:
+            return
+        self.entries[key] = (time.monotonic() + ttl, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def get(self, key: Hashable, fetch: Callable[[], Any]) -> Any:
+        """Return the value for key, calling fetch to look it up if it isn't cached.
+
+        If fetch raises an exception, it's raised to everyone waiting on it,
+        and nothing is cached. If the key is invalidated while fetch is
+        running, what it returns isn't cached either, since it might be
+        from before whatever made the key stale.
+        """
+        with self.lock:
+            found, value = self._lookup(key)
+            if found:
+                self.hits += 1
+                return value
+            flight = self.flights.get(key)
+            leader = flight is None
+            if flight is None:
+                flight = self.flights[key] = _Flight()
+                self.misses += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        try:
+            flight.value = fetch()
+            with self.lock:
+                if self.flights.get(key) is flight:
+                    self._put(key, flight.value)
+            return flight.value
+        except BaseException as ex:
+            flight.error = ex
+            raise
+        finally:
+            with self.lock:
+                if self.flights.get(key) is flight:
+                    del self.flights[key]
+            flight.done.set()
+
+    def invalidate(self, key: Hashable):
+        """Forget key, including whatever a lookup of it that's already running finds."""
+        with self.lock:
+            self.entries.pop(key, None)
+            # Later calls start a new lookup, rather than wait on this one
+            self.flights.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.flights.clear()
+
+    def stats(self) -> Dict[str, int]:
+        with self.lock:
+            return {
+                'entries': len(self.entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'coalesced': self.coalesced,
+            }
+
+
+_caches: Dict[str, Cache] = {}
+_caches_lock = threading.Lock()
+
+
+def namespace(name: str, ttl: float, negative_ttl: float = 0, max_size: int = DEFAULT_MAX_SIZE) -> Cache:
+    """Return the cache called name, creating it with these settings if it doesn't exist."""
+    with _caches_lock:
+        if name not in _caches:
+            _caches[name] = Cache(name, ttl=ttl, negative_ttl=negative_ttl, max_size=max_size)
+        return _caches[name]
+
+
+def caches() -> Dict[str, Cache]:
+    with _caches_lock:
+        return dict(_caches)
+
+
+def cached(name: str, ttl: float, negative_ttl: float = 0, max_size: int = DEFAULT_MAX_SIZE):
+    """Cache what a function returns, by its arguments."""
+    cache = namespace(name, ttl=ttl, negative_ttl=negative_ttl, max_size=max_size)
+
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            key = (args, tuple(sorted(kwargs.items())))
+            return cache.get(key, lambda: fn(*args, **kwargs))
+
+        wrapper.cache = cache  # type: ignore
+        return wrapper
+
+    return decorator
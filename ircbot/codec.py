@@ -0,0 +1,212 @@
+"""Turn messages into IRC lines that fit within the protocol's length limits."""
+import itertools
+import re
+import unicodedata
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+# RFC 2812 limits lines (including the sender's prefix the server adds when
+# relaying them, and the trailing CRLF) to 512 bytes
+MAX_LINE_BYTES = 512
+
+# Longest hostname we're likely to be given, used until we've seen our own
+MAX_HOST_LENGTH = 63
+
+# Tags added to lines in a multiline batch, with room for the batch reference
+BATCH_TAGS_LENGTH = len('@batch=ml0000000000;draft/multiline-concat ')
+
+# IRC color codes, which shouldn't be split up
+COLOR_CODE = re.compile(r'\x03\d{1,2}(?:,\d{1,2})?')
+
+
+def parse_caps(caps: str) -> Dict[str, str]:
+    """Parse a CAP LS reply like 'batch draft/multiline=max-bytes=4096'."""
+    parsed = {}
+    for cap in caps.split():
+        name, _, value = cap.partition('=')
+        parsed[name] = value
+    return parsed
+
+
+def _attaches_to_previous(c: str) -> bool:
+    """Whether c is part of the same grapheme cluster as the character before it."""
+    return (
+        unicodedata.category(c) in ('Mn', 'Mc', 'Me') or
+        c == '\u200d' or  # zero width joiner
+        '\ufe00' <= c <= '\ufe0f' or  # variation selectors
+        '\U0001f3fb' <= c <= '\U0001f3ff' or  # emoji skin tone modifiers
+        '\U000e0020' <= c <= '\U000e007f'  # emoji tag sequences
+    )
+
+
+def _is_regional_indicator(c: str) -> bool:
+    return '\U0001f1e6' <= c <= '\U0001f1ff'
+
+
+def can_split_before(text: str, i: int) -> bool:
+    """Whether splitting text before index i keeps characters intact.
+
+    This is an approximation of Unicode grapheme cluster boundaries (good
+    enough for accents, emoji sequences, and flags) that also avoids
+    splitting IRC color codes.
+    """
+    if i <= 0 or i >= len(text):
+        return True
+    if _attaches_to_previous(text[i]) or text[i - 1] == '\u200d':
+        return False
+    if _is_regional_indicator(text[i]) and _is_regional_indicator(text[i - 1]):
+        # Flags are pairs of regional indicators, only split between pairs
+        run = 0
+        while i - run - 1 >= 0 and _is_regional_indicator(text[i - run - 1]):
+            run += 1
+        if run % 2 == 1:
+            return False
+    color_start = text.rfind('\x03', max(0, i - 5), i)
+    if color_start != -1:
+        color = COLOR_CODE.match(text, color_start)
+        if color is not None and color.end() > i:
+            return False
+    return True
+
+
+def split_message(text: str, budget: int, keep_spaces: bool = False) -> List[str]:
+    """Split text into chunks of at most budget bytes when UTF-8 encoded.
+
+    Chunks are split at spaces where possible, otherwise at the last
+    character boundary that fits. The space a chunk is split at is dropped,
+    unless keep_spaces is set, in which case it's kept at the end of the
+    chunk so that joining the chunks gives back the original text.
+    """
+    # Work on the encoded text, so it only needs to be encoded once. Spaces
+    # are never part of a multibyte character, so it's safe to search for them.
+    data = text.encode()
+    chunks = []
+    start = 0
+    while len(data) - start > budget:
+        # All continuation bytes for utf-8 codepoints are between 0x80 and 0xBF
+        end = start + budget
+        while data[end] & 0xc0 == 0x80:
+            end -= 1
+
+        space = data.rfind(b' ', start + 1, end if keep_spaces else end + 1)
+        if space != -1:
+            chunks.append(data[start:space + 1 if keep_spaces else space].decode())
+            start = space + 1
+            continue
+
+        # No spaces to split at, so split at a character boundary instead
+        chunk = data[start:end].decode()
+        window = chunk + data[end:end + 4].decode(errors='ignore')[:1]
+        split = len(chunk)
+        while split > 1 and not can_split_before(window, split):
+            split -= 1
+        if split == 1 and not can_split_before(window, split):
+            # A single enormous grapheme cluster, just chop it up
+            split = len(chunk)
+        chunks.append(chunk[:split])
+        start += len(chunk[:split].encode())
+
+    chunks.append(data[start:].decode())
+    return chunks
+
+
+class MessageCodec:
+    """Encode messages into the raw IRC lines needed to send them.
+
+    :param nickname: The bot's nickname, used to estimate how long the
+                     prefix added by the server is.
+    :param max_line_length: The longest line to send, in bytes, including
+                            the command and CRLF.
+    """
+
+    def __init__(self, nickname: str, max_line_length: int):
+        self.max_line_length = max_line_length
+        self.prefix_length = len(f':{nickname}!~{nickname}@ ') + MAX_HOST_LENGTH
+        # (max-bytes, max-lines) if the server supports draft/multiline
+        self.multiline: Optional[Tuple[int, int]] = None
+        self.batch_ids = itertools.count()
+        self.budgets: Dict[str, int] = {}
+
+    def set_prefix(self, prefix: str):
+        """Set the prefix (nick!user@host) the server is relaying our messages with."""
+        self.prefix_length = len(f':{prefix} ')
+        self.budgets = {}
+
+    def enable_multiline(self, value: str):
+        """Start sending multiline batches, with limits from the draft/multiline cap value."""
+        limits = dict(
+            limit.partition('=')[::2]
+            for limit in value.split(',')
+            if limit
+        )
+        self.multiline = (
+            int(limits.get('max-bytes', MAX_LINE_BYTES)),
+            int(limits.get('max-lines', 0)) or 100,
+        )
+
+    def budget(self, target: str) -> int:
+        """Return how many bytes of text fit in a PRIVMSG to target."""
+        budget = self.budgets.get(target)
+        if budget is None:
+            line_length = min(self.max_line_length, MAX_LINE_BYTES - self.prefix_length)
+            budget = line_length - len(f'PRIVMSG {target} :\r\n'.encode())
+            self.budgets[target] = budget
+        return budget
+
+    def encode(self, target: str, message: str) -> List[List[str]]:
+        """Encode a message as raw IRC lines.
+
+        Returns a list of groups of lines. Each group is either a single
+        PRIVMSG or a whole multiline batch, and should be sent together.
+        """
+        command = f'PRIVMSG {target} :'
+        lines = [line for line in message.replace('\r', '').split('\n') if line]
+
+        if self.multiline is None:
+            return [
+                [command + chunk]
+                for line in lines
+                for chunk in split_message(line, self.budget(target))
+            ]
+
+        # Lines that had to be split get tagged so they're joined back up by
+        # clients that understand multiline batches
+        budget = min(
+            self.budget(target),
+            MAX_LINE_BYTES - BATCH_TAGS_LENGTH - len(f'{command}\r\n'.encode()),
+        )
+        parts = [
+            (chunk, i > 0)
+            for line in lines
+            for i, chunk in enumerate(split_message(line, budget, keep_spaces=True))
+        ]
+
+        max_bytes, max_lines = self.multiline
+        batches: List[List[Tuple[str, bool]]] = []
+        batch_bytes = 0
+        for chunk, concat in parts:
+            size = len(chunk.encode())
+            if not batches or len(batches[-1]) >= max_lines or batch_bytes + size > max_bytes:
+                batches.append([])
+                batch_bytes = 0
+                # A batch can't start by continuing a line from the last one
+                concat = False
+            batches[-1].append((chunk, concat))
+            batch_bytes += size
+
+        groups = []
+        for batch in batches:
+            if len(batch) == 1:
+                groups.append([command + batch[0][0].rstrip(' ')])
+                continue
+
+            ref = f'ml{next(self.batch_ids)}'
+            group = [f'BATCH +{ref} draft/multiline {target}']
+            for chunk, concat in batch:
+                tags = f'@batch={ref};draft/multiline-concat' if concat else f'@batch={ref}'
+                group.append(f'{tags} {command}{chunk}')
+            group.append(f'BATCH -{ref}')
+            groups.append(group)
+        return groups
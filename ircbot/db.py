@@ -1,21 +1,201 @@
+"""Connections to the ocfircbot MySQL database, kept open between commands.
+
+Connecting means a TCP handshake and logging in, which takes longer than
+most of the queries we run, so connections are pooled. The pool is safe to
+use from any thread.
+"""
+import collections
 import contextlib
+import threading
+import time
+from typing import Callable
+from typing import Deque
+from typing import Dict
+from typing import List
+from typing import Tuple
 
 import pymysql
 
+HOST = 'mysql.ocf.berkeley.edu'
+DATABASE = 'ocfircbot'
+
+# Most connections open at once (per user). Listeners run on up to
+# ircbot.NUM_WORKERS threads, but few of them use the database at once.
+POOL_MAX_SIZE = 8
+
+# Connections opened ahead of time by warm_up
+POOL_MIN_SIZE = 2
+
+# Connections idle for longer than this are closed, rather than risk the
+# server timing them out while they sit in the pool
+IDLE_TIMEOUT_SECONDS = 5 * 60
+
+# How long to wait for a connection when POOL_MAX_SIZE are in use
+CHECKOUT_TIMEOUT_SECONDS = 10
+
+# Errors that mean the connection itself is broken, rather than the query
+CONNECTION_ERRORS = (pymysql.err.OperationalError, pymysql.err.InterfaceError)
+
+
+class ConnectionPool:
+    """Up to max_size connections made by connect, reused most recently used first."""
+
+    def __init__(self, connect: Callable[[], pymysql.connections.Connection], max_size: int, idle_timeout: float):
+        self.connect = connect
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.cond = threading.Condition()
+        # Connections not in use, with when they were last used
+        self.idle: Deque[Tuple[pymysql.connections.Connection, float]] = collections.deque()
+        # Connections open or being opened, in use or not
+        self.size = 0
+        # Totals, for metrics
+        self.opened = 0
+        self.discarded = 0
+
+    def get(self, timeout: float = CHECKOUT_TIMEOUT_SECONDS) -> pymysql.connections.Connection:
+        """Check out a connection that was alive just now, opening one if needed."""
+        deadline = time.monotonic() + timeout
+        while True:
+            conn = None
+            with self.cond:
+                expired = self._expire_idle()
+                while not self.idle and self.size >= self.max_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0 or not self.cond.wait(remaining):
+                        raise pymysql.err.OperationalError('timed out waiting for a database connection')
+                    expired += self._expire_idle()
+                if self.idle:
+                    conn, _ = self.idle.pop()
+                else:
+                    self.size += 1
+            for old in expired:
+                self._close(old)
+
+            if conn is None:
+                try:
+                    conn = self.connect()
+                except BaseException:
+                    self._forget()
+                    raise
+                with self.cond:
+                    self.opened += 1
+                return conn
+
+            try:
+                conn.ping(reconnect=False)
+            except CONNECTION_ERRORS:
+                # It's gone away while idle, so try another one
+                self._close(conn)
+                self._forget()
+                continue
+            return conn
+
+    def put(self, conn: pymysql.connections.Connection, broken: bool = False):
+        """Return a connection to the pool, or close it if it's broken."""
+        if broken:
+            self._close(conn)
+            self._forget()
+            return
+        with self.cond:
+            self.idle.append((conn, time.monotonic()))
+            self.cond.notify()
+
+    def _expire_idle(self):
+        """Take connections that have been idle too long out of the pool (with cond held)."""
+        expired = []
+        cutoff = time.monotonic() - self.idle_timeout
+        # The least recently used are at the left
+        while self.idle and self.idle[0][1] < cutoff:
+            expired.append(self.idle.popleft()[0])
+            self.size -= 1
+            self.discarded += 1
+            self.cond.notify()
+        return expired
+
+    def _forget(self):
+        """Account for a connection that was closed or never opened."""
+        with self.cond:
+            self.size -= 1
+            self.discarded += 1
+            self.cond.notify()
+
+    def _close(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            # It's probably closed already
+            pass
+
+    def fill(self, count: int):
+        """Open connections until there are count idle ones (or the pool is full)."""
+        conns: List[pymysql.connections.Connection] = []
+        try:
+            for _ in range(count):
+                with self.cond:
+                    if len(self.idle) + len(conns) >= count or self.size >= self.max_size:
+                        break
+                conns.append(self.get())
+        finally:
+            for conn in conns:
+                self.put(conn)
+
+    def stats(self) -> Dict[str, int]:
+        with self.cond:
+            return {
+                'open': self.size,
+                'idle': len(self.idle),
+                'opened': self.opened,
+                'discarded': self.discarded,
+            }
+
+
+# One pool for each (user, password)
+_pools: Dict[Tuple[str, str], ConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+
+def pool(*, user='ocfircbot', password) -> ConnectionPool:
+    with _pools_lock:
+        key = (user, password)
+        if key not in _pools:
+            _pools[key] = ConnectionPool(
+                lambda: pymysql.connect(
+                    user=user,
+                    password=password,
+                    db=DATABASE,
+                    host=HOST,
+                    cursorclass=pymysql.cursors.DictCursor,
+                    charset='utf8mb4',
+                    autocommit=True,
+                ),
+                max_size=POOL_MAX_SIZE,
+                idle_timeout=IDLE_TIMEOUT_SECONDS,
+            )
+        return _pools[key]
+
+
+def pools() -> Dict[str, ConnectionPool]:
+    """Return the pools so far, by user."""
+    with _pools_lock:
+        return {user: conn_pool for (user, _), conn_pool in _pools.items()}
+
 
 @contextlib.contextmanager
 def cursor(*, user='ocfircbot', password):
-    conn: pymysql.connections.Connection = pymysql.connect(
-        user=user,
-        password=password,
-        db='ocfircbot',
-        host='mysql.ocf.berkeley.edu',
-        cursorclass=pymysql.cursors.DictCursor,
-        charset='utf8mb4',
-        autocommit=True,
-    )
+    conn_pool = pool(user=user, password=password)
+    conn = conn_pool.get()
+    broken = False
     try:
         with conn.cursor() as cursor:
             yield cursor
+    except CONNECTION_ERRORS:
+        broken = True
+        raise
     finally:
-        conn.close()
+        conn_pool.put(conn, broken=broken)
+
+
+def warm_up(*, user='ocfircbot', password):
+    """Open a few connections ahead of time, so the first commands don't wait."""
+    pool(user=user, password=password).fill(POOL_MIN_SIZE)
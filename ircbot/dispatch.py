@@ -0,0 +1,214 @@
+"""Index listeners by the literal text their patterns require.
+
+Most listener patterns start with (or at least contain) a literal command like
+``!notify`` or ``rt#``, so instead of running every regex against every line
+we bucket listeners by that literal when they are registered and only run the
+regexes of listeners whose literal is actually present in the line.
+"""
+import re
+from typing import Dict
+from typing import Iterable
+from typing import List
+from typing import Optional
+from typing import Pattern
+from typing import Set
+from typing import Tuple
+from typing import TYPE_CHECKING
+
+try:
+    from re import _constants as sre_constants  # type: ignore
+    from re import _parser as sre_parse  # type: ignore
+except ImportError:  # Python < 3.11
+    import sre_constants  # type: ignore
+    import sre_parse  # type: ignore
+
+if TYPE_CHECKING:
+    from ircbot.ircbot import Listener
+
+# Give up on expanding alternations like (a|b)(c|d) past this many literals
+MAX_ALTERNATIVES = 16
+
+# Literals shorter than this aren't worth indexing on
+MIN_LITERAL_LENGTH = 2
+
+
+def _literals(items) -> Tuple[List[str], bool]:
+    """Return the literal strings one of which every match of items starts with.
+
+    The second return value is whether those literals make up the whole
+    match, in which case whatever follows items can be appended to them.
+    """
+    alternatives = ['']
+    for op, av in items:
+        if op is sre_constants.LITERAL:
+            alternatives = [alt + chr(av) for alt in alternatives]
+            continue
+
+        if op is sre_constants.SUBPATTERN:
+            _, add_flags, del_flags, sub = av
+            if add_flags or del_flags:
+                return alternatives, False
+            sub_alternatives, complete = _literals(sub.data)
+        elif op is sre_constants.BRANCH:
+            sub_alternatives = []
+            complete = True
+            for branch in av[1]:
+                branch_alternatives, branch_complete = _literals(branch.data)
+                sub_alternatives.extend(branch_alternatives)
+                complete = complete and branch_complete
+        else:
+            return alternatives, False
+
+        if len(alternatives) * len(sub_alternatives) > MAX_ALTERNATIVES:
+            return alternatives, False
+
+        alternatives = [alt + sub_alt for alt in alternatives for sub_alt in sub_alternatives]
+        if not complete:
+            return alternatives, False
+
+    return alternatives, True
+
+
+def _best_literals(items) -> List[str]:
+    """Find the most selective set of literals that every match must contain."""
+    best: List[str] = []
+    for i in range(len(items)):
+        alternatives, _ = _literals(items[i:])
+        shortest = min(map(len, alternatives))
+        if shortest >= MIN_LITERAL_LENGTH and (not best or shortest > min(map(len, best))):
+            best = alternatives
+    return best
+
+
+def required_literals(pattern: Pattern) -> Tuple[List[str], bool]:
+    """Work out which literals a compiled pattern requires.
+
+    Returns a list of literals (at least one of which is in any text the
+    pattern matches) and whether the pattern is anchored to the start of
+    the text, in which case the text must start with one of them.  An empty
+    list means the pattern is free-form and can't be indexed.
+    """
+    items = sre_parse.parse(pattern.pattern, pattern.flags).data
+    anchored = (
+        not pattern.flags & re.MULTILINE and
+        len(items) > 0 and
+        items[0] == (sre_constants.AT, sre_constants.AT_BEGINNING)
+    )
+    if anchored:
+        prefixes, _ = _literals(items[1:])
+        if min(map(len, prefixes)) >= MIN_LITERAL_LENGTH:
+            return sorted(set(prefixes)), True
+        items = items[1:]
+    return sorted(set(_best_literals(items))), False
+
+
+class LiteralMatcher:
+    """Find which of a set of literals appear in a text, in one regex scan.
+
+    The literals are combined into one alternation, longest first, inside a
+    lookahead so that it's tried at every position. At each position that
+    gives the longest literal starting there, and every other literal
+    starting there is a prefix of that one.
+    """
+
+    def __init__(self, literals: Iterable[str]):
+        literals = sorted(set(literals), key=lambda literal: (-len(literal), literal))
+        self.regex = re.compile('(?=({}))'.format('|'.join(map(re.escape, literals))))
+        self.prefixes = {
+            literal: [other for other in literals if literal.startswith(other)]
+            for literal in literals
+        }
+
+    def find(self, text: str) -> Set[str]:
+        found: Set[str] = set()
+        for match in self.regex.finditer(text):
+            found.update(self.prefixes[match.group(1)])
+        return found
+
+
+class ListenerIndex:
+    """Buckets of listeners keyed by the literal their pattern requires."""
+
+    def __init__(self):
+        # Patterns anchored with ^, keyed by the literal text they start with
+        self.prefixes: Dict[str, List[Listener]] = {}
+        self.prefix_lengths: Set[int] = set()
+        self.prefixes_ignorecase: Dict[str, List[Listener]] = {}
+        self.prefix_lengths_ignorecase: Set[int] = set()
+
+        # Unanchored patterns, keyed by a literal found somewhere in the text
+        self.substrings: Dict[str, List[Listener]] = {}
+        self.substrings_ignorecase: Dict[str, List[Listener]] = {}
+        # Matchers for the keys of those, built when first needed
+        self.matchers: Dict[bool, Optional[LiteralMatcher]] = {}
+
+        # Free-form patterns (shipit, shrug, mystery, ...), always tried
+        self.unindexed: List[Listener] = []
+
+        # Registration order, so dispatch order is stable between runs
+        self.order: Dict[Listener, int] = {}
+
+    def add(self, listener: 'Listener'):
+        self.order.setdefault(listener, len(self.order))
+        literals, anchored = required_literals(listener.pattern)
+        if not literals:
+            self.unindexed.append(listener)
+            return
+
+        ignorecase = bool(listener.pattern.flags & re.IGNORECASE)
+        if ignorecase:
+            if not all(literal.isascii() for literal in literals):
+                self.unindexed.append(listener)
+                return
+            literals = sorted({literal.lower() for literal in literals})
+
+        if anchored:
+            buckets = self.prefixes_ignorecase if ignorecase else self.prefixes
+            lengths = self.prefix_lengths_ignorecase if ignorecase else self.prefix_lengths
+            lengths.update(map(len, literals))
+        else:
+            buckets = self.substrings_ignorecase if ignorecase else self.substrings
+            self.matchers.pop(ignorecase, None)
+
+        for literal in literals:
+            buckets.setdefault(literal, []).append(listener)
+
+    def candidates(self, text: str, lowered: Optional[str] = None) -> List['Listener']:
+        """Return the listeners whose pattern could possibly match text.
+
+        :param lowered: text.lower(), if the caller already has it around.
+        """
+        found: Set[Listener] = set(self.unindexed)
+
+        for length in self.prefix_lengths:
+            found.update(self.prefixes.get(text[:length], ()))
+        for substring in self._find_substrings(text, ignorecase=False):
+            found.update(self.substrings[substring])
+
+        if text.isascii():
+            if lowered is None:
+                lowered = text.lower()
+            for length in self.prefix_lengths_ignorecase:
+                found.update(self.prefixes_ignorecase.get(lowered[:length], ()))
+            for substring in self._find_substrings(lowered, ignorecase=True):
+                found.update(self.substrings_ignorecase[substring])
+        else:
+            # Case-insensitive regexes match some non-ASCII characters against
+            # ASCII ones (e.g. the Kelvin sign against k), which str.lower
+            # doesn't, so don't try to be clever with non-ASCII text.
+            found.update(_flatten(self.prefixes_ignorecase.values()))
+            found.update(_flatten(self.substrings_ignorecase.values()))
+
+        return sorted(found, key=self.order.__getitem__)
+
+    def _find_substrings(self, text: str, ignorecase: bool) -> Set[str]:
+        if ignorecase not in self.matchers:
+            substrings = self.substrings_ignorecase if ignorecase else self.substrings
+            self.matchers[ignorecase] = LiteralMatcher(substrings) if substrings else None
+        matcher = self.matchers[ignorecase]
+        return matcher.find(text) if matcher is not None else set()
+
+
+def _flatten(lists: Iterable[List['Listener']]) -> Iterable['Listener']:
+    for listeners in lists:
+        yield from listeners
@@ -0,0 +1,126 @@
+"""Run listeners on worker threads so slow plugins don't block the IRC connection."""
+import collections
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+from typing import Counter
+from typing import DefaultDict
+from typing import Deque
+from typing import List
+
+
+class _Ticket:
+    """A place in line for responding in a channel."""
+
+    def __init__(self):
+        self.buffered: List[Callable] = []
+        self.done = False
+        # Whether everything before this has been sent, so it can respond
+        # straight away (even after it's done, from a background thread)
+        self.released = False
+
+
+class ResponseOrderer:
+    """Hold back responses in a channel until earlier commands have finished.
+
+    Each command gets a ticket when it is received. A command can respond
+    straight away if every command before it in the channel has finished,
+    otherwise its responses are buffered and sent once they have.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.tickets: DefaultDict[str, Deque[_Ticket]] = collections.defaultdict(collections.deque)
+
+    def ticket(self, channel: str) -> _Ticket:
+        ticket = _Ticket()
+        with self.lock:
+            tickets = self.tickets[channel]
+            tickets.append(ticket)
+            ticket.released = tickets[0] is ticket
+        return ticket
+
+    def wrap(self, channel: str, ticket: _Ticket, respond: Callable) -> Callable:
+        def ordered_respond(*args, **kwargs):
+            with self.lock:
+                if ticket.released:
+                    respond(*args, **kwargs)
+                else:
+                    ticket.buffered.append(functools.partial(respond, *args, **kwargs))
+        return ordered_respond
+
+    def finish(self, channel: str, ticket: _Ticket):
+        with self.lock:
+            ticket.done = True
+            tickets = self.tickets[channel]
+            while tickets and tickets[0].done:
+                tickets.popleft()
+                if tickets:
+                    # The next command in line can now send what it has so far
+                    tickets[0].released = True
+                    for respond in tickets[0].buffered:
+                        respond()
+                    tickets[0].buffered.clear()
+            if not tickets:
+                del self.tickets[channel]
+
+
+class ListenerExecutor:
+    """A bounded thread pool for running listeners.
+
+    :param max_workers: Number of worker threads.
+    :param max_pending: Maximum number of jobs queued or running at once,
+                        past which new jobs are rejected.
+    """
+
+    def __init__(self, max_workers: int, max_pending: int):
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='listener')
+        self.max_pending = max_pending
+        self.orderer = ResponseOrderer()
+
+        self.lock = threading.Lock()
+        self.pending = 0
+        self.running: Counter[str] = collections.Counter()
+        # Jobs held back because their plugin is at its concurrency limit
+        self.waiting: DefaultDict[str, Deque[Callable]] = collections.defaultdict(collections.deque)
+
+    def submit(self, *, plugin: str, limit: int, channel: str, respond: Callable, fn: Callable) -> bool:
+        """Schedule fn to be called with a respond function on a worker thread.
+
+        At most `limit` jobs for the same plugin run at once. Responses are
+        sent to the channel in the order jobs were submitted.
+
+        Returns False (and doesn't run fn) if too many jobs are pending.
+        """
+        with self.lock:
+            if self.pending >= self.max_pending:
+                return False
+            self.pending += 1
+
+            ticket = self.orderer.ticket(channel)
+            job = functools.partial(
+                self._run,
+                plugin,
+                channel,
+                ticket,
+                functools.partial(fn, self.orderer.wrap(channel, ticket, respond)),
+            )
+            if self.running[plugin] < limit:
+                self.running[plugin] += 1
+                self.pool.submit(job)
+            else:
+                self.waiting[plugin].append(job)
+        return True
+
+    def _run(self, plugin: str, channel: str, ticket: _Ticket, fn: Callable):
+        try:
+            fn()
+        finally:
+            self.orderer.finish(channel, ticket)
+            with self.lock:
+                self.pending -= 1
+                if self.waiting[plugin]:
+                    self.pool.submit(self.waiting[plugin].popleft())
+                else:
+                    self.running[plugin] -= 1
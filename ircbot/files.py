@@ -0,0 +1,27 @@
+"""Files the bot keeps between restarts, like caches of slow-to-build data."""
+import os
+import tempfile
+from typing import Union
+
+# Everything in here can be thrown away, it'll just be slower to start up.
+# In production this is a persistent volume (see .transpire.py), so it
+# survives the pod being restarted or moved.
+CACHE_DIR = os.environ.get('IRCBOT_CACHE_DIR', 'cache')
+
+
+def cache_path(name: str) -> str:
+    """Return the path to a file in the cache directory, creating the directory if needed."""
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    return os.path.join(CACHE_DIR, name)
+
+
+def write_atomic(path: str, data: Union[str, bytes]):
+    """Write a file so that readers see either the old contents or the new, never a mix."""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data.encode() if isinstance(data, str) else data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 """IRC bot for doing stupid stuff and sometimes handling commands for account creation."""
 import argparse
+import asyncio
 import collections
 import functools
 import getpass
@@ -9,6 +10,7 @@ import pkgutil
 import re
 import ssl
 import threading
+import time
 from configparser import ConfigParser
 from importlib.abc import PathEntryFinder
 from textwrap import dedent
@@ -19,6 +21,8 @@ from typing import Any
 from typing import Callable
 from typing import DefaultDict
 from typing import Dict
+from typing import Iterable
+from typing import List
 from typing import Match
 from typing import NamedTuple
 from typing import Pattern
@@ -29,6 +33,20 @@ import irc.connection
 from irc.client import NickMask
 from ocflib.misc.mail import send_problem_report
 
+from ircbot import cache
+from ircbot import db
+from ircbot import web
+from ircbot.codec import MessageCodec
+from ircbot.codec import parse_caps
+from ircbot.dispatch import ListenerIndex
+from ircbot.executor import ListenerExecutor
+from ircbot.metrics import Metrics
+from ircbot.metrics import Sample
+from ircbot.outbound import OutboundQueue
+from ircbot.outbound import PRIORITY_HIGH
+from ircbot.outbound import PRIORITY_NORMAL
+from ircbot.unfurl import UnfurlStage
+
 IRC_HOST = 'irc'
 IRC_PORT = 6697
 
@@ -46,14 +64,35 @@ else:
     IRC_CHANNELS_OPER = IRC_CHANNELS_ANNOUNCE = frozenset(('#' + user,))
     IRC_CHANNELS_JOIN_MYSQL = False
 
+# Messages starting with one of these are addressed to the bot
+IRC_MENTION_PREFIXES = (IRC_NICKNAME.lower() + ' ', IRC_NICKNAME.lower() + ': ')
+
 NUM_RECENT_MESSAGES = 10
 
+# Listeners run on a pool of worker threads, so that slow plugins don't hold
+# up the IRC connection (and every other channel) while they run.
+NUM_WORKERS = 16
+MAX_PENDING_JOBS = 200
+MAX_JOBS_PER_PLUGIN = 4
+
+# Outgoing messages are rate limited with a token bucket: up to SEND_BURST
+# lines go out at once, after which we send SEND_RATE lines per second.
+SEND_RATE = 2
+SEND_BURST = 10
+
 # 512 bytes is the max message length set by RFC 2812 on the max single message
 # length, so messages need to split up into at least sections of that size,
 # however clients (hexchat at least) appear to start cutting off less than that
 # amount of text, so cut into small blocks to avoid that.
 MAX_CLIENT_MSG = 435
 
+# How many of the slowest plugins to list when reporting startup times
+NUM_SLOW_PLUGINS = 5
+
+# IRCv3 capabilities we need to send a long response as one multiline message
+# (the lines in a batch are tagged, so message-tags is needed too)
+IRC_MULTILINE_CAPS = ('batch', 'draft/multiline', 'message-tags')
+
 
 class Listener(NamedTuple):
     pattern: Pattern
@@ -77,6 +116,24 @@ class Listener(NamedTuple):
         else:
             return self.fn.__module__
 
+    @property
+    def function_name(self) -> str:
+        if isinstance(self.fn, functools.partial):
+            return self.fn.func.__name__
+        else:
+            return self.fn.__name__
+
+    @property
+    def metric_labels(self) -> Dict[str, str]:
+        return {'plugin': self.plugin_name, 'function': self.function_name}
+
+    @property
+    def is_async(self) -> bool:
+        if isinstance(self.fn, functools.partial):
+            return asyncio.iscoroutinefunction(self.fn.func)
+        else:
+            return asyncio.iscoroutinefunction(self.fn)
+
 
 class MatchedMessage(NamedTuple):
     """A message matching a listener.
@@ -113,6 +170,7 @@ class CreateBot(irc.bot.SingleServerIRCBot):
             googlesearch_cx,
             kanboard_apikey,
             twitter_apikeys,
+            github_token=None,
     ):
         self.recent_messages: DefaultDict[str, Any] = collections.defaultdict(
             functools.partial(collections.deque, maxlen=NUM_RECENT_MESSAGES),
@@ -128,31 +186,190 @@ class CreateBot(irc.bot.SingleServerIRCBot):
         self.googlesearch_cx = googlesearch_cx
         self.kanboard_apikey = kanboard_apikey
         self.twitter_apikeys = twitter_apikeys
+        # Optional, but without it we only get 60 GitHub API requests an hour
+        self.github_token = github_token
         self.listeners: Set[Listener] = set()
+        # Listeners indexed by the literal text they look for, split by
+        # whether they match against the text after the bot's nickname
+        self.listener_index = ListenerIndex()
+        self.mention_listener_index = ListenerIndex()
         self.plugins: Dict[str, ModuleType] = {}
+        # Link and reference previews, run together for each message
+        self.unfurls = UnfurlStage()
+        # Slow plugin setup, run in the background once plugins are registered
+        self.warmups: List[Callable] = []
+        self.executor = ListenerExecutor(max_workers=NUM_WORKERS, max_pending=MAX_PENDING_JOBS)
         self.extra_channels: Set[str] = set()  # plugins can add stuff here
+        self.server_caps: Dict[str, str] = {}
+        self.acked_caps: Set[str] = set()
+        self.codec = MessageCodec(IRC_NICKNAME, MAX_CLIENT_MSG)
+        self.outbound = OutboundQueue(self.send_lines, rate=SEND_RATE, burst=SEND_BURST)
+        self.outbound.start()
+        self.metrics = Metrics()
+        self.describe_metrics()
+
+        # Some plugins use the database as they register, and after joining
+        # the server anything could, so connect to it first.
+        self.warm_up_db()
 
         # Register plugins before joining the server.
         self.register_plugins()
+        self.start_warmup()
 
-        factory = irc.connection.Factory(wrapper=ssl.wrap_socket)
         super().__init__(
             [(IRC_HOST, IRC_PORT)],
             IRC_NICKNAME,
             IRC_NICKNAME,
-            connect_factory=factory,
+            connect_factory=self.connect_factory(),
+        )
+
+    def describe_metrics(self):
+        describe = self.metrics.describe
+        describe('ircbot_messages_received_total', 'counter', 'Chat messages received, by channel')
+        describe('ircbot_listener_matches_total', 'counter', 'Messages matched by each listener')
+        describe(
+            'ircbot_listener_regex_seconds_total', 'counter',
+            'Time spent matching messages against each listener pattern',
         )
+        describe('ircbot_listener_latency_seconds', 'summary', 'Time taken to run each listener')
+        describe('ircbot_listener_exceptions_total', 'counter', 'Exceptions raised by each listener')
+        describe('ircbot_listener_rejected_total', 'counter', 'Matches dropped because too many jobs were pending')
+        describe('ircbot_jobs_pending', 'gauge', 'Listener jobs queued or running')
+        describe('ircbot_jobs_waiting', 'gauge', 'Jobs held back by their plugin concurrency limit, by plugin')
+        describe('ircbot_outbound_queue_depth', 'gauge', 'Messages waiting to be sent, by channel (or private)')
+        describe('ircbot_outbound_lag_seconds', 'gauge', 'How long the oldest waiting message has waited')
+        describe('ircbot_outbound_last_lag_seconds', 'gauge', 'How long the last message sent spent queued')
+        describe('ircbot_outbound_sent_total', 'counter', 'Messages sent, by channel (or private)')
+        describe('ircbot_thread_starts_total', 'counter', 'Plugin threads started')
+        describe('ircbot_thread_exceptions_total', 'counter', 'Exceptions that stopped plugin threads')
+        describe('ircbot_plugin_load_seconds', 'gauge', 'Time taken to import and register each plugin')
+        describe('ircbot_warmup_seconds', 'gauge', 'Time taken by each warm-up task')
+        describe('ircbot_db_connections', 'gauge', 'Database connections open, and how many of them are idle')
+        describe('ircbot_db_connections_opened_total', 'counter', 'Database connections opened')
+        describe('ircbot_db_connections_discarded_total', 'counter', 'Database connections closed or failed to open')
+        describe('ircbot_http_requests_in_flight', 'gauge', 'HTTP requests made by plugins and not yet finished')
+        describe('ircbot_http_requests_total', 'counter', 'HTTP requests made by plugins, by host and status class')
+        describe('ircbot_http_request_seconds_total', 'counter', 'Time spent on HTTP requests by plugins, by host')
+        describe('ircbot_unfurls_total', 'counter', 'References found by each unfurler, by what became of them')
+        describe('ircbot_cache_entries', 'gauge', 'Entries in each plugin cache')
+        describe(
+            'ircbot_cache_requests_total', 'counter',
+            'Plugin cache lookups, by whether they hit, missed, or waited on a lookup already running',
+        )
+        self.metrics.add_collector(self.collect_metrics)
+
+    def collect_metrics(self) -> Iterable[Sample]:
+        with self.executor.lock:
+            yield 'ircbot_jobs_pending', {}, self.executor.pending
+            waiting = {plugin: len(jobs) for plugin, jobs in self.executor.waiting.items()}
+        for plugin, count in waiting.items():
+            yield 'ircbot_jobs_waiting', {'plugin': plugin}, count
+
+        for target, depth in self.outbound.depths().items():
+            yield 'ircbot_outbound_queue_depth', {'target': target}, depth
+        for target, sent in self.outbound.sent_counts().items():
+            yield 'ircbot_outbound_sent_total', {'target': target}, sent
+        yield 'ircbot_outbound_lag_seconds', {}, self.outbound.lag()
+        yield 'ircbot_outbound_last_lag_seconds', {}, self.outbound.last_lag
+
+        for user, pool in db.pools().items():
+            stats = pool.stats()
+            yield 'ircbot_db_connections', {'user': user, 'state': 'open'}, stats['open']
+            yield 'ircbot_db_connections', {'user': user, 'state': 'idle'}, stats['idle']
+            yield 'ircbot_db_connections_opened_total', {'user': user}, stats['opened']
+            yield 'ircbot_db_connections_discarded_total', {'user': user}, stats['discarded']
+
+        yield 'ircbot_http_requests_in_flight', {}, web.in_flight()
+        for host, (outcomes, seconds) in web.host_stats().items():
+            for outcome, count in outcomes.items():
+                yield 'ircbot_http_requests_total', {'host': host, 'outcome': outcome}, count
+            yield 'ircbot_http_request_seconds_total', {'host': host}, seconds
+
+        for name, plugin_cache in cache.caches().items():
+            stats = plugin_cache.stats()
+            yield 'ircbot_cache_entries', {'namespace': name}, stats['entries']
+            for result in ('hits', 'misses', 'coalesced'):
+                yield 'ircbot_cache_requests_total', {'namespace': name, 'result': result}, stats[result]
+
+    def warm_up_db(self):
+        start = time.perf_counter()
+        try:
+            db.warm_up(password=self.mysql_password)
+        except db.CONNECTION_ERRORS as ex:
+            # Carry on, the pool will try again when something needs it
+            print(f'could not connect to the database: {ex}')
+        else:
+            print(f'connected to the database in {time.perf_counter() - start:.2f}s')
+
+    def connect_factory(self):
+        return irc.connection.Factory(wrapper=ssl.wrap_socket)
 
     def register_plugins(self):
+        load_times = {}
         for importer, mod_name, _ in pkgutil.iter_modules(['ircbot/plugin']):
             assert isinstance(importer, PathEntryFinder)
+            start = time.perf_counter()
             loader = importer.find_module(mod_name)
             assert loader is not None
             mod = loader.load_module(mod_name)
-            self.plugins[mod_name] = mod
-            register = getattr(mod, 'register', None)
-            if register is not None:
-                register(self)
+            self.register_plugin(mod_name, mod)
+            load_times[mod_name] = time.perf_counter() - start
+            self.metrics.set('ircbot_plugin_load_seconds', load_times[mod_name], labels={'plugin': mod_name})
+
+        # One listener looks for every kind of reference
+        if self.unfurls.unfurlers:
+            self.listen(self.unfurls.pattern(), self.unfurls.unfurl)
+
+        slowest = sorted(load_times.items(), key=lambda item: item[1], reverse=True)[:NUM_SLOW_PLUGINS]
+        print(
+            f'loaded {len(load_times)} plugins in {sum(load_times.values()):.2f}s, slowest: ' +
+            ', '.join(f'{name} {seconds:.2f}s' for name, seconds in slowest),
+        )
+
+    def register_plugin(self, name: str, mod: ModuleType):
+        self.plugins[name] = mod
+        register = getattr(mod, 'register', None)
+        if register is not None:
+            register(self)
+
+    def add_warmup(self, func):
+        """Run func(bot) in the background once all plugins have registered.
+
+        Use this for slow setup (loading data, building models) so that it
+        doesn't hold up connecting to IRC. Warm-up tasks run one at a time,
+        in the order they were added.
+        """
+        self.warmups.append(func)
+
+    def start_warmup(self):
+        thread = threading.Thread(target=self.warm_up, name='warmup', daemon=True)
+        thread.start()
+
+    def warm_up(self):
+        start = time.perf_counter()
+        for func in self.warmups:
+            name = f'{func.__module__}.{func.__name__}'
+            func_start = time.perf_counter()
+            try:
+                func(self)
+            except Exception as ex:
+                self.handle_error(
+                    dedent(
+                        """
+                    ircbot exception in warm-up {name}: {exception}
+
+                    {traceback}
+                    """,
+                    ).format(
+                        name=name,
+                        exception=ex,
+                        traceback=format_exc(),
+                    ),
+                )
+            seconds = time.perf_counter() - func_start
+            self.metrics.set('ircbot_warmup_seconds', seconds, labels={'task': name})
+            print(f'warm-up {name} took {seconds:.2f}s')
+        print(f'warm-up finished in {time.perf_counter() - start:.2f}s')
 
     def handle_error(self, error_message):
         # for debugging purposes
@@ -172,20 +389,42 @@ class CreateBot(irc.bot.SingleServerIRCBot):
             require_oper=False,
             require_privileged_oper=False,
     ):
-        self.listeners.add(
-            Listener(
-                pattern=re.compile(pattern, flags),
-                fn=fn,
-                help_text=help_text,
-                require_mention=require_mention,
-                require_oper=require_oper,
-                require_privileged_oper=require_privileged_oper,
-            ),
+        listener = Listener(
+            pattern=re.compile(pattern, flags),
+            fn=fn,
+            help_text=help_text,
+            require_mention=require_mention,
+            require_oper=require_oper,
+            require_privileged_oper=require_privileged_oper,
         )
+        if listener in self.listeners:
+            return
+
+        self.listeners.add(listener)
+        if require_mention:
+            self.mention_listener_index.add(listener)
+        else:
+            self.listener_index.add(listener)
+
+    def add_unfurler(self, pattern, fn, flags=0, batch=False, ping=False):
+        """Preview references matching pattern (like links) with fn.
+
+        fn(bot, match) returns the preview to send, or None if there isn't
+        one. Unlike listeners, unfurlers are run together for each message,
+        at most once per reference per channel every few minutes. With
+        batch, fn(bot, matches) gets every match in the message at once, and
+        returns a list of previews.
+        """
+        self.unfurls.add(pattern, fn, flags=flags, batch=batch, ping=ping)
 
     def on_welcome(self, conn, _):
         conn.privmsg('NickServ', f'identify {self.nickserv_password}')
 
+        # See if the server supports multiline messages
+        self.server_caps = {}
+        self.acked_caps = set()
+        conn.cap('LS', '302')
+
         # Join the "main" IRC channels.
         for channel in IRC_CHANNELS_OPER | IRC_CHANNELS_ANNOUNCE | self.extra_channels:
             conn.join(channel)
@@ -201,17 +440,32 @@ class CreateBot(irc.bot.SingleServerIRCBot):
             respond: Callable,
             pretend_mentioned: bool = False,
     ):
-        was_mentioned = raw_text.lower().startswith((IRC_NICKNAME.lower() + ' ', IRC_NICKNAME.lower() + ': '))
-
-        for listener in self.listeners:
-            text = raw_text
-            if listener.require_mention and not pretend_mentioned:
-                if was_mentioned:
-                    # Chop off the bot nickname.
-                    text = text.split(' ', 1)[1]
-                else:
-                    continue
+        self.metrics.inc(
+            'ircbot_messages_received_total',
+            labels={'channel': channel if channel.startswith('#') else 'private'},
+        )
+        lowered = raw_text.lower()
+        was_mentioned = lowered.startswith(IRC_MENTION_PREFIXES)
+
+        # Only try the listeners whose pattern could possibly match
+        candidates = [
+            (listener, raw_text)
+            for listener in self.listener_index.candidates(raw_text, lowered)
+        ]
+        if pretend_mentioned:
+            candidates.extend(
+                (listener, raw_text)
+                for listener in self.mention_listener_index.candidates(raw_text, lowered)
+            )
+        elif was_mentioned:
+            # Chop off the bot nickname.
+            text = raw_text.split(' ', 1)[1]
+            candidates.extend(
+                (listener, text)
+                for listener in self.mention_listener_index.candidates(text)
+            )
 
+        for listener, text in candidates:
             if (
                 (listener.require_oper or listener.require_privileged_oper) and
                 not is_oper
@@ -224,8 +478,15 @@ class CreateBot(irc.bot.SingleServerIRCBot):
             if listener.require_privileged_oper and not is_privileged_channel:
                 continue
 
+            start = time.perf_counter()
             match = listener.pattern.search(text)
+            self.metrics.inc(
+                'ircbot_listener_regex_seconds_total',
+                time.perf_counter() - start,
+                labels=listener.metric_labels,
+            )
             if match is not None:
+                self.metrics.inc('ircbot_listener_matches_total', labels=listener.metric_labels)
                 msg = MatchedMessage(
                     channel=channel,
                     text=text,
@@ -235,46 +496,98 @@ class CreateBot(irc.bot.SingleServerIRCBot):
                     nick=user,
                     respond=respond,
                 )
-                try:
-                    listener.fn(self, msg)
-                except Exception as ex:
-                    error_msg = 'ircbot exception in {module}/{function}: {exception}'.format(
-                        module=listener.fn.__module__,
-                        function=listener.fn.__name__,
-                        exception=ex,
-                    )
-                    msg.respond(error_msg, ping=False)
-                    self.handle_error(
-                        dedent(
-                            """
-                        {error}
-
-                        {traceback}
-
-                        Message:
-                            * Channel: {channel}
-                            * Nick: {nick}
-                            * Oper?: {oper}
-                            * Text: {text}
-                            * Raw text: {raw_text}
-                            * Match groups: {groups}
-                        """,
-                        ).format(
-                            error=error_msg,
-                            traceback=format_exc(),
-                            channel=msg.channel,
-                            nick=msg.nick,
-                            oper=msg.is_oper,
-                            text=msg.text,
-                            raw_text=msg.raw_text,
-                            groups=msg.match.groups(),
-                        ),
-                    )
+                if not self.schedule_listener(listener, msg):
+                    self.metrics.inc('ircbot_listener_rejected_total', labels=listener.metric_labels)
+                    respond('too busy right now, try again in a bit')
 
         # everything gets logged except commands
         if raw_text[0] != '!' or raw_text[:2] == '!!':
             self.recent_messages[channel].appendleft((user, raw_text))
 
+    def plugin_job_limit(self, listener: Listener) -> int:
+        """Return how many of a plugin's listeners can run at once.
+
+        Plugins can set MAX_CONCURRENT_JOBS to lower (or raise) the default.
+        """
+        if listener.fn == self.unfurls.unfurl:
+            return self.unfurls.max_messages
+        plugin = self.plugins.get(listener.plugin_name)
+        return getattr(plugin, 'MAX_CONCURRENT_JOBS', MAX_JOBS_PER_PLUGIN)
+
+    def schedule_listener(self, listener: Listener, msg: MatchedMessage) -> bool:
+        """Arrange for a matched listener to be run.
+
+        Returns False if there are too many listeners waiting to run already.
+        """
+        return self.executor.submit(
+            plugin=listener.plugin_name,
+            limit=self.plugin_job_limit(listener),
+            channel=msg.channel,
+            respond=msg.respond,
+            fn=functools.partial(self.run_listener, listener, msg),
+        )
+
+    def run_listener(self, listener: Listener, msg: MatchedMessage, respond: Callable):
+        """Run a listener on a worker thread, responding in order via respond."""
+        msg = msg._replace(respond=respond)
+        start = time.perf_counter()
+        try:
+            self.call_listener(listener, msg)
+        except Exception as ex:
+            self.listener_failed(listener, msg, ex)
+        finally:
+            self.metrics.observe(
+                'ircbot_listener_latency_seconds',
+                time.perf_counter() - start,
+                labels=listener.metric_labels,
+            )
+
+    def call_listener(self, listener: Listener, msg: MatchedMessage):
+        """Call a listener's function, running it to completion if it's a coroutine."""
+        result = listener.fn(self, msg)
+        if asyncio.iscoroutine(result):
+            self.run_coroutine(result)
+
+    def run_coroutine(self, coro):
+        """Run an `async def` listener from a worker thread and wait for it."""
+        return asyncio.run(coro)
+
+    def listener_failed(self, listener: Listener, msg: MatchedMessage, ex: Exception):
+        """Report an exception raised by a listener. Call from an except block."""
+        self.metrics.inc('ircbot_listener_exceptions_total', labels=listener.metric_labels)
+        error_msg = 'ircbot exception in {module}/{function}: {exception}'.format(
+            module=listener.fn.__module__,
+            function=listener.fn.__name__,
+            exception=ex,
+        )
+        msg.respond(error_msg, ping=False)
+        self.handle_error(
+            dedent(
+                """
+            {error}
+
+            {traceback}
+
+            Message:
+                * Channel: {channel}
+                * Nick: {nick}
+                * Oper?: {oper}
+                * Text: {text}
+                * Raw text: {raw_text}
+                * Match groups: {groups}
+            """,
+            ).format(
+                error=error_msg,
+                traceback=format_exc(),
+                channel=msg.channel,
+                nick=msg.nick,
+                oper=msg.is_oper,
+                text=msg.text,
+                raw_text=msg.raw_text,
+                groups=msg.match.groups(),
+            ),
+        )
+
     def on_pubmsg(self, conn, event):
         if event.target in self.channels:
             user = NickMask(event.source).nick
@@ -323,6 +636,25 @@ class CreateBot(irc.bot.SingleServerIRCBot):
             pretend_mentioned=True,
         )
 
+    def on_cap(self, conn, event):
+        subcommand, *args = event.arguments
+        if subcommand == 'LS':
+            self.server_caps.update(parse_caps(args[-1]))
+            # A '*' means there are more capabilities to come
+            if args[0] != '*' and all(cap in self.server_caps for cap in IRC_MULTILINE_CAPS):
+                conn.cap('REQ', *IRC_MULTILINE_CAPS)
+        elif subcommand == 'ACK':
+            self.acked_caps.update(args[-1].split())
+            # The server either takes all of a REQ or none of it, but don't
+            # start sending batches unless everything they need is on
+            if all(cap in self.acked_caps for cap in IRC_MULTILINE_CAPS):
+                self.codec.enable_multiline(self.server_caps['draft/multiline'])
+
+    def on_join(self, conn, event):
+        # Find out how long the prefix the server relays our messages with is
+        if event.source.nick == conn.get_nickname():
+            self.codec.set_prefix(event.source)
+
     def on_currenttopic(self, connection, event):
         channel, topic = event.arguments
         self.topics[channel] = topic
@@ -338,9 +670,12 @@ class CreateBot(irc.bot.SingleServerIRCBot):
 
     def add_thread(self, func):
         def thread_func():
+            labels = {'plugin': func.__module__, 'function': func.__name__}
+            self.metrics.inc('ircbot_thread_starts_total', labels=labels)
             try:
                 func(self)
             except Exception as ex:
+                self.metrics.inc('ircbot_thread_exceptions_total', labels=labels)
                 error_msg = 'ircbot exception in thread {thread}.{function}: {exception}'.format(
                     thread=func.__module__,
                     function=func.__name__,
@@ -376,32 +711,24 @@ class CreateBot(irc.bot.SingleServerIRCBot):
             if topic != new_topic:
                 self.connection.topic(channel, new_topic=new_topic)
 
-    def say(self, channel, message):
-        # Find the length of the full message
-        msg_len = len(f'PRIVMSG {channel} :{message}\r\n'.encode())
-
-        # The message must be split up if over the length limit
-        if msg_len > MAX_CLIENT_MSG:
-            messages = split_utf8(message.encode('utf-8'), MAX_CLIENT_MSG)
-
-            for msg in messages:
-                self.connection.privmsg(channel, msg)
-        else:
-            self.connection.privmsg(channel, message)
+    def say(self, channel, message, priority=None):
+        """Queue up a message to be sent.
 
+        Messages to the oper and announce channels are sent ahead of
+        everything else, unless a priority is given.
+        """
+        if priority is None:
+            if channel in IRC_CHANNELS_OPER | IRC_CHANNELS_ANNOUNCE:
+                priority = PRIORITY_HIGH
+            else:
+                priority = PRIORITY_NORMAL
 
-# Generator which splits the unicode message string
-def split_utf8(s, n):
-    while len(s) > n:
-        k = n
-        # All continuation bytes for utf-8 codepoints
-        # are between 0x80 and 0xBF
-        while (s[k] & 0xc0) == 0x80:
-            k -= 1
+        for lines in self.codec.encode(channel, message):
+            self.outbound.put(channel, lines, priority)
 
-        yield s[:k].decode('utf-8')
-        s = s[k:]
-    yield s.decode('utf-8')
+    def send_lines(self, target, lines):
+        for line in lines:
+            self.connection.send_raw(line)
 
 
 def main():
@@ -415,6 +742,11 @@ def main():
         default='/etc/ocf-ircbot/ocf-ircbot.conf',
         help='Config file to read from.',
     )
+    parser.add_argument(
+        '--asyncio',
+        action='store_true',
+        help='Run on the asyncio-based bot core, which runs `async def` listeners on its event loop.',
+    )
     args = parser.parse_args()
 
     conf = ConfigParser()
@@ -436,11 +768,17 @@ def main():
         conf.get('twitter', 'apikey'),
         conf.get('twitter', 'apisecret'),
     )
+    github_token = conf.get('github', 'token', fallback=None)
+
+    bot_class = CreateBot
+    if args.asyncio:
+        from ircbot.aio import AsyncCreateBot
+        bot_class = AsyncCreateBot
 
-    bot = CreateBot(
+    bot = bot_class(
         celery_conf, nickserv_password, rt_password,
         weather_apikey, mysql_password, googlesearch_key, googlesearch_cx,
-        kanboard_apikey, twitter_apikeys,
+        kanboard_apikey, twitter_apikeys, github_token,
     )
 
     # Start the bot!
@@ -0,0 +1,588 @@
+"""Build markov models of quotes, and generate sentences from them in a separate process.
+
+Generating a sentence that doesn't repeat a quote too closely can take
+hundreds of milliseconds, which would hold the GIL and slow down the rest
+of the bot. So the model lives in a worker process, which keeps a buffer of
+sentences ready to go and refills it as they're used up.
+"""
+import bisect
+import itertools
+import multiprocessing
+import os
+import queue
+import random
+import re
+import threading
+from array import array
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError
+from traceback import format_exc
+from typing import Any
+from typing import Dict
+from typing import Iterable
+from typing import Iterator
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+import markovify
+from markovify.chain import BEGIN
+from markovify.chain import END
+
+from ircbot import db
+from ircbot import files
+
+# How heavily to weight quotes, rants, and inspirations
+MODEL_WEIGHTS = [2, 2, 0.5]
+
+# The last model built, so it's ready straight away after a restart
+CACHE_FILE = 'turing.json'
+
+# How many sentences to keep ready
+BUFFER_SIZE = 20
+
+# How many times to try for a sentence that doesn't overlap too much with a quote
+SENTENCE_TRIES = 200
+
+# How many different states to try starting from, for sentences about a word
+SEED_STATES = 10
+
+# How often the worker checks for commands when it has nothing else to do
+IDLE_POLL_SECONDS = 1
+
+# Whether to run the worker in its own process, rather than on a thread. The
+# replay harness uses a thread, so that its stand-ins for MySQL apply.
+RUN_IN_PROCESS = True
+
+# What BEGIN and END are numbered in a CompactChain
+BEGIN_ID = 0
+END_ID = 1
+
+
+def insert_space(w):
+    # Put a zero width space in every word to prevent pings.
+    # This is also much simpler than using crazy IRC nick regex.
+    # Put it in the middle of the word since nicks are quoted
+    # using "<@keur>" syntax.  Additionally, remove any -slack at
+    # the end of a nick, to avoid inserting a space like
+    # abcde|-slack (thus pinging abcde).
+    halfway = len(re.sub(r'-slack([^A-Za-z0-9_\-\\\[\]{}^`|]|\Z)', r'\1', w)) // 2
+    return w[:halfway] + '\u2060' + w[halfway:]
+
+
+def deping(sentence):
+    return ' '.join(map(insert_space, sentence.split()))
+
+
+def build_model(db_passwd, model_weights=[1, 1, 1]):
+    """Rebuild the markov model using quotes, inspire, and rants databases as seeds."""
+    with db.cursor(password=db_passwd) as c:
+        # Fetch quote data
+        c.execute('SELECT quote FROM quotes WHERE is_deleted = 0')
+        quotes = c.fetchall()
+
+        # Fetch inspire data
+        c.execute('SELECT text FROM inspire')
+        inspirations = c.fetchall()
+
+        # Fetch iconic FOSS rants
+        c.execute('SELECT text FROM markov_rants')
+        rants = c.fetchall()
+
+    # Normalize the quote data... Get rid of IRC junk
+    clean_quotes = [normalize_quote(d['quote']) for d in quotes]
+
+    # Normalize the inspire data... Just lightly prune authors
+    clean_inspirations = [normalize_inspiration(d['text']) for d in inspirations]
+
+    # Normalize the rant data... just remove ending punctuation
+    clean_rants = [normalize_rant(d['text']) for d in rants]
+
+    # Create the three models, and combine them.
+    # More heavily weight our quotes and rants
+    rants_model = markovify.NewlineText('\n'.join(clean_rants))
+    quotes_model = markovify.NewlineText('\n'.join(clean_quotes))
+    inspire_model = markovify.NewlineText('\n'.join(clean_inspirations))
+    return markovify.combine([quotes_model, rants_model, inspire_model], model_weights)
+
+
+def normalize_quote(q):
+    # Remove timestamps
+    cleaned = re.sub(r'\[?\d{2}:\d{2}(:?:\d{2})?\]?', '', q)
+    # Remove "\\" newline separators
+    cleaned = re.sub(r'\\\s*', '', cleaned)
+    # Trim punctuation from end of quotes
+    cleaned = re.sub(r'(\.|\?|!)$', '', cleaned)
+    return cleaned
+
+
+def normalize_inspiration(q):
+    # Remove fancy en dash or double dash that start author clause
+    cleaned = re.sub('—.*$', '', q)
+    cleaned = re.sub('--.*$', '', cleaned)
+    # Remove "\\" newline separators
+    cleaned = re.sub(r'\\\s', '', cleaned)
+    return cleaned.strip()
+
+
+def normalize_rant(r):
+    # Remove sentence ends because we need the newline model
+    # so this will match up with our other datasets
+    cleaned = re.sub(r'(\.|\?|!)$', '', r)
+    return cleaned.strip()
+
+
+class CompactChain:
+    """A markov chain kept in arrays, rather than dicts keyed by tuples of words.
+
+    It works like markovify.Chain, but every word is numbered, and each state
+    (the last few words) is packed into one integer. The states are kept
+    sorted in an array, and each has a slice of follows (the words that can
+    come next) and cumulative (their running total weights), which is all it
+    takes to pick the next word at random.
+
+    To find the states with a given word in them, there's also a sorted copy
+    of the states for each other position in a state, rotated so that the
+    word in that position comes first. So the states with a word in any
+    position are a range of one of the arrays.
+    """
+
+    def __init__(self, state_size: int, tokens: List[str]):
+        self.state_size = state_size
+        self.token_bits = min(32, 64 // state_size)
+        # Every word, numbered by position, starting with BEGIN and END
+        self.tokens = tokens
+        self.token_ids = {token: i for i, token in enumerate(tokens)}
+        # The words that are the same ignoring case, for seeding sentences
+        self.folded_ids: Dict[str, List[int]] = {}
+        for i, token in enumerate(tokens):
+            self.folded_ids.setdefault(token.casefold(), []).append(i)
+        # The packed states, in order, and where their slices are
+        self.keys = array('Q')
+        self.starts = array('I')
+        self.sizes = array('I')
+        self.follows = array('I')
+        self.cumulative = array('d')
+        # The states rotated left by 1, 2, ... words, in order
+        self.rotations = [array('Q') for _ in range(1, state_size)]
+        # How much of follows and cumulative is no longer used
+        self.unused = 0
+
+    @classmethod
+    def from_model(cls, model: Dict[Tuple[str, ...], Dict[str, float]], state_size: int) -> 'CompactChain':
+        """Convert the dict of dicts from a markovify.Chain."""
+        chain = cls(state_size, [BEGIN, END])
+        states = [
+            (chain._key(tuple(chain._token_id(word, add=True) for word in state)), options)
+            for state, options in model.items()
+        ]
+        states.sort(key=lambda state: state[0])
+        for key, options in states:
+            chain.keys.append(key)
+            chain.starts.append(len(chain.follows))
+            chain.sizes.append(len(options))
+            chain.follows.extend(chain._token_id(word, add=True) for word in options)
+            chain.cumulative.extend(itertools.accumulate(options.values()))
+        chain._index_rotations()
+        return chain
+
+    def _token_id(self, token: str, add: bool = False) -> int:
+        token_id = self.token_ids.get(token)
+        if token_id is None:
+            if not add:
+                raise KeyError(token)
+            token_id = len(self.tokens)
+            if token_id >= 1 << self.token_bits:
+                raise ValueError(f'too many words for a chain with state size {self.state_size}')
+            self.tokens.append(token)
+            self.token_ids[token] = token_id
+            self.folded_ids.setdefault(token.casefold(), []).append(token_id)
+        return token_id
+
+    def _key(self, state: Tuple[int, ...]) -> int:
+        key = 0
+        for token_id in state:
+            key = key << self.token_bits | token_id
+        return key
+
+    def _unpack(self, key: int) -> Tuple[int, ...]:
+        mask = (1 << self.token_bits) - 1
+        return tuple(
+            (key >> self.token_bits * i) & mask
+            for i in reversed(range(self.state_size))
+        )
+
+    def _rotate(self, key: int, words: int) -> int:
+        state = self._unpack(key)
+        return self._key(state[words:] + state[:words])
+
+    def _index_rotations(self):
+        for words, rotation in enumerate(self.rotations, 1):
+            rotation[:] = array('Q', sorted(self._rotate(key, words) for key in self.keys))
+
+    def _index(self, key: int) -> int:
+        i = bisect.bisect_left(self.keys, key)
+        if i == len(self.keys) or self.keys[i] != key:
+            raise KeyError(key)
+        return i
+
+    def _move(self, key: int) -> int:
+        i = self._index(key)
+        start = self.starts[i]
+        end = start + self.sizes[i]
+        r = random.random() * self.cumulative[end - 1]
+        return self.follows[bisect.bisect(self.cumulative, r, start, end)]
+
+    def move(self, state: Tuple[str, ...]) -> str:
+        """Given a state, choose the next word at random."""
+        return self.tokens[self._move(self._key(tuple(map(self._token_id, state))))]
+
+    def gen(self, init_state: Optional[Tuple[str, ...]] = None) -> Iterator[str]:
+        """Yield words from init_state (or the start of a sentence) until the end of the sentence."""
+        state = init_state or (BEGIN,) * self.state_size
+        key = self._key(tuple(map(self._token_id, state)))
+        mask = (1 << self.token_bits * self.state_size) - 1
+        while True:
+            token_id = self._move(key)
+            if token_id == END_ID:
+                return
+            yield self.tokens[token_id]
+            key = (key << self.token_bits | token_id) & mask
+
+    def walk(self, init_state: Optional[Tuple[str, ...]] = None) -> List[str]:
+        return list(self.gen(init_state))
+
+    def random_state_with(self, word: str) -> Optional[Tuple[str, ...]]:
+        """Return a state with word in it, picked at random, or None if the word never comes up.
+
+        If the word isn't in the chain as it is, it's looked for ignoring case.
+        """
+        token_ids = [self.token_ids[word]] if word in self.token_ids else self.folded_ids.get(word.casefold(), [])
+
+        # Where the states with the word are, in each array
+        shift = self.token_bits * (self.state_size - 1)
+        ranges = []
+        for token_id in token_ids:
+            for words, keys in enumerate([self.keys, *self.rotations]):
+                first = bisect.bisect_left(keys, token_id << shift)
+                last = bisect.bisect_left(keys, (token_id + 1) << shift)
+                if first < last:
+                    ranges.append((words, keys, first, last))
+
+        choice = random.randrange(sum(last - first for _, _, first, last in ranges) or 1)
+        for words, keys, first, last in ranges:
+            if choice < last - first:
+                # Rotate it back the rest of the way round
+                key = self._rotate(keys[first + choice], (self.state_size - words) % self.state_size)
+                return tuple(self.tokens[token_id] for token_id in self._unpack(key))
+            choice -= last - first
+        return None
+
+    def options(self, i: int) -> Dict[int, float]:
+        """Return the words that can follow the i'th state, with their weights."""
+        start = self.starts[i]
+        end = start + self.sizes[i]
+        options = {}
+        previous = 0.0
+        for token_id, total in zip(self.follows[start:end], self.cumulative[start:end]):
+            options[token_id] = total - previous
+            previous = total
+        return options
+
+    def add_runs(self, runs: Iterable[List[str]], weight: float):
+        """Add runs of words to the chain, as if they'd been in the corpus all along."""
+        added: Dict[int, Dict[int, float]] = {}
+        for run in runs:
+            items = [BEGIN_ID] * self.state_size + [self._token_id(word, add=True) for word in run] + [END_ID]
+            for i in range(len(run) + 1):
+                options = added.setdefault(self._key(tuple(items[i:i + self.state_size])), {})
+                follow = items[i + self.state_size]
+                options[follow] = options.get(follow, 0) + weight
+
+        for key, new_options in added.items():
+            i = bisect.bisect_left(self.keys, key)
+            if i < len(self.keys) and self.keys[i] == key:
+                options = self.options(i)
+                self.unused += self.sizes[i]
+            else:
+                options = {}
+                self.keys.insert(i, key)
+                for words, rotation in enumerate(self.rotations, 1):
+                    rotated = self._rotate(key, words)
+                    rotation.insert(bisect.bisect_left(rotation, rotated), rotated)
+                self.starts.insert(i, 0)
+                self.sizes.insert(i, 0)
+            for token_id, option_weight in new_options.items():
+                options[token_id] = options.get(token_id, 0) + option_weight
+
+            # Rather than move everything after it along, the state's new
+            # slice goes at the end
+            self.starts[i] = len(self.follows)
+            self.sizes[i] = len(options)
+            self.follows.extend(options)
+            self.cumulative.extend(itertools.accumulate(options.values()))
+
+        if self.unused > len(self.follows) // 2:
+            self._pack()
+
+    def _pack(self):
+        """Rewrite follows and cumulative without the slices that aren't used."""
+        follows = array('I')
+        cumulative = array('d')
+        for i, start in enumerate(self.starts):
+            end = start + self.sizes[i]
+            self.starts[i] = len(follows)
+            follows.extend(self.follows[start:end])
+            cumulative.extend(self.cumulative[start:end])
+        self.follows = follows
+        self.cumulative = cumulative
+        self.unused = 0
+
+    def to_dict(self) -> Dict[str, Any]:
+        self._pack()
+        return {
+            'state_size': self.state_size,
+            'tokens': self.tokens,
+            'keys': self.keys.tolist(),
+            'sizes': self.sizes.tolist(),
+            'follows': self.follows.tolist(),
+            'cumulative': self.cumulative.tolist(),
+        }
+
+    @classmethod
+    def from_dict(cls, obj: Dict[str, Any]) -> 'CompactChain':
+        chain = cls(obj['state_size'], obj['tokens'])
+        chain.keys = array('Q', obj['keys'])
+        chain.sizes = array('I', obj['sizes'])
+        chain.starts = array('I', itertools.accumulate(chain.sizes[:-1], initial=0))
+        chain.follows = array('I', obj['follows'])
+        chain.cumulative = array('d', obj['cumulative'])
+        chain._index_rotations()
+        return chain
+
+
+class CompactText(markovify.NewlineText):
+    """A NewlineText using a CompactChain.
+
+    The corpus is only kept as one string, which is all that's needed to
+    check that sentences don't repeat it.
+    """
+
+    def __init__(self, chain: CompactChain, rejoined_text: str):
+        super().__init__(None, state_size=chain.state_size, chain=chain, retain_original=False)
+        self.retain_original = True
+        self.rejoined_text = rejoined_text
+
+    @classmethod
+    def from_text(cls, text: markovify.Text) -> 'CompactText':
+        return cls(CompactChain.from_model(text.chain.model, text.state_size), text.rejoined_text)
+
+    def add_text(self, text: str, weight: float):
+        """Add text to the model in place, as if it had been in the corpus all along."""
+        runs = list(self.generate_corpus(text))
+        self.chain.add_runs(runs, weight)
+        # Generated sentences are checked against this to avoid repeating quotes
+        self.rejoined_text = self.sentence_join([self.rejoined_text, *map(self.word_join, runs)])
+
+    def to_dict(self):
+        return {
+            'state_size': self.state_size,
+            'chain': self.chain.to_dict(),
+            'rejoined_text': self.rejoined_text,
+        }
+
+    @classmethod
+    def from_dict(cls, obj, **kwargs):
+        return cls(CompactChain.from_dict(obj['chain']), obj['rejoined_text'])
+
+
+def load_cached_model(path):
+    try:
+        with open(path) as f:
+            return CompactText.from_json(f.read())
+    except FileNotFoundError:
+        return None
+    except (ValueError, KeyError) as ex:
+        print(f'ignoring bad markov model cache: {ex!r}')
+        return None
+
+
+class _Worker:
+    """The worker's end: owns the model, generates sentences, and runs commands."""
+
+    def __init__(self, mysql_password, cache_path, commands, replies, sentences):
+        self.mysql_password = mysql_password
+        self.cache_path = cache_path
+        self.commands = commands
+        self.replies = replies
+        self.sentences = sentences
+        self.parent = os.getppid()
+        self.model = None
+        # Set when the model couldn't come up with a sentence, so we don't spin
+        self.stuck = False
+
+    def run(self):
+        self.model = load_cached_model(self.cache_path)
+        while True:
+            idle = self.model is None or self.stuck or self.sentences.full()
+            try:
+                command = self.commands.get(timeout=IDLE_POLL_SECONDS) if idle else self.commands.get_nowait()
+            except queue.Empty:
+                command = None
+
+            if command is not None:
+                self.stuck = False
+                self.run_command(*command)
+            elif not idle:
+                sentence = self.model.make_sentence(tries=SENTENCE_TRIES)
+                if sentence:
+                    self.sentences.put(deping(sentence))
+                else:
+                    self.stuck = True
+            else:
+                if RUN_IN_PROCESS and os.getppid() != self.parent:
+                    # The bot has gone away without stopping us
+                    return
+                self.stuck = False
+
+    def run_command(self, request_id, name, args):
+        try:
+            result = getattr(self, f'do_{name}')(*args)
+        except Exception as ex:
+            self.replies.put((request_id, False, f'{ex}\n\n{format_exc()}'))
+        else:
+            self.replies.put((request_id, True, result))
+
+    def save(self):
+        assert self.model is not None
+        files.write_atomic(self.cache_path, self.model.to_json())
+
+    def do_rebuild(self):
+        self.model = CompactText.from_text(build_model(self.mysql_password, model_weights=MODEL_WEIGHTS))
+        self.save()
+
+    def do_sentence_about(self, word):
+        if self.model is None:
+            return None
+        for _ in range(SEED_STATES):
+            state = self.model.chain.random_state_with(word)
+            if state is None:
+                return None
+            sentence = self.model.make_sentence(init_state=state, tries=SENTENCE_TRIES // SEED_STATES)
+            if sentence:
+                return deping(sentence)
+        return None
+
+    def do_add_quote(self, quote):
+        if self.model is not None:
+            self.model.add_text(normalize_quote(quote), MODEL_WEIGHTS[0])
+            self.save()
+
+
+def _run_worker(*args):
+    _Worker(*args).run()
+
+
+class SentenceWorker:
+    """The bot's end of the worker: hands out sentences and sends it commands.
+
+    The worker is started again if it dies.
+    """
+
+    def __init__(self, mysql_password: str):
+        self.mysql_password = mysql_password
+        self.lock = threading.Lock()
+        self.request_ids = itertools.count()
+        self.pending: Dict[int, Future] = {}
+        self.worker: Any = None
+        self.commands: Any = None
+        self.replies: Any = None
+        self.sentences: Any = None
+        # Spawn rather than fork, since forking a process with lots of
+        # threads can leave locks held in the child
+        self.context = multiprocessing.get_context('spawn')
+
+    def start(self):
+        """Start the worker, if it isn't running already."""
+        with self.lock:
+            if self.worker is not None:
+                if self.worker.is_alive():
+                    return
+                # Let the old reply reader finish
+                self.replies.put(None)
+            for future in self.pending.values():
+                future.set_exception(RuntimeError('markov worker stopped'))
+            self.pending = {}
+
+            # Queue classes, for talking to a process or a thread
+            Queue = self.context.Queue if RUN_IN_PROCESS else queue.Queue
+            self.commands = Queue()
+            self.replies = Queue()
+            self.sentences = Queue(BUFFER_SIZE)
+            args = (
+                self.mysql_password,
+                files.cache_path(CACHE_FILE),
+                self.commands,
+                self.replies,
+                self.sentences,
+            )
+            if RUN_IN_PROCESS:
+                self.worker = self.context.Process(target=_run_worker, args=args, name='markov', daemon=True)
+            else:
+                self.worker = threading.Thread(target=_run_worker, args=args, name='markov', daemon=True)
+            self.worker.start()
+
+            replies = threading.Thread(target=self._read_replies, args=(self.replies,), daemon=True)
+            replies.start()
+
+    def _read_replies(self, replies):
+        while True:
+            reply = replies.get()
+            if reply is None:
+                return
+            request_id, ok, result = reply
+            with self.lock:
+                future = self.pending.pop(request_id, None)
+            if future is None:
+                continue
+            if ok:
+                future.set_result(result)
+            else:
+                future.set_exception(RuntimeError(result))
+
+    def request(self, name: str, *args) -> Future:
+        """Ask the worker to run a command, returning a future for its result."""
+        self.start()
+        future: Future = Future()
+        with self.lock:
+            request_id = next(self.request_ids)
+            self.pending[request_id] = future
+            self.commands.put((request_id, name, args))
+        return future
+
+    def rebuild(self):
+        """Rebuild the model from the database, and wait for it to finish."""
+        return self.request('rebuild').result()
+
+    def add_quote(self, quote: str):
+        """Add a quote to the model, without waiting for it."""
+        self.request('add_quote', quote)
+
+    def sentence_about(self, word: str, timeout: float) -> Optional[str]:
+        """Make a (ping-free) sentence with word in it, or return None if that doesn't work out.
+
+        This can't come from the buffer, so it waits for the worker to finish
+        what it's doing first, up to timeout seconds.
+        """
+        try:
+            return self.request('sentence_about', word).result(timeout=timeout)
+        except TimeoutError:
+            return None
+
+    def sentence(self, timeout: float) -> Optional[str]:
+        """Return a ready-made (and ping-free) sentence, if there is one within timeout seconds."""
+        self.start()
+        try:
+            return self.sentences.get(timeout=timeout)
+        except queue.Empty:
+            return None
@@ -0,0 +1,134 @@
+"""Collect metrics about the bot and render them for Prometheus."""
+import collections
+import threading
+from typing import Callable
+from typing import DefaultDict
+from typing import Deque
+from typing import Dict
+from typing import Iterable
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+Labels = Tuple[Tuple[str, str], ...]
+
+# A metric computed when rendering, rather than recorded as it happens:
+# (metric name, labels, value)
+Sample = Tuple[str, Dict[str, str], float]
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+# Quantiles are computed over this many of the most recent observations
+SUMMARY_WINDOW = 1024
+
+
+def _labels(labels: Optional[Dict[str, str]]) -> Labels:
+    if not labels:
+        return ()
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _format_labels(labels: Labels) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join(
+        '{}="{}"'.format(
+            key,
+            value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'),
+        )
+        for key, value in labels
+    ) + '}'
+
+
+class Summary:
+    """A count and sum of observations, plus quantiles of the recent ones."""
+
+    def __init__(self):
+        self.count = 0
+        self.sum = 0.0
+        self.recent: Deque[float] = collections.deque(maxlen=SUMMARY_WINDOW)
+
+    def observe(self, value: float):
+        self.count += 1
+        self.sum += value
+        self.recent.append(value)
+
+    def quantiles(self) -> List[Tuple[float, float]]:
+        ordered = sorted(self.recent)
+        if not ordered:
+            return []
+        return [
+            (q, ordered[min(len(ordered) - 1, int(q * len(ordered)))])
+            for q in QUANTILES
+        ]
+
+
+class Metrics:
+    """A registry of metrics, safe to update from any thread."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # name -> (type, help text)
+        self.families: Dict[str, Tuple[str, str]] = {}
+        self.values: DefaultDict[str, Dict[Labels, float]] = collections.defaultdict(dict)
+        self.summaries: DefaultDict[str, Dict[Labels, Summary]] = collections.defaultdict(dict)
+        self.collectors: List[Callable[[], Iterable[Sample]]] = []
+
+    def describe(self, name: str, kind: str, help_text: str):
+        """Declare a metric, with its Prometheus type (counter, gauge, or summary)."""
+        self.families[name] = (kind, help_text)
+
+    def inc(self, name: str, amount: float = 1, labels: Optional[Dict[str, str]] = None):
+        key = _labels(labels)
+        with self.lock:
+            values = self.values[name]
+            values[key] = values.get(key, 0) + amount
+
+    def set(self, name: str, value: float, labels: Optional[Dict[str, str]] = None):
+        key = _labels(labels)
+        with self.lock:
+            self.values[name][key] = value
+
+    def observe(self, name: str, value: float, labels: Optional[Dict[str, str]] = None):
+        key = _labels(labels)
+        with self.lock:
+            summaries = self.summaries[name]
+            if key not in summaries:
+                summaries[key] = Summary()
+            summaries[key].observe(value)
+
+    def add_collector(self, collector: Callable[[], Iterable[Sample]]):
+        """Add a function returning samples to compute each time metrics are rendered."""
+        self.collectors.append(collector)
+
+    def render(self) -> str:
+        """Render all metrics in the Prometheus text exposition format."""
+        values: DefaultDict[str, Dict[Labels, float]] = collections.defaultdict(dict)
+        with self.lock:
+            for name, samples in self.values.items():
+                values[name].update(samples)
+            summaries = {
+                name: {
+                    key: (summary.count, summary.sum, summary.quantiles())
+                    for key, summary in by_labels.items()
+                }
+                for name, by_labels in self.summaries.items()
+            }
+        for collector in self.collectors:
+            for name, labels, value in collector():
+                values[name][_labels(labels)] = value
+
+        lines = []
+        for name in sorted(set(values) | set(summaries) | set(self.families)):
+            kind, help_text = self.families.get(name, ('untyped', ''))
+            if help_text:
+                lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            for key, value in sorted(values.get(name, {}).items()):
+                lines.append(f'{name}{_format_labels(key)} {value}')
+            for key, (count, total, quantiles) in sorted(summaries.get(name, {}).items()):
+                for q, value in quantiles:
+                    lines.append(f'{name}{_format_labels(key + (("quantile", str(q)),))} {value}')
+                lines.append(f'{name}_sum{_format_labels(key)} {total}')
+                lines.append(f'{name}_count{_format_labels(key)} {count}')
+        return '\n'.join(lines) + '\n'
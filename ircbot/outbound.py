@@ -0,0 +1,161 @@
+"""Send outgoing messages at a rate that won't get the bot flood-kicked."""
+import collections
+import threading
+import time
+from typing import Callable
+from typing import Counter
+from typing import Deque
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import OrderedDict
+from typing import Tuple
+
+# Lower numbers are sent first
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+NUM_PRIORITIES = 2
+
+
+def target_label(target: str) -> str:
+    """Return what to report a target as: channels by name, and every private message together."""
+    return target if target.startswith('#') else 'private'
+
+
+class TokenBucket:
+    """Allow `burst` lines at once, refilling at `rate` lines per second."""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def delay(self, count: int = 1) -> float:
+        """Return how long to wait before count tokens are available.
+
+        Groups bigger than the burst only wait for a full bucket, and leave
+        it in debt, so whatever comes next waits for it to refill.
+        """
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        needed = min(count, self.burst)
+        if self.tokens >= needed:
+            return 0
+        return (needed - self.tokens) / self.rate
+
+    def take(self, count: int = 1):
+        self.tokens -= count
+
+
+class OutboundQueue:
+    """A queue of messages waiting to be sent, drained by a sender thread.
+
+    Higher priority messages are always sent first. Within a priority,
+    targets take turns, so a long response in one channel can't hold up
+    everything else.
+
+    Each message is a group of raw lines (a single PRIVMSG, or a multiline
+    batch) which are sent together. Every line counts against the rate
+    limit, since that's what the server counts.
+
+    :param send: Called with (target, lines) to actually send a message.
+    """
+
+    def __init__(self, send: Callable[[str, List[str]], None], rate: float, burst: int):
+        self.send = send
+        self.bucket = TokenBucket(rate, burst)
+        self.cond = threading.Condition()
+        # One round-robin of targets per priority, each with its queued
+        # (time enqueued, message) pairs
+        self.queues: List[OrderedDict[str, Deque[Tuple[float, List[str]]]]] = [
+            collections.OrderedDict() for _ in range(NUM_PRIORITIES)
+        ]
+        # How long the most recently sent message spent in the queue
+        self.last_lag = 0.0
+        # Messages sent so far, by target_label (not by nick, so this
+        # doesn't grow with everybody the bot has ever talked to)
+        self.sent: Counter[str] = collections.Counter()
+        self.thread: Optional[threading.Thread] = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name='outbound', daemon=True)
+        self.thread.start()
+
+    def put(self, target: str, message: List[str], priority: int = PRIORITY_NORMAL):
+        with self.cond:
+            queue = self.queues[priority]
+            if target not in queue:
+                queue[target] = collections.deque()
+            queue[target].append((time.monotonic(), message))
+            self.cond.notify()
+
+    def depth(self) -> int:
+        """Return the number of messages waiting to be sent."""
+        with self.cond:
+            return sum(len(messages) for queue in self.queues for messages in queue.values())
+
+    def depths(self) -> Dict[str, int]:
+        """Return the number of messages waiting to be sent, by target_label."""
+        depths: Dict[str, int] = collections.Counter()
+        with self.cond:
+            for queue in self.queues:
+                for target, messages in queue.items():
+                    depths[target_label(target)] += len(messages)
+        return dict(depths)
+
+    def lag(self) -> float:
+        """Return how long the oldest waiting message has been waiting."""
+        with self.cond:
+            oldest = min(
+                (messages[0][0] for queue in self.queues for messages in queue.values()),
+                default=None,
+            )
+        return 0.0 if oldest is None else time.monotonic() - oldest
+
+    def sent_counts(self) -> Dict[str, int]:
+        """Return the number of messages sent so far, by target_label."""
+        with self.cond:
+            return dict(self.sent)
+
+    def _pop(self) -> Optional[Tuple[str, float, List[str]]]:
+        for queue in self.queues:
+            if queue:
+                target, messages = next(iter(queue.items()))
+                enqueued, message = messages.popleft()
+                if messages:
+                    # Go to the back of the line
+                    queue.move_to_end(target)
+                else:
+                    del queue[target]
+                return target, enqueued, message
+        return None
+
+    def run(self):
+        while True:
+            with self.cond:
+                while not any(self.queues):
+                    self.cond.wait()
+
+            # Don't hold the lock while waiting, so that new (maybe higher
+            # priority) messages can be queued up in the meantime.
+            time.sleep(self.bucket.delay())
+
+            with self.cond:
+                popped = self._pop()
+            if popped is None:
+                continue
+            target, enqueued, message = popped
+
+            # A multiline batch can need more than the one token waited for
+            time.sleep(self.bucket.delay(len(message)))
+            self.bucket.take(len(message))
+            self.last_lag = time.monotonic() - enqueued
+            try:
+                self.send(target, message)
+                with self.cond:
+                    self.sent[target_label(target)] += 1
+            except Exception as ex:
+                # Most likely we're not connected, nothing to do but drop it
+                print(f'failed to send message to {target}: {ex}')
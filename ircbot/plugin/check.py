@@ -5,6 +5,11 @@ import string
 from ocflib.account import search
 from ocflib.infra import ldap
 
+from ircbot import cache
+
+# Users looked up in LDAP, which change rarely
+user_attrs = cache.cached('ldap_users', ttl=5 * 60, negative_ttl=60)(search.user_attrs)
+
 
 GROUP_COLOR_MAPPING = {
     'ocf': '\x0314',  # gray
@@ -27,7 +32,7 @@ def register(bot):
 def check(bot, msg):
     """Print information about an OCF user."""
     user = msg.match.group(1).strip()
-    attrs = search.user_attrs(user)
+    attrs = user_attrs(user)
 
     if attrs is not None:
         groups = [grp.getgrgid(attrs['gidNumber']).gr_name]
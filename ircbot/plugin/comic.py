@@ -1,22 +1,234 @@
 """Make references to XKCD easier"""
+import gzip
+import json
 import re
-import urllib.error
+import threading
+import time
+from textwrap import dedent
+from traceback import format_exc
+from typing import Dict
+from typing import Iterable
+from typing import List
+from typing import NamedTuple
+from typing import Optional
+from typing import Set
 
-import xkcd
+from ircbot import cache
+from ircbot import files
+from ircbot import web
+
+API = 'https://xkcd.com'
 
 REGEX = re.compile(r'(?:xkcd#|xkcd.com/)([0-9]+)')
 
+# Titles and alt text are searched by word
+WORDS = re.compile(r"[a-z0-9']+")
 
-def register(bot):
-    bot.listen(REGEX.pattern, show_comic)
+# Every comic's details are kept here, so they can be shown (and searched)
+# without asking xkcd. Only comics newer than the newest one in here are
+# ever downloaded.
+MIRROR_FILE = 'xkcd.json.gz'
 
+# How often to check for new comics
+CHECK_INTERVAL_SECONDS = 60 * 60
 
-def show_comic(_, msg):
-    """Show XKCD comic details."""
-    for number in REGEX.findall(msg.text):
+# Filling the mirror from scratch takes a while, so save it along the way
+SAVE_EVERY = 100
+
+# The mirror, loaded on first use
+_mirror: Optional['ComicMirror'] = None
+_mirror_lock = threading.Lock()
+
+
+class Comic(NamedTuple):
+    number: int
+    title: str
+    image: str
+    alt: str
+
+    def __str__(self) -> str:
+        return f"XKCD#{self.number} | '{self.title}' | {self.image} | {self.alt}"
+
+
+class ComicMirror:
+    """Every comic up to the newest one downloaded, with an index of the words in them."""
+
+    def __init__(self, comics: Iterable[Comic] = ()):
+        self.lock = threading.Lock()
+        self.comics: Dict[int, Comic] = {}
+        # Comics with each word in their title, and in their title or alt text
+        self.title_words: Dict[str, Set[int]] = {}
+        self.words: Dict[str, Set[int]] = {}
+        # Comics up to here that aren't in the mirror don't exist (like 404)
+        self.newest = 0
+        for comic in comics:
+            self.add(comic)
+
+    def add(self, comic: Comic):
+        with self.lock:
+            self.comics[comic.number] = comic
+            self.newest = max(self.newest, comic.number)
+            for word in set(WORDS.findall(comic.title.lower())):
+                self.title_words.setdefault(word, set()).add(comic.number)
+            for word in set(WORDS.findall(f'{comic.title} {comic.alt}'.lower())):
+                self.words.setdefault(word, set()).add(comic.number)
+
+    def get(self, number: int) -> Optional[Comic]:
+        with self.lock:
+            return self.comics.get(number)
+
+    def search(self, text: str) -> List[Comic]:
+        """Return comics with every word of text in their title or alt text.
+
+        Comics titled exactly text come first, then those with more of its
+        words in their title, then the oldest.
+        """
+        words = set(WORDS.findall(text.lower()))
+        if not words:
+            return []
+        with self.lock:
+            found = set.intersection(*(self.words.get(word, set()) for word in words))
+            in_title = {number: sum(number in self.title_words.get(word, ()) for word in words) for number in found}
+            comics = [self.comics[number] for number in found]
+        wanted = ' '.join(WORDS.findall(text.lower()))
+        return sorted(
+            comics,
+            key=lambda comic: (
+                ' '.join(WORDS.findall(comic.title.lower())) != wanted,
+                -in_title[comic.number],
+                comic.number,
+            ),
+        )
+
+    def save(self):
+        with self.lock:
+            comics = [list(comic) for _, comic in sorted(self.comics.items())]
+            newest = self.newest
+        data = json.dumps({'newest': newest, 'comics': comics}, separators=(',', ':'))
+        files.write_atomic(files.cache_path(MIRROR_FILE), gzip.compress(data.encode()))
+
+    @classmethod
+    def load(cls) -> 'ComicMirror':
         try:
-            comic = xkcd.Comic(int(number))
-            reply = f"XKCD#{int(number)} | '{comic.getTitle()}' | {comic.getImageLink()} | {comic.getAltText()}"
-            msg.respond(reply)
-        except urllib.error.HTTPError:
+            with gzip.open(files.cache_path(MIRROR_FILE), 'rt') as f:
+                saved = json.load(f)
+            mirror = cls([Comic(*comic) for comic in saved['comics']])
+            mirror.newest = max(mirror.newest, saved['newest'])
+            return mirror
+        except FileNotFoundError:
             pass
+        except (OSError, ValueError, KeyError, TypeError) as ex:
+            print(f'ignoring bad xkcd mirror: {ex!r}')
+        return cls()
+
+
+def register(bot):
+    bot.add_unfurler(REGEX.pattern, show_comic, ping=True)
+    bot.listen(r'^xkcd\s+(.+)$', search, require_mention=True)
+
+    bot.add_warmup(load_mirror)
+    bot.add_thread(fill_mirror)
+
+
+def mirror() -> ComicMirror:
+    global _mirror
+    with _mirror_lock:
+        if _mirror is None:
+            _mirror = ComicMirror.load()
+    return _mirror
+
+
+def load_mirror(bot):
+    mirror()
+
+
+def fill_mirror(bot):
+    """Download any new comics into the mirror, every so often."""
+    while True:
+        try:
+            update_mirror()
+        except Exception as ex:
+            bot.handle_error(
+                dedent(
+                    """
+                ircbot exception updating xkcd mirror: {exception}
+
+                {traceback}
+                """,
+                ).format(
+                    exception=ex,
+                    traceback=format_exc(),
+                ),
+            )
+        time.sleep(CHECK_INTERVAL_SECONDS)
+
+
+def update_mirror():
+    comics = mirror()
+    latest = fetch_comic()
+    if latest is None or latest.number <= comics.newest:
+        return
+    added = 0
+    for number in range(comics.newest + 1, latest.number):
+        comic = fetch_comic(number)
+        if comic is not None:
+            comics.add(comic)
+        else:
+            # Not every number is a comic, but later ones still count
+            with comics.lock:
+                comics.newest = number
+        added += 1
+        if added % SAVE_EVERY == 0:
+            comics.save()
+    comics.add(latest)
+    comics.save()
+
+
+def fetch_comic(number: Optional[int] = None) -> Optional[Comic]:
+    """Download a comic's details (the latest one's, without a number), or None if it doesn't exist."""
+    url = f'{API}/info.0.json' if number is None else f'{API}/{number}/info.0.json'
+    resp = web.get(url)
+    if resp.status_code == 404:
+        return None
+    resp.raise_for_status()
+    info = resp.json()
+    return Comic(info['num'], info['safe_title'], info['img'], info['alt'])
+
+
+def show_comic(_, match):
+    """Show XKCD comic details."""
+    return describe(int(match.group(1)))
+
+
+def describe(number: int) -> Optional[str]:
+    comics = mirror()
+    comic = comics.get(number)
+    if comic is not None:
+        return str(comic)
+    if number <= comics.newest:
+        return None
+    # Newer than anything in the mirror, it'll be added next time it's filled
+    return comic_info(number)
+
+
+# Comics don't change once they're up, but ones that aren't up yet will be
+@cache.cached('xkcd', ttl=24 * 60 * 60, negative_ttl=60 * 60)
+def comic_info(number):
+    comic = fetch_comic(number)
+    return str(comic) if comic is not None else None
+
+
+def search(bot, msg):
+    """Search XKCD comics by title and alt text."""
+    text = msg.match.group(1).strip()
+    if text.isdigit():
+        msg.respond(describe(int(text)) or f'there is no XKCD#{text}', ping=False)
+        return
+
+    found = mirror().search(text)
+    if not found:
+        msg.respond('no matching comics :(', ping=False)
+    elif len(found) == 1:
+        msg.respond(str(found[0]), ping=False)
+    else:
+        msg.respond(f'{found[0]} (+{len(found) - 1} more)', ping=False)
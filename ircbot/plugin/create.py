@@ -2,12 +2,6 @@
 import ssl
 import time
 
-from celery import Celery
-from celery import exceptions
-from celery.events import EventReceiver
-from kombu import Connection
-from ocflib.account.submission import get_tasks
-
 from ircbot.ircbot import IRC_CHANNELS_ANNOUNCE
 from ircbot.ircbot import IRC_CHANNELS_OPER
 
@@ -42,6 +36,8 @@ def reject(bot, msg):
 
 def list_pending(bot, msg):
     """List accounts pending approval."""
+    from celery import exceptions
+
     task = bot.tasks.get_pending_requests.delay()
     try:
         task.wait(timeout=5)
@@ -56,6 +52,12 @@ def list_pending(bot, msg):
 
 def celery_listener(bot):
     """Listen for events from Celery, relay to IRC."""
+    # Celery takes a while to import, so it's only imported once the bot is
+    # up and running
+    from celery import Celery
+    from celery.events import EventReceiver
+    from kombu import Connection
+    from ocflib.account.submission import get_tasks
 
     while not (hasattr(bot, 'connection') and bot.connection.connected):
         time.sleep(2)
@@ -5,7 +5,7 @@ from datetime import datetime
 from typing import List
 from xml.etree import ElementTree
 
-import requests
+from ircbot import web
 
 
 DSA = namedtuple('DSA', ('number', 'revision', 'package', 'link', 'description', 'date'))
@@ -14,7 +14,7 @@ last_seen_rev = None
 
 
 def dsa_list():
-    req = requests.get('https://www.debian.org/security/dsa-long', timeout=30)
+    req = web.get('https://www.debian.org/security/dsa-long', timeout=30)
     req.raise_for_status()
 
     root = ElementTree.fromstring(req.content)
@@ -1,43 +1,259 @@
 """Search (or reverse search) for emojis."""
+import bisect
+import re
 import shlex
+import threading
 import unicodedata
+from array import array
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Set
+from typing import Tuple
 
+RESULTS_PER_PAGE = 50
 
-char_mapping = []
-for i in range(0x10ffff):
-    c = chr(i)
-    try:
-        name = unicodedata.name(c)
-    except ValueError:
-        continue
-    if unicodedata.category(c).startswith('C'):
-        continue
-    char_mapping.append((name, c))
-char_map = tuple(char_mapping)
+# Character names are searched by word, split at these
+WORD_SEPARATORS = re.compile('[ -]')
+HEX_DIGITS = re.compile('[0-9A-F]+')
+
+# The index of character names, built on first use since it takes a moment
+# to go through all of unicode
+_index: Optional['EmojiIndex'] = None
+_index_lock = threading.Lock()
+
+# Results not shown yet, by channel: (results, how many were shown)
+_pages: Dict[str, Tuple[str, int]] = {}
+
+
+class EmojiIndex:
+    """An index of unicode character names, for searching by word or substring.
+
+    Names are split into words (at spaces and hyphens), and each distinct
+    word maps to the characters with it in their name. To find words
+    containing some text, there's a suffix array over the distinct words:
+    every position in every word, sorted by the rest of the word from there.
+    Everything is packed into strings and arrays to keep it small.
+    """
+
+    def __init__(self):
+        chars = []
+        names = []
+        for i in range(0x110000):
+            c = chr(i)
+            # name() is much faster given a default than raising ValueError
+            name = unicodedata.name(c, '')
+            if name and not unicodedata.category(c).startswith('C'):
+                chars.append(c)
+                names.append(name)
+
+        self.chars = ''.join(chars)
+        # Each name followed by a newline, with where each one starts
+        self.names = '\n'.join(names) + '\n'
+        self.name_starts = array('I', [0])
+        for name in names:
+            self.name_starts.append(self.name_starts[-1] + len(name) + 1)
+
+        postings: Dict[str, List[int]] = {}
+        for i, name in enumerate(names):
+            for word in set(WORD_SEPARATORS.split(name)):
+                postings.setdefault(word, []).append(i)
+
+        # Words made of hex digits are mostly code points from names like
+        # "CJK UNIFIED IDEOGRAPH-4E00". There are lots of them, so rather
+        # than going in the suffix array they're just searched one by one.
+        words = sorted(word for word in postings if not HEX_DIGITS.fullmatch(word))
+        codes = sorted(word for word in postings if HEX_DIGITS.fullmatch(word))
+
+        # Every distinct word, packed like the names (spelled out words, then
+        # hex words), and the characters with each word in their name
+        self.word_ids = {word: i for i, word in enumerate(words)}
+        self.words = '\n'.join(words) + '\n'
+        self.codes = '\n' + '\n'.join(codes) + '\n'
+        self.code_starts = array('I', [1])
+        for code in codes:
+            self.code_starts.append(self.code_starts[-1] + len(code) + 1)
+        self.postings = array('I')
+        self.posting_starts = array('I', [0])
+        for word in words + codes:
+            self.postings.extend(postings[word])
+            self.posting_starts.append(len(self.postings))
+
+        # Where each suffix starts in self.words, and which word it's part of
+        starts = array('I')
+        word_ends = array('I')
+        word_of = array('I')
+        start = 0
+        for word_id, word in enumerate(words):
+            end = start + len(word)
+            for i in range(start, end):
+                starts.append(i)
+                word_ends.append(end)
+                word_of.append(word_id)
+            start = end + 1
+        order = sorted(range(len(starts)), key=lambda i: self.words[starts[i]:word_ends[i]])
+        self.suffix_starts = array('I', (starts[i] for i in order))
+        self.suffix_words = array('I', (word_of[i] for i in order))
+
+    def name(self, i: int) -> str:
+        return self.names[self.name_starts[i]:self.name_starts[i + 1] - 1]
+
+    def _with_word(self, word_id: int) -> array:
+        return self.postings[self.posting_starts[word_id]:self.posting_starts[word_id + 1]]
+
+    def _suffixes_starting(self, text: str) -> Tuple[int, int]:
+        """Return the range of the suffix array starting with text."""
+        # Words are separated by newlines, which sort before anything else,
+        # so comparing past the end of a word still gives the right order.
+        size = len(text)
+        lo, hi = 0, len(self.suffix_starts)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            start = self.suffix_starts[mid]
+            if self.words[start:start + size] < text:
+                lo = mid + 1
+            else:
+                hi = mid
+        first, hi = lo, len(self.suffix_starts)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            start = self.suffix_starts[mid]
+            if self.words[start:start + size] <= text:
+                lo = mid + 1
+            else:
+                hi = mid
+        return first, lo
+
+    def _containing(self, text: str) -> Set[int]:
+        """Return characters with a word in their name containing text."""
+        first, last = self._suffixes_starting(text)
+        word_ids = set(self.suffix_words[first:last])
+        if HEX_DIGITS.fullmatch(text):
+            start = self.codes.find(text)
+            while start != -1:
+                code = bisect.bisect_right(self.code_starts, start) - 1
+                word_ids.add(len(self.word_ids) + code)
+                start = self.codes.find(text, self.code_starts[code + 1])
+
+        found: Set[int] = set()
+        for word_id in word_ids:
+            found.update(self._with_word(word_id))
+        return found
+
+    def _word_id(self, word: str) -> Optional[int]:
+        if not HEX_DIGITS.fullmatch(word):
+            return self.word_ids.get(word)
+        start = self.codes.find(f'\n{word}\n')
+        if start == -1:
+            return None
+        return len(self.word_ids) + bisect.bisect_right(self.code_starts, start + 1) - 1
+
+    def _matching(self, term: str) -> Tuple[Set[int], Set[int]]:
+        """Return characters with term in their name, and those with it as whole words."""
+        words = [word for word in WORD_SEPARATORS.split(term) if word]
+        if not words:
+            # Just separators, nothing for the index to go on
+            found = {i for i, name in enumerate(self.names.split('\n')) if term in name}
+        else:
+            found = self._containing(words[0])
+            for word in words[1:]:
+                found &= self._containing(word)
+
+        if words == [term]:
+            word_id = self._word_id(term)
+            whole = set() if word_id is None else set(self._with_word(word_id))
+            return found, whole
+
+        # A phrase, so check it really appears like that
+        found = {i for i in found if term in self.name(i)}
+        whole = set()
+        for i in found:
+            padded = f' {WORD_SEPARATORS.sub(" ", self.name(i))} '
+            if f' {WORD_SEPARATORS.sub(" ", term)} ' in padded:
+                whole.add(i)
+        return found, whole
+
+    def search(self, terms: List[str]) -> str:
+        """Return characters with every term somewhere in their name.
+
+        Terms are uppercase, and can be phrases of several words. Characters
+        with every term as whole words in their name come first, and
+        otherwise characters are in code point order.
+        """
+        matches: Optional[Set[int]] = None
+        exact: Set[int] = set()
+        for term in terms:
+            found, whole = self._matching(term)
+            if matches is None:
+                matches, exact = found, whole
+            else:
+                matches &= found
+                exact &= whole
+            if not matches:
+                return ''
+        if matches is None:
+            return ''
+
+        exact &= matches
+        ranked = sorted(exact) + sorted(matches - exact)
+        return ''.join(self.chars[i] for i in ranked)
 
 
 def register(bot):
     bot.listen(r'^emoji (.+)$', emoji, require_mention=True)
     bot.listen(r'^remoji (.+)$', remoji, require_mention=True)
 
+    bot.add_warmup(load_index)
+
+
+def index() -> EmojiIndex:
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = EmojiIndex()
+    return _index
+
+
+def load_index(bot):
+    index()
+
+
+def show_page(msg, results: str, shown: int):
+    page = results[shown:shown + RESULTS_PER_PAGE]
+    if shown + len(page) < len(results):
+        _pages[msg.channel] = (results, shown + len(page))
+        msg.respond(
+            f'Showing {shown + 1}-{shown + len(page)} of {len(results)} results '
+            f'(say "emoji more" for more)',
+        )
+    else:
+        _pages.pop(msg.channel, None)
+        if shown > 0:
+            msg.respond(f'Showing {shown + 1}-{len(results)} of {len(results)} results')
+    msg.respond(page)
+
 
 def emoji(bot, msg):
-    """Search for emojis by name."""
+    """Search for emojis by name. Say "emoji more" for more results."""
+    if msg.match.group(1).strip().lower() == 'more':
+        page = _pages.get(msg.channel)
+        if page is None:
+            msg.respond('No more results')
+        else:
+            show_page(msg, *page)
+        return
+
     # allow quoted results
-    query = ' '.join(shlex.split(msg.match.group(1))).upper()
+    terms = [term.upper() for term in shlex.split(msg.match.group(1))]
     ret = ''
-    if query == 'DEBIAN':
+    if terms == ['DEBIAN']:
         ret += '🍥'
-    for name, c in char_map:
-        if query in name:
-            ret += c
+    ret += index().search(terms)
     if not ret:
+        _pages.pop(msg.channel, None)
         msg.respond('No results 😢')
-    elif len(ret) > 50:
-        msg.respond(f'Showing 1-50 of {len(ret)} results')
-        msg.respond(ret[:50])
     else:
-        msg.respond(ret)
+        show_page(msg, ret, 0)
 
 
 def remoji(bot, msg):
@@ -1,7 +1,11 @@
 """A really long winded way of writing return 'yes'"""
 import re
 
-import requests
+from ircbot import cache
+from ircbot import web
+
+# It's not going to stop being on fire in the next five minutes
+answers = cache.namespace('fire', ttl=5 * 60)
 
 
 def register(bot):
@@ -10,11 +14,15 @@ def register(bot):
 
 
 def onfire(bot, msg):
-    req = requests.get(
+    msg.respond(answers.get('california', is_california_on_fire), ping=False)
+
+
+def is_california_on_fire():
+    req = web.get(
         'http://iscaliforniaonfire.com/',
     )
     req.raise_for_status()
-    msg.respond('yes' if 'yes' in req.text.lower() else 'no', ping=False)
+    return 'yes' if 'yes' in req.text.lower() else 'no'
 
 
 def frozen(bot, msg):
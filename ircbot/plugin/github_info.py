@@ -1,70 +1,134 @@
 """Print information about GitHub links."""
+import collections
+import threading
+from typing import Optional
+from typing import Tuple
+
 import github3
 
+# Responses to keep for revalidating, most recently used first
+MAX_CACHED_RESPONSES = 512
+
+# One client for every link, so connections (and the token) are reused
+_github: Optional[github3.GitHub] = None
+_github_lock = threading.Lock()
+
+# The last response from each URL: its ETag, and its JSON
+_responses: 'collections.OrderedDict[str, Tuple[str, dict]]' = collections.OrderedDict()
+_cache_lock = threading.Lock()
+
 
 def register(bot):
-    bot.listen(r'https?://github.com/([^/]+)/([^/]+?)/?(?:[ #]|$)', project_info)
-    bot.listen(r'https?://github.com/([^/]+)/([^/]+)/issues/([0-9]+)/?\b', issue_info)
-    bot.listen(r'https?://github.com/([^/]+)/([^/]+)/pull/([0-9]+)/?\b', pr_info)
+    bot.add_unfurler(r'https?://github.com/([^/]+)/([^/]+?)/?(?:[ #]|$)', project_info)
+    bot.add_unfurler(r'https?://github.com/([^/]+)/([^/]+)/issues/([0-9]+)/?\b', issue_info)
+    bot.add_unfurler(r'https?://github.com/([^/]+)/([^/]+)/pull/([0-9]+)/?\b', pr_info)
+
+    describe = bot.metrics.describe
+    describe('ircbot_github_rate_limit', 'gauge', 'GitHub API requests allowed per hour')
+    describe('ircbot_github_rate_limit_remaining', 'gauge', 'GitHub API requests left until the limit resets')
+    describe('ircbot_github_rate_limit_reset_timestamp', 'gauge', 'When the GitHub API rate limit next resets')
+    describe('ircbot_github_requests_total', 'counter', 'GitHub API requests, by whether the cached copy was current')
+
+
+def client(bot) -> github3.GitHub:
+    """Return the shared GitHub client, logged in with the bot's token if there is one."""
+    global _github
+    with _github_lock:
+        if _github is None:
+            _github = github3.GitHub(token=bot.github_token or '')
+        return _github
+
+
+def fetch(bot, *path) -> Optional[dict]:
+    """Get something from the GitHub API, or None if it doesn't exist.
+
+    If we've fetched it before, GitHub is asked whether it's changed since.
+    Answers of "no" (304 Not Modified) don't count against the rate limit.
+    """
+    session = client(bot).session
+    url = session.build_url(*path)
+    with _cache_lock:
+        cached = _responses.get(url)
+    headers = {'If-None-Match': cached[0]} if cached is not None else {}
+
+    resp = session.get(url, headers=headers)
+    record_rate_limit(bot, resp)
+    if resp.status_code == 304 and cached is not None:
+        bot.metrics.inc('ircbot_github_requests_total', labels={'outcome': 'not_modified'})
+        with _cache_lock:
+            if url in _responses:
+                _responses.move_to_end(url)
+        return cached[1]
 
+    bot.metrics.inc('ircbot_github_requests_total', labels={'outcome': str(resp.status_code)})
+    if resp.status_code == 404:
+        with _cache_lock:
+            _responses.pop(url, None)
+        return None
+    resp.raise_for_status()
 
-def project_info(bot, msg):
+    data = resp.json()
+    etag = resp.headers.get('ETag')
+    if etag:
+        with _cache_lock:
+            _responses[url] = (etag, data)
+            _responses.move_to_end(url)
+            while len(_responses) > MAX_CACHED_RESPONSES:
+                _responses.popitem(last=False)
+    return data
+
+
+def record_rate_limit(bot, resp):
+    for header, metric in (
+        ('X-RateLimit-Limit', 'ircbot_github_rate_limit'),
+        ('X-RateLimit-Remaining', 'ircbot_github_rate_limit_remaining'),
+        ('X-RateLimit-Reset', 'ircbot_github_rate_limit_reset_timestamp'),
+    ):
+        value = resp.headers.get(header)
+        if value is not None and value.isdigit():
+            bot.metrics.set(metric, int(value))
+
+
+def project_info(bot, match):
     """Show GitHub project information."""
-    user, repo_name = msg.match.groups()
-
-    github = github3.GitHub()
-    try:
-        repo = github.repository(user, repo_name)
-        msg.respond(
-            '\x0303{user}/{repo}\x03 | \x0308{stars} stars\x03 | \x0314{description}\x03'.format(
-                user=user,
-                repo=repo_name,
-                stars=repo.stargazers_count,
-                description=repo.description,
-            ),
-            ping=False,
-        )
-    except github3.exceptions.NotFoundError:
-        pass
-
-
-def issue_info(bot, msg):
+    user, repo_name = match.groups()
+
+    repo = fetch(bot, 'repos', user, repo_name)
+    if repo is None:
+        return None
+    return '\x0303{user}/{repo}\x03 | \x0308{stars} stars\x03 | \x0314{description}\x03'.format(
+        user=user,
+        repo=repo_name,
+        stars=repo['stargazers_count'],
+        description=repo['description'],
+    )
+
+
+def issue_info(bot, match):
     """Show GitHub project issue information."""
-    user, repo_name, issue_num = msg.match.groups()
-
-    github = github3.GitHub()
-    try:
-        repo = github.repository(user, repo_name)
-        issue = repo.issue(int(issue_num))
-        msg.respond(
-            '\x0314Issue #{num}: {title}\x03 (\x0308{state}\x03, filed by \x0302{user}\x03)'.format(
-                num=issue_num,
-                title=issue.title,
-                state=issue.state,
-                user=issue.user.login,
-            ),
-            ping=False,
-        )
-    except github3.exceptions.NotFoundError:
-        pass
-
-
-def pr_info(bot, msg):
+    user, repo_name, issue_num = match.groups()
+
+    issue = fetch(bot, 'repos', user, repo_name, 'issues', issue_num)
+    if issue is None:
+        return None
+    return '\x0314Issue #{num}: {title}\x03 (\x0308{state}\x03, filed by \x0302{user}\x03)'.format(
+        num=issue_num,
+        title=issue['title'],
+        state=issue['state'],
+        user=issue['user']['login'],
+    )
+
+
+def pr_info(bot, match):
     """Show GitHub project pull request information."""
-    user, repo_name, pr_num = msg.match.groups()
-
-    github = github3.GitHub()
-    try:
-        repo = github.repository(user, repo_name)
-        pr = repo.pull_request(int(pr_num))
-        msg.respond(
-            '\x0314PR #{num}: {title}\x03 (\x0308{state}\x03, submitted by \x0302{user}\x03)'.format(
-                num=pr_num,
-                title=pr.title,
-                state=pr.state,
-                user=pr.user.login,
-            ),
-            ping=False,
-        )
-    except github3.exceptions.NotFoundError:
-        pass
+    user, repo_name, pr_num = match.groups()
+
+    pr = fetch(bot, 'repos', user, repo_name, 'pulls', pr_num)
+    if pr is None:
+        return None
+    return '\x0314PR #{num}: {title}\x03 (\x0308{state}\x03, submitted by \x0302{user}\x03)'.format(
+        num=pr_num,
+        title=pr['title'],
+        state=pr['state'],
+        user=pr['user']['login'],
+    )
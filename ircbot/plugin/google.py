@@ -1,19 +1,147 @@
 """Let me Google that for you."""
+import json
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from typing import Optional
+
+import pytz
 import requests
 
+from ircbot import cache
+from ircbot import files
+from ircbot import web
+
+# Results don't change much, and each search counts against a daily quota,
+# so they're kept (on disk, so they last between restarts) for this long
+RESULT_TTL_SECONDS = 24 * 60 * 60
+NO_RESULTS_TTL_SECONDS = 60 * 60
+
+# Searches we can make each day. Google allows 100 free a day, after which
+# the API starts answering 429 Too Many Requests, so stop a little short
+# (leaving some for anyone else using the same key) and say so instead.
+DAILY_QUOTA = 90
+
+# The quota resets at midnight Pacific time, not whenever it is here
+QUOTA_TIMEZONE = pytz.timezone('America/Los_Angeles')
+
+CACHE_FILE = 'google.sqlite3'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    query TEXT PRIMARY KEY,
+    result TEXT,
+    fetched REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS quota (
+    day TEXT PRIMARY KEY,
+    used INTEGER NOT NULL
+);
+"""
+
+# Kept by normalized query, the same as on disk
+results = cache.namespace('google', ttl=RESULT_TTL_SECONDS, negative_ttl=NO_RESULTS_TTL_SECONDS)
+
+_db: Optional[sqlite3.Connection] = None
+_db_lock = threading.Lock()
+
 
 class GoogleNoResultsError(Exception):
     pass
 
 
+class GoogleQuotaError(Exception):
+    pass
+
+
 def register(bot):
     bot.listen(r'!g (.+)$', google)
     bot.listen(r'!yt (.+)$', youtube)
 
 
+def normalize(query):
+    """Return query in a form that's the same for searches Google treats the same."""
+    return ' '.join(query.casefold().split())
+
+
+def db() -> sqlite3.Connection:
+    """Return the connection to the cache file, opening it if needed (with _db_lock held)."""
+    global _db
+    if _db is None:
+        _db = sqlite3.connect(files.cache_path(CACHE_FILE), check_same_thread=False, isolation_level=None)
+        _db.executescript(SCHEMA)
+    return _db
+
+
+def stored_result(query):
+    """Return whether there's a fresh result for query on disk, and what it is."""
+    with _db_lock:
+        row = db().execute('SELECT result, fetched FROM results WHERE query = ?', (query,)).fetchone()
+    if row is None:
+        return False, None
+    result, fetched = row
+    ttl = RESULT_TTL_SECONDS if result is not None else NO_RESULTS_TTL_SECONDS
+    if time.time() - fetched > ttl:
+        return False, None
+    return True, json.loads(result) if result is not None else None
+
+
+def store_result(query, result):
+    with _db_lock:
+        conn = db()
+        conn.execute(
+            'INSERT OR REPLACE INTO results (query, result, fetched) VALUES (?, ?, ?)',
+            (query, json.dumps(result) if result is not None else None, time.time()),
+        )
+        # Throw away anything too old to be used
+        conn.execute('DELETE FROM results WHERE fetched < ?', (time.time() - RESULT_TTL_SECONDS,))
+
+
+def quota_day() -> str:
+    """Return the day that searches count against, as Google sees it."""
+    return datetime.now(QUOTA_TIMEZONE).date().isoformat()
+
+
+def use_quota():
+    """Count a search against today's quota, or raise GoogleQuotaError if it's used up."""
+    today = quota_day()
+    with _db_lock:
+        conn = db()
+        row = conn.execute('SELECT used FROM quota WHERE day = ?', (today,)).fetchone()
+        used = row[0] if row is not None else 0
+        if used >= DAILY_QUOTA:
+            raise GoogleQuotaError
+        conn.execute('INSERT OR REPLACE INTO quota (day, used) VALUES (?, ?)', (today, used + 1))
+        conn.execute('DELETE FROM quota WHERE day != ?', (today,))
+
+
+def quota_used_up():
+    """Record that Google says the quota's gone, whatever we thought."""
+    with _db_lock:
+        db().execute(
+            'INSERT OR REPLACE INTO quota (day, used) VALUES (?, ?)',
+            (quota_day(), DAILY_QUOTA),
+        )
+
+
 def google_query(key, cx, query):
     """Searches Google and returns the first result."""
-    resp = requests.get(
+    result = results.get((key, cx, normalize(query)), lambda: first_result(key, cx, query))
+    if result is None:
+        raise GoogleNoResultsError
+    return result
+
+
+def first_result(key, cx, query):
+    # Only the cache is keyed by the normalized query, Google gets it as
+    # typed (operators like OR are case sensitive)
+    found, result = stored_result(normalize(query))
+    if found:
+        return result
+
+    use_quota()
+    resp = web.get(
         'https://www.googleapis.com/customsearch/v1',
         params={
             'key': key,
@@ -22,14 +150,20 @@ def google_query(key, cx, query):
             'q': query,
         },
     )
+    if resp.status_code == requests.codes.too_many_requests:
+        quota_used_up()
+        raise GoogleQuotaError
 
     resp.raise_for_status()
 
-    results = resp.json()
-    if len(results.get('items', ())) == 0:
-        raise GoogleNoResultsError
-
-    return results['items'][0]
+    items = resp.json().get('items', ())
+    if len(items) == 0:
+        result = None
+    else:
+        # That's all we show, and all that's worth keeping
+        result = {'title': items[0]['title'], 'link': items[0]['link']}
+    store_result(normalize(query), result)
+    return result
 
 
 def irc_search(bot, msg, query):
@@ -50,6 +184,8 @@ def irc_search(bot, msg, query):
         )
     except GoogleNoResultsError:
         msg.respond('no results :(', ping=False)
+    except GoogleQuotaError:
+        msg.respond('out of google searches for today, try again tomorrow :(', ping=False)
 
 
 def youtube(bot, msg):
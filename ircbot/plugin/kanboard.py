@@ -4,18 +4,23 @@ import re
 from ocflib.infra.kanboard import KanboardError
 from ocflib.infra.kanboard import KanboardTask
 
+from ircbot import cache
+
 REGEX = re.compile(r'(?:k#)([0-9]+)')
 
 
 def register(bot):
-    bot.listen(REGEX.pattern, show_task)
+    bot.add_unfurler(REGEX.pattern, show_task, ping=True)
 
 
-def show_task(bot, msg):
+def show_task(bot, match):
     """Show the Kanboard task and don't break the webserver ;)"""
-    for task in REGEX.findall(msg.text):
-        try:
-            k = KanboardTask.from_number('gstaff', bot.kanboard_apikey, int(task))
-            msg.respond(str(k))
-        except KanboardError:
-            pass
+    return task_info(bot.kanboard_apikey, int(match.group(1)))
+
+
+@cache.cached('kanboard', ttl=5 * 60, negative_ttl=60)
+def task_info(apikey, number):
+    try:
+        return str(KanboardTask.from_number('gstaff', apikey, number))
+    except KanboardError:
+        return None
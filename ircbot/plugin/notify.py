@@ -1,15 +1,47 @@
 """Ping multiple users at once in notification groups."""
-from functools import wraps
+import threading
+import time
+from textwrap import dedent
+from traceback import format_exc
+from typing import AbstractSet
+from typing import Dict
+from typing import FrozenSet
+from typing import List
 from typing import Optional
+from typing import Sequence
 from typing import Set
+from typing import Tuple
 
 from ircbot import db
 
-MAX_DEPTH = 100
+# The notify table is kept in memory, and loaded again this often in case
+# someone changed it without going through the bot
+RELOAD_SECONDS = 60 * 60
 
+# What to expand: everyone in a group, or just its owners
+EVERYONE = ('owners', 'members')
+OWNERS = ('owners',)
 
-class NotifyExpansionLoopError(Exception):
-    pass
+# Each role in notify_members, and the list of the group it goes in
+ROLES = (('owner', 'owners'), ('member', 'members'))
+
+# Owners and members of each group are kept one per row in notify_members
+# (created by sql/notify_members.sql). This replaces the space-separated
+# owners and members columns of the notify table, which are moved over (and
+# set to NULL) when the bot starts, and whenever a group that still has them
+# is changed. Until then, they're read as well. If notify_members hasn't
+# been created yet, the old columns are used for everything.
+
+# A group, by list ('owners' or 'members')
+Group = Dict[str, List[str]]
+
+_graph: Optional['NotifyGraph'] = None
+_graph_loaded = 0.0
+_graph_lock = threading.Lock()
+_reload_lock = threading.Lock()
+
+# Whether notify_members exists, once we've checked
+_members_table: Optional[bool] = None
 
 
 def register(bot):
@@ -27,16 +59,315 @@ def register(bot):
     bot.listen(r'^!notify clear ([^ ]+)$', clear)
     bot.listen(r'^!notify add ', addhelp)
 
+    bot.add_warmup(migrate)
+    bot.add_warmup(graph)
+
+
+def split_targets(targets: Optional[str]) -> List[str]:
+    return [target for target in targets.split(' ') if target] if targets else []
+
+
+class NotifyGraph:
+    """The notify tables, as a graph of groups including other groups with !!slug.
+
+    Each group's expansion is worked out once, and kept until the group or
+    one it includes changes. Loops are found with Tarjan's algorithm for
+    strongly connected components: all the groups in a loop include each
+    other, so they expand to the same thing.
+    """
+
+    def __init__(self, groups: Dict[str, Group]):
+        self.lock = threading.RLock()
+        # Each group's owners and members
+        self.groups: Dict[str, Group] = {}
+        # The groups including each slug (which might not exist)
+        self.parents: Dict[str, Set[str]] = {}
+        # Expansions so far, by slug and what was expanded
+        self.expansions: Dict[Tuple[str, Tuple[str, ...]], FrozenSet[str]] = {}
+        # The groups in each loop, by slug
+        self.loops: Dict[str, FrozenSet[str]] = {}
+
+        for slug, group in groups.items():
+            self.update(slug, group['owners'], group['members'])
+        for slug in self.groups:
+            self.expand(slug)
+
+    def get(self, slug: str) -> Optional[Group]:
+        with self.lock:
+            group = self.groups.get(slug)
+            if group is None:
+                return None
+            return {attr: list(targets) for attr, targets in group.items()}
+
+    def slugs(self) -> List[str]:
+        with self.lock:
+            return list(self.groups)
+
+    def role(self, slug: str, target: str) -> Optional[str]:
+        """Return whether target is directly an owner or member of slug."""
+        with self.lock:
+            group = self.groups.get(slug)
+            if group is None:
+                return None
+            for role, attr in ROLES:
+                if target in group[attr]:
+                    return role
+            return None
+
+    def subgroups(self, slug: str, attrs: Tuple[str, ...] = EVERYONE) -> List[str]:
+        group = self.groups[slug]
+        return [
+            target[2:]
+            for attr in attrs
+            for target in group[attr]
+            if target.startswith('!!')
+        ]
+
+    def expand(self, slug: str, attrs: Tuple[str, ...] = EVERYONE) -> Optional[FrozenSet[str]]:
+        """Return everyone in a group (or just the owners), or None if it doesn't exist."""
+        with self.lock:
+            if slug not in self.groups:
+                return None
+            if (slug, attrs) not in self.expansions:
+                self._expand_from(slug, attrs)
+            return self.expansions[slug, attrs]
+
+    def loop(self, slug: str) -> Optional[FrozenSet[str]]:
+        """Return the groups in a loop with slug, if it's in one."""
+        with self.lock:
+            self.expand(slug)
+            return self.loops.get(slug)
+
+    def _expand_from(self, start: str, attrs: Tuple[str, ...]):
+        """Expand start, and the groups it includes which haven't been already.
+
+        Tarjan's algorithm finishes each strongly connected component after
+        all the ones it leads to, so they're expanded in the right order.
+        This is done without recursion, since groups can be nested deeply.
+        """
+        index: Dict[str, int] = {}
+        low: Dict[str, int] = {}
+        stack: List[str] = []
+        on_stack: Set[str] = set()
+
+        def visit(slug):
+            index[slug] = low[slug] = len(index)
+            stack.append(slug)
+            on_stack.add(slug)
+            return slug, iter(self.subgroups(slug, attrs))
+
+        path = [visit(start)]
+        while path:
+            slug, children = path[-1]
+            for child in children:
+                if child not in self.groups or (child, attrs) in self.expansions:
+                    continue
+                if child not in index:
+                    path.append(visit(child))
+                    break
+                if child in on_stack:
+                    low[slug] = min(low[slug], index[child])
+            else:
+                path.pop()
+                if path:
+                    parent = path[-1][0]
+                    low[parent] = min(low[parent], low[slug])
+                if low[slug] == index[slug]:
+                    component: List[str] = []
+                    while not component or component[-1] != slug:
+                        component.append(stack.pop())
+                        on_stack.discard(component[-1])
+                    self._expand_component(component, attrs)
+
+    def _expand_component(self, component: List[str], attrs: Tuple[str, ...]):
+        in_component = set(component)
+        targets: Set[str] = set()
+        looped = len(component) > 1
+        for slug in component:
+            for attr in attrs:
+                for target in self.groups[slug][attr]:
+                    if not target.startswith('!!'):
+                        targets.add(target)
+                    elif target[2:] in in_component:
+                        looped = True
+                    elif (target[2:], attrs) in self.expansions:
+                        targets |= self.expansions[target[2:], attrs]
+
+        expansion = frozenset(targets)
+        for slug in component:
+            self.expansions[slug, attrs] = expansion
+            if looped and attrs == EVERYONE:
+                self.loops[slug] = frozenset(component)
+
+    def _invalidate(self, slug: str):
+        """Forget the expansions of slug, and every group including it."""
+        seen = {slug}
+        todo = [slug]
+        while todo:
+            current = todo.pop()
+            for attrs in (EVERYONE, OWNERS):
+                self.expansions.pop((current, attrs), None)
+            self.loops.pop(current, None)
+            for parent in self.parents.get(current, ()):
+                if parent not in seen:
+                    seen.add(parent)
+                    todo.append(parent)
+
+    def update(self, slug: str, owners: Sequence[str], members: Sequence[str]):
+        """Record a group being created or changed."""
+        with self.lock:
+            self.remove(slug)
+            self.groups[slug] = {'owners': list(owners), 'members': list(members)}
+            for subgroup in self.subgroups(slug):
+                self.parents.setdefault(subgroup, set()).add(slug)
+
+    def remove(self, slug: str):
+        """Record a group being deleted."""
+        with self.lock:
+            self._invalidate(slug)
+            if slug in self.groups:
+                for subgroup in self.subgroups(slug):
+                    self.parents[subgroup].discard(slug)
+                del self.groups[slug]
+
+    def add_target(self, slug: str, target: str, role: str):
+        """Record target becoming an owner or member of slug (and not the other)."""
+        with self.lock:
+            group = self.groups[slug]
+            owners = [owner for owner in group['owners'] if owner != target]
+            members = [member for member in group['members'] if member != target]
+            (owners if role == 'owner' else members).append(target)
+            self.update(slug, owners, members)
+
+    def remove_target(self, slug: str, target: str):
+        with self.lock:
+            group = self.groups[slug]
+            self.update(
+                slug,
+                [owner for owner in group['owners'] if owner != target],
+                [member for member in group['members'] if member != target],
+            )
 
-def handle_loop_error(fn):
-    """Decorate fn to manually catch expansion errors, so they don't send emails."""
-    @wraps(fn)
-    def handled_fn(bot, msg):
-        try:
-            return fn(bot, msg)
-        except NotifyExpansionLoopError as e:
-            msg.respond(str(e))
-    return handled_fn
+
+def load_groups(cursor, slug: Optional[str] = None) -> Dict[str, Group]:
+    """Read every group (or just slug), including any that haven't been migrated yet."""
+    where, args = ('WHERE slug = %s', (slug,)) if slug is not None else ('', ())
+    cursor.execute(f'SELECT slug, owners, members FROM notify {where}', args)
+    groups = {
+        row['slug']: {'owners': split_targets(row['owners']), 'members': split_targets(row['members'])}
+        for row in cursor.fetchall()
+    }
+    if not members_table(cursor):
+        return groups
+    cursor.execute(f'SELECT slug, target, role FROM notify_members {where} ORDER BY id', args)
+    for row in cursor.fetchall():
+        group = groups.get(row['slug'])
+        if group is not None and row['target'] not in group['owners'] + group['members']:
+            group[dict(ROLES)[row['role']]].append(row['target'])
+    return groups
+
+
+def loaded_graph(bot) -> Optional[NotifyGraph]:
+    """Return the graph if it's been loaded, without waiting for it.
+
+    If it's getting old, it's loaded again in the background, and this
+    carries on returning the old one until that's done.
+    """
+    notify_graph = _graph
+    if (
+        notify_graph is not None and
+        time.monotonic() - _graph_loaded > RELOAD_SECONDS and
+        _reload_lock.acquire(blocking=False)
+    ):
+        threading.Thread(target=reload_graph, args=(bot,), name='notify-reload', daemon=True).start()
+    return notify_graph
+
+
+def reload_graph(bot):
+    try:
+        graph(bot)
+    except Exception as ex:
+        bot.handle_error(
+            dedent(
+                """
+            ircbot exception reloading notify groups: {exception}
+
+            {traceback}
+            """,
+            ).format(
+                exception=ex,
+                traceback=format_exc(),
+            ),
+        )
+    finally:
+        _reload_lock.release()
+
+
+def graph(bot) -> NotifyGraph:
+    """Return the notify tables as a graph, loading them if they're not loaded or getting old."""
+    global _graph, _graph_loaded, _members_table
+    with _graph_lock:
+        if _graph is None or time.monotonic() - _graph_loaded > RELOAD_SECONDS:
+            if not _members_table:
+                # See if it's been created since we last looked
+                _members_table = None
+            with db.cursor(password=bot.mysql_password) as c:
+                _graph = NotifyGraph(load_groups(c))
+            _graph_loaded = time.monotonic()
+        return _graph
+
+
+def members_table(cursor) -> bool:
+    """Return whether notify_members has been created."""
+    global _members_table
+    if _members_table is None:
+        cursor.execute(
+            'SELECT COUNT(*) AS count FROM information_schema.tables '
+            'WHERE table_schema = DATABASE() AND table_name = %s',
+            ('notify_members',),
+        )
+        _members_table = cursor.fetchone()['count'] > 0
+    return _members_table
+
+
+def migrate(bot):
+    """Move every group still in the old columns into notify_members, if it's been created."""
+    with db.cursor(password=bot.mysql_password) as c:
+        if not members_table(c):
+            print('notify_members does not exist (see sql/notify_members.sql), using the old notify columns')
+            return
+        c.execute('SELECT slug FROM notify WHERE owners IS NOT NULL OR members IS NOT NULL')
+        slugs = [row['slug'] for row in c.fetchall()]
+        for slug in slugs:
+            migrate_group(c, slug)
+    if slugs:
+        print(f'moved {len(slugs)} notify groups to notify_members')
+
+
+def migrate_group(cursor, slug: str) -> bool:
+    """Move a group's owners and members into notify_members, and return whether it exists.
+
+    This is safe to repeat, or to run twice at once: the old columns are only
+    cleared once everyone in them is in notify_members.
+    """
+    group = get_group(cursor, slug)
+    if group is None:
+        return False
+    if not members_table(cursor) or (group['owners'] is None and group['members'] is None):
+        return True
+
+    # Owners first, so anyone in both stays an owner
+    for role, attr in ROLES:
+        for target in split_targets(group[attr]):
+            cursor.execute(
+                'INSERT IGNORE INTO notify_members (slug, target, role) VALUES (%s, %s, %s)',
+                (slug, target, role),
+            )
+    cursor.execute(
+        'UPDATE notify SET owners = NULL, members = NULL WHERE slug = %s',
+        (slug,),
+    )
+    return True
 
 
 def get_group(cursor, slug: str):
@@ -47,48 +378,130 @@ def get_group(cursor, slug: str):
     return cursor.fetchone()
 
 
-def expand(cursor, targets: str, depth: int = 0) -> Set[str]:
-    """Perform expansion on the targets string."""
-    result = set()
-    target_arr = targets.split(' ')
-    for target in target_arr:
-        if target[:2] != '!!':
-            result.add(target)
+def put_target(cursor, slug: str, target: str, role: str, move: bool = False) -> int:
+    """Make target an owner or member of slug.
+
+    Returns 0 if it already was (or without move, was either), 1 if it's
+    been added, and 2 if it's been moved from the other role.
+    """
+    if members_table(cursor):
+        if move:
+            # This affects 1 row for an insert, 2 for a change, and 0 for no change
+            cursor.execute(
+                'INSERT INTO notify_members (slug, target, role) VALUES (%s, %s, %s) '
+                'ON DUPLICATE KEY UPDATE role = VALUES(role)',
+                (slug, target, role),
+            )
         else:
-            subtargets = get_all_targets(cursor, target[2:], depth + 1)
-            if subtargets is not None:
-                result |= subtargets
-    return result
+            cursor.execute(
+                'INSERT IGNORE INTO notify_members (slug, target, role) VALUES (%s, %s, %s)',
+                (slug, target, role),
+            )
+        return cursor.rowcount
+
+    group = get_group(cursor, slug)
+    owners, members = split_targets(group['owners']), split_targets(group['members'])
+    same, other = (owners, members) if role == 'owner' else (members, owners)
+    if target in same or (target in other and not move):
+        return 0
+    moved = target in other
+    if moved:
+        other.remove(target)
+    same.append(target)
+    update_columns(cursor, slug, owners, members)
+    return 2 if moved else 1
+
+
+def delete_target(cursor, slug: str, target: str, role: Optional[str] = None) -> bool:
+    """Remove target from slug (only if it has role, if given), and return whether it was there."""
+    if members_table(cursor):
+        if role is None:
+            cursor.execute(
+                'DELETE FROM notify_members WHERE slug = %s AND target = %s',
+                (slug, target),
+            )
+        else:
+            cursor.execute(
+                'DELETE FROM notify_members WHERE slug = %s AND target = %s AND role = %s',
+                (slug, target, role),
+            )
+        return cursor.rowcount > 0
+
+    group = get_group(cursor, slug)
+    targets = {attr_role: split_targets(group[attr]) for attr_role, attr in ROLES}
+    removed = False
+    for attr_role, role_targets in targets.items():
+        if role in (None, attr_role) and target in role_targets:
+            role_targets.remove(target)
+            removed = True
+    if removed:
+        update_columns(cursor, slug, targets['owner'], targets['member'])
+    return removed
+
+
+def reset_group(cursor, slug: str, owner: str):
+    """Make owner the only owner of slug, with no members."""
+    if not members_table(cursor):
+        update_columns(cursor, slug, [owner], [])
+        return
+    # Make sure they're an owner before removing everyone else, so the group
+    # is never left with nobody in it
+    put_target(cursor, slug, owner, 'owner', move=True)
+    cursor.execute(
+        'DELETE FROM notify_members WHERE slug = %s AND target != %s',
+        (slug, owner),
+    )
 
 
-def get_all_targets(cursor, slug: str, depth: int = 0) -> Optional[Set[str]]:
-    """Expand the full unique list of owners and members of slug."""
-    if depth > MAX_DEPTH:
-        raise NotifyExpansionLoopError(f'Hit MAX_DEPTH while expanding !!{slug}. Do you have a loop?')
+def update_columns(cursor, slug: str, owners: List[str], members: List[str]):
+    """Write a group to the old columns, for when there's no notify_members."""
+    cursor.execute(
+        'UPDATE notify SET owners = %s, members = %s WHERE slug = %s',
+        (' '.join(owners), ' '.join(members), slug),
+    )
+
+
+def query_targets(cursor, slug: str, roles: Sequence[str] = ('owner', 'member')) -> Optional[Set[str]]:
+    """Expand a group in the database with one query, or return None if it doesn't exist.
 
-    subtarget = get_group(cursor, slug)
-    if subtarget is None:
+    This is for when the graph isn't loaded yet, so it only sees groups that
+    have been migrated to notify_members.
+    """
+    placeholders = ', '.join(['%s'] * len(roles))
+    cursor.execute(
+        f"""
+        WITH RECURSIVE included (slug) AS (
+            SELECT slug FROM notify WHERE slug = %s
+            UNION
+            SELECT SUBSTRING(m.target, 3) FROM notify_members m
+            JOIN included i ON m.slug = i.slug
+            WHERE m.target LIKE '!!%%' AND m.role IN ({placeholders})
+        )
+        SELECT i.slug, m.target FROM included i
+        LEFT JOIN notify_members m
+        ON m.slug = i.slug AND m.target NOT LIKE '!!%%' AND m.role IN ({placeholders})
+        """,
+        (slug, *roles, *roles),
+    )
+    rows = cursor.fetchall()
+    if not rows:
         return None
+    return {row['target'] for row in rows if row['target'] is not None}
 
-    result = set()
-    if subtarget['owners'] is not None:
-        result |= expand(cursor, subtarget['owners'], depth + 1)
-    if subtarget['members'] is not None:
-        result |= expand(cursor, subtarget['members'], depth + 1)
-    return result
+
+def get_all_targets(graph: NotifyGraph, slug: str) -> Optional[FrozenSet[str]]:
+    """Expand the full unique list of owners and members of slug."""
+    return graph.expand(slug)
 
 
-def expand_owners(cursor, targets: str, depth: int = 0) -> Set[str]:
-    """Performance expansion on the targets string, only keeping owners."""
+def expand_owners(graph: NotifyGraph, targets: List[str]) -> Set[str]:
+    """Performance expansion on the targets, only keeping owners."""
     result = set()
-    target_arr = targets.split(' ')
-    for target in target_arr:
+    for target in targets:
         if target[:2] != '!!':
             result.add(target)
         else:
-            subtarget = get_group(cursor, target[:2])
-            if subtarget is not None and subtarget['owners'] is not None:
-                result |= expand_owners(cursor, subtarget['owners'], depth + 1)
+            result |= graph.expand(target[2:], OWNERS) or set()
     return result
 
 
@@ -99,82 +512,106 @@ def deping(target: str) -> str:
     return target[:1] + '\u2060' + target[1:]
 
 
-def expand_list(cursor, targets: str, depth: int = 0) -> str:
-    """Generate an expanded string representing the targets string."""
-    if depth > MAX_DEPTH:
-        raise NotifyExpansionLoopError(f'Hit MAX_DEPTH while expanding {targets}. Do you have a loop?')
-
+def expand_list(graph: NotifyGraph, targets: List[str], path: Tuple[str, ...] = ()) -> str:
+    """Generate an expanded string representing the targets."""
     result = ''
-    for target in targets.split(' '):
+    for target in targets:
         if target[:2] != '!!':
             result += deping(target) + ' '
+            continue
 
+        subtarget = graph.get(target[2:])
+        if subtarget is None:
+            result += f'{target}(Not found!) '
+        elif target[2:] in path:
+            result += f'{target}(Loop!) '
         else:
-            subtarget = get_group(cursor, target[2:])
-            if subtarget is None:
-                result += f'{target}(Not found!) '
-            else:
-                owners = subtarget['owners'] and expand_list(cursor, subtarget['owners'], depth + 1)
-                members = subtarget['members'] and expand_list(cursor, subtarget['members'], depth + 1)
-                result += f'{target}({owners} | {members}) '
+            subpath = path + (target[2:],)
+            owners = expand_list(graph, subtarget['owners'], subpath)
+            members = expand_list(graph, subtarget['members'], subpath)
+            result += f'{target}({owners} | {members}) '
 
     # remove trailing space
     return result[:-1]
 
 
-def is_owner(cursor, respond, group, nick: str) -> bool:
-    if group['owners'] is None:
+def is_owner(graph: NotifyGraph, slug: str, nick: str) -> bool:
+    group = graph.get(slug)
+    return group is not None and nick in expand_owners(graph, group['owners'])
+
+
+def check_group(bot, msg, c, slug: str, action: Optional[str]) -> bool:
+    """Make sure a group exists (migrating it if needed), and that msg.nick can action it."""
+    if not migrate_group(c, slug):
+        msg.respond('No such notification group.')
         return False
-    try:
-        return nick in expand_owners(cursor, group['owners'])
-    except NotifyExpansionLoopError as e:
-        respond(f'During owner check: {e} Using rudimentary check instead.', ping=False)
-        return nick in group['owners'].split(' ')
+    notify_graph = graph(bot)
+    if notify_graph.get(slug) is None:
+        # Created since the graph was loaded (by another bot sharing the
+        # database, or by hand), so add it now instead of waiting for a reload
+        for new_slug, group in load_groups(c, slug).items():
+            notify_graph.update(new_slug, group['owners'], group['members'])
+    if action and not msg.is_oper and not is_owner(notify_graph, slug, msg.nick):
+        msg.respond(f'You can\'t {action} {slug}, since you\'re neither an oper, nor an owner of the group.')
+        return False
+    return True
 
 
-@handle_loop_error
 def notify(bot, msg):
     """Notify all targets (owners and members) in the tagged notificaton group."""
     slug = msg.match.group(1)
-    with db.cursor(password=bot.mysql_password) as c:
-        targets = get_all_targets(c, slug)
-        if targets is not None:
-            targets_str = ' '.join(targets)
-            msg.respond(f'{slug}: {targets_str}', ping=False)
+    notify_graph = loaded_graph(bot)
+    targets: Optional[AbstractSet[str]]
+    if notify_graph is not None:
+        targets = get_all_targets(notify_graph, slug)
+    else:
+        with db.cursor(password=bot.mysql_password) as c:
+            migrated = members_table(c)
+            if migrated:
+                targets = query_targets(c, slug)
+        if not migrated:
+            # There's no quick way to expand the old columns, so wait for the graph
+            targets = get_all_targets(graph(bot), slug)
+    if targets is not None:
+        targets_str = ' '.join(targets)
+        msg.respond(f'{slug}: {targets_str}', ping=False)
 
 
-@handle_loop_error
 def show(bot, msg):
     """Show owners and members of the notification group."""
     slug = msg.match.group(1)
-    with db.cursor(password=bot.mysql_password) as c:
-        group = get_group(c, slug)
-        if group is None:
-            msg.respond(f'{slug} not found.')
-            return
-        for attr in ('owners', 'members'):
-            if group[attr] is None:
-                msg.respond(f'{slug} has no {attr}', ping=False)
-            else:
-                targets = expand_list(c, group[attr])
-                msg.respond(f'{slug} {attr}: {targets}', ping=False)
+    notify_graph = graph(bot)
+    group = notify_graph.get(slug)
+    if group is None:
+        msg.respond(f'{slug} not found.')
+        return
+    for attr in ('owners', 'members'):
+        if not group[attr]:
+            msg.respond(f'{slug} has no {attr}', ping=False)
+        else:
+            targets = expand_list(notify_graph, group[attr], (slug,))
+            msg.respond(f'{slug} {attr}: {targets}', ping=False)
+
+    loop = notify_graph.loop(slug)
+    if loop is not None:
+        loop_str = ' '.join(f'!!{other}' for other in sorted(loop))
+        msg.respond(f'{slug} is in a loop with {loop_str}', ping=False)
 
 
 def showdumb(bot, msg):
     """Show the notification group, but don't expand subgroups."""
     slug = msg.match.group(1)
-    with db.cursor(password=bot.mysql_password) as c:
-        group = get_group(c, slug)
-        if group is None:
-            msg.respond(f'{slug} not found.')
-            return
-        for attr in ('owners', 'members'):
-            if group[attr] is None:
-                msg.respond(f'{slug} has no {attr}', ping=False)
-            else:
-                targets = [deping(target) for target in group[attr].split(' ')]
-                joined_targets = ' '.join(targets)
-                msg.respond(f'{slug} {attr}: {joined_targets}', ping=False)
+    group = graph(bot).get(slug)
+    if group is None:
+        msg.respond(f'{slug} not found.')
+        return
+    for attr in ('owners', 'members'):
+        if not group[attr]:
+            msg.respond(f'{slug} has no {attr}', ping=False)
+        else:
+            targets = [deping(target) for target in group[attr]]
+            joined_targets = ' '.join(targets)
+            msg.respond(f'{slug} {attr}: {joined_targets}', ping=False)
 
 
 def create(bot, msg):
@@ -187,69 +624,56 @@ def create(bot, msg):
             return
 
         c.execute(
-            'INSERT INTO notify (slug, owners) VALUES (%s, %s)',
-            (slug, msg.nick),
+            'INSERT INTO notify (slug) VALUES (%s)',
+            (slug,),
         )
+        put_target(c, slug, msg.nick, 'owner')
+        graph(bot).update(slug, [msg.nick], [])
         msg.respond(f'Empty group "{slug}" added. You are the only owner.')
 
 
-@handle_loop_error
 def delete(bot, msg):
     """Delete a notifcation group."""
     slug = msg.match.group(1)
     with db.cursor(password=bot.mysql_password) as c:
-        group = get_group(c, slug)
-        if group is None:
-            msg.respond('No such notification group.')
-            return
-
-        if not msg.is_oper and not is_owner(c, msg.respond, group, msg.nick):
-            msg.respond(f'You can\'t delete {slug}, since you\'re neither an oper, nor an owner of the group.')
+        if not check_group(bot, msg, c, slug, 'delete'):
             return
 
         c.execute(
             'DELETE FROM notify WHERE slug = %s',
             (slug,),
         )
+        if members_table(c):
+            c.execute(
+                'DELETE FROM notify_members WHERE slug = %s',
+                (slug,),
+            )
+        graph(bot).remove(slug)
         msg.respond(f'{slug} has been deleted.')
 
 
 def list_groups(bot, msg):
     """List all notification groups."""
-    with db.cursor(password=bot.mysql_password) as c:
-        c.execute('SELECT slug FROM notify')
-        slugs = sorted(group['slug'] for group in c.fetchall())
-        msg.respond(' '.join(slugs))
+    slugs = sorted(graph(bot).slugs())
+    msg.respond(' '.join(slugs))
 
 
 def addme(bot, msg):
     """Add yourself to a notification group as a member."""
     slug = msg.match.group(1)
     with db.cursor(password=bot.mysql_password) as c:
-        group = get_group(c, slug)
-        if group is None:
-            msg.respond('No such notification group.')
+        if not check_group(bot, msg, c, slug, None):
             return
 
         # If you're already a _direct_ owner or member of this group, do nothing.
-        if group['owners'] and msg.nick in group['owners'].split(' '):
-            msg.respond(f'You\'re already an owner of {slug}!')
-            return
-
-        members = []
-        if group['members']:
-            members = group['members'].split(' ')
-
-        if msg.nick in members:
-            msg.respond(f'You\'re already a member of {slug}!')
+        if put_target(c, slug, msg.nick, 'member') == 0:
+            if graph(bot).role(slug, msg.nick) == 'owner':
+                msg.respond(f'You\'re already an owner of {slug}!')
+            else:
+                msg.respond(f'You\'re already a member of {slug}!')
             return
 
-        members.append(msg.nick)
-
-        c.execute(
-            'UPDATE notify SET members = %s WHERE slug = %s',
-            (' '.join(members), slug),
-        )
+        graph(bot).add_target(slug, msg.nick, 'member')
         msg.respond(f'Added you to {slug}, as a member.')
 
 
@@ -257,34 +681,21 @@ def removeme(bot, msg):
     """Remove yourself from a notification group."""
     slug = msg.match.group(1)
     with db.cursor(password=bot.mysql_password) as c:
-        group = get_group(c, slug)
-        if group is None:
-            msg.respond('No such notification group.')
+        if not check_group(bot, msg, c, slug, None):
             return
 
-        # If you're already a _direct_ owner or member of this group, do nothing.
-        if group['owners'] and msg.nick in group['owners'].split(' '):
+        if graph(bot).role(slug, msg.nick) == 'owner':
             msg.respond(
                 f'You\'re an owner of {slug}. ' +
                 'If you\'re sure you want to remove yourself, please use !notify remove.',
             )
             return
 
-        if group['members'] is None:
-            msg.respond(f'You\'re not a member of {slug}!')
-            return
-
-        members = group['members'].split(' ')
-        if msg.nick not in members:
+        if not delete_target(c, slug, msg.nick, 'member'):
             msg.respond(f'You\'re not a member of {slug}!')
             return
 
-        members = [m for m in members if m != msg.nick]
-
-        c.execute(
-            'UPDATE notify SET members = %s WHERE slug = %s',
-            (' '.join(members), slug),
-        )
+        graph(bot).remove_target(slug, msg.nick)
         msg.respond(f'Removed you to from the member list for {slug}.')
 
 
@@ -292,29 +703,16 @@ def addmembers(bot, msg):
     """Add member(s) to a notification group."""
     slug = msg.match.group(1)
     with db.cursor(password=bot.mysql_password) as c:
-        group = get_group(c, slug)
-        if group is None:
-            msg.respond('No such notification group.')
+        if not check_group(bot, msg, c, slug, 'add to'):
             return
 
-        if not msg.is_oper and not is_owner(c, msg.respond, group, msg.nick):
-            msg.respond(f'You can\'t add to {slug}, since you\'re neither an oper, nor an owner of the group.')
-            return
-
-        members = []
-        if group['members'] is not None:
-            members = group['members'].split(' ')
-        owners = []
-        if group['owners'] is not None:
-            owners = group['owners'].split(' ')
-
         present = []
         added = []
         for nick in filter(lambda s: s != '', msg.match.group(2).split(' ')):
-            if nick in members or nick in owners:
+            if put_target(c, slug, nick, 'member') == 0:
                 present.append(nick)
             else:
-                members.append(nick)
+                graph(bot).add_target(slug, nick, 'member')
                 added.append(nick)
 
         if len(present) > 0:
@@ -325,11 +723,6 @@ def addmembers(bot, msg):
         if len(added) == 0:
             return
 
-        c.execute(
-            'UPDATE notify SET members = %s WHERE slug = %s',
-            (' '.join(members), slug),
-        )
-
         added_str = ', '.join(added)
         if len(added) > 1:
             msg.respond(f'{added_str} were added to {slug} as members.')
@@ -341,35 +734,22 @@ def addowners(bot, msg):
     """Add owner(s) to a notification group."""
     slug = msg.match.group(1)
     with db.cursor(password=bot.mysql_password) as c:
-        group = get_group(c, slug)
-        if group is None:
-            msg.respond('No such notification group.')
-            return
-
-        if not msg.is_oper and not is_owner(c, msg.respond, group, msg.nick):
-            msg.respond(f'You can\'t add to {slug}, since you\'re neither an oper, nor an owner of the group.')
+        if not check_group(bot, msg, c, slug, 'add to'):
             return
 
-        members = []
-        if group['members'] is not None:
-            members = group['members'].split(' ')
-        owners = []
-        if group['owners'] is not None:
-            owners = group['owners'].split(' ')
-
         present = []
         moved = []
         added = []
         for nick in filter(lambda s: s != '', msg.match.group(2).split(' ')):
-            if nick in members:
-                members.remove(nick)
-                owners.append(nick)
-                moved.append(nick)
-            elif nick in owners:
+            result = put_target(c, slug, nick, 'owner', move=True)
+            if result == 0:
                 present.append(nick)
-            else:
-                owners.append(nick)
+                continue
+            graph(bot).add_target(slug, nick, 'owner')
+            if result == 1:
                 added.append(nick)
+            else:
+                moved.append(nick)
 
         if len(present) > 0:
             present_str = ', '.join(present)
@@ -378,14 +758,6 @@ def addowners(bot, msg):
             else:
                 msg.respond(f'{present_str} was already an owner of {slug}.')
 
-        if len(added) == 0 and len(moved) == 0:
-            return
-
-        c.execute(
-            'UPDATE notify SET owners = %s, members = %s WHERE slug = %s',
-            (' '.join(owners), ' '.join(members), slug),
-        )
-
         if len(moved) > 0:
             moved_str = ', '.join(moved)
             if len(moved) > 1:
@@ -405,51 +777,28 @@ def remove(bot, msg):
     """Remove targets from a notification group, for both owners and members."""
     slug = msg.match.group(1)
     with db.cursor(password=bot.mysql_password) as c:
-        group = get_group(c, slug)
-        if group is None:
-            msg.respond('No such notification group.')
+        if not check_group(bot, msg, c, slug, 'remove from'):
             return
 
-        if not msg.is_oper and not is_owner(c, msg.respond, group, msg.nick):
-            msg.respond(f'You can\'t remove from {slug}, since you\'re neither an oper, nor an owner of the group.')
-            return
-
-        members = group['members'] and group['members'].split(' ')
-        owners = group['owners'] and group['owners'].split(' ')
-
         missing = []
         former_members = []
         former_owners = []
         for nick in filter(lambda s: s != '', msg.match.group(2).split(' ')):
-            if members and nick in members:
-                members.remove(nick)
-                former_members.append(nick)
-            elif owners and nick in owners:
-                owners.remove(nick)
+            role = graph(bot).role(slug, nick)
+            if not delete_target(c, slug, nick):
+                missing.append(nick)
+                continue
+            graph(bot).remove_target(slug, nick)
+            if role == 'owner':
                 former_owners.append(nick)
             else:
-                missing.append(nick)
+                former_members.append(nick)
 
         if len(missing) > 0:
             missing_str = ', '.join(missing)
             was_plural = 'were' if len(missing) > 1 else 'was'
             msg.respond(f'{missing_str} {was_plural} not in {slug}.')
 
-        if len(former_owners) == 0 and len(former_members) == 0:
-            return
-
-        sql_owners = owners
-        if owners is not None:
-            sql_owners = ' '.join(owners)
-        sql_members = members
-        if members is not None:
-            sql_members = ' '.join(members)
-
-        c.execute(
-            'UPDATE notify SET owners = %s, members = %s WHERE slug = %s',
-            (sql_owners, sql_members, slug),
-        )
-
         if len(former_owners) > 0:
             owners_str = ', '.join(former_owners)
             if len(former_owners) > 1:
@@ -469,19 +818,11 @@ def clear(bot, msg):
     """Reset a notification group, clearing all members."""
     slug = msg.match.group(1)
     with db.cursor(password=bot.mysql_password) as c:
-        group = get_group(c, slug)
-        if group is None:
-            msg.respond('No such notification group.')
+        if not check_group(bot, msg, c, slug, 'clear'):
             return
 
-        if not msg.is_oper and not is_owner(c, msg.respond, group, msg.nick):
-            msg.respond(f'You can\'t clear {slug}, since you\'re neither an oper, nor an owner of the group.')
-            return
-
-        c.execute(
-            'UPDATE notify SET owners = %s, members = NULL WHERE slug = %s',
-            (msg.nick, slug),
-        )
+        reset_group(c, slug, msg.nick)
+        graph(bot).update(slug, [msg.nick], [])
 
         msg.respond(f'{slug} has been cleared. You are now the only owner, and there are no members.')
 
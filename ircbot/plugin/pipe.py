@@ -64,7 +64,7 @@ def run_command(command, bot, msg):
             respond=respond,
         )
         try:
-            listener.fn(bot, stub_msg)
+            bot.call_listener(listener, stub_msg)
         except Exception as ex:
             raise Exception(
                 'Command {} not supported: {}'.format(
@@ -79,6 +79,11 @@ def add(bot, msg):
 
     msg.respond(f'Your quote was added as #{c.lastrowid}')
 
+    # Let turing start quoting it
+    turing = bot.plugins.get('turing')
+    if turing is not None:
+        turing.add_quote(bot, msg.match.group(1))
+
 
 def delete(bot, msg):
     """Delete a quote."""
@@ -20,7 +20,8 @@ def replace(bot, msg):
     def new(_):
         return f'\x02{msg.match.group(3)}\x02'
 
-    for user, recent_msg in bot.recent_messages[msg.channel]:
+    # Copy the recent messages, since new ones can arrive while we're running
+    for user, recent_msg in list(bot.recent_messages[msg.channel]):
         if not REGEX.search(recent_msg):
             try:
                 new_msg = re.sub(old, new, recent_msg)
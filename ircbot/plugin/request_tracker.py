@@ -1,25 +1,97 @@
 """Print RT ticket information."""
 import re
+import threading
+from typing import Optional
 
+import requests
 from ocflib.infra.rt import rt_connection
 from ocflib.infra.rt import RtTicket
 
+from ircbot import cache
+from ircbot import web
 
 REGEX = re.compile(r'(?:rt#|ocf.io/rt/)([0-9]+)')
 
+# Tickets change owner and status, so don't keep them long
+tickets = cache.namespace('rt', ttl=2 * 60, negative_ttl=60)
+
+# Logged in on first use, and again whenever RT forgets us
+_session: Optional[requests.Session] = None
+_session_lock = threading.Lock()
+
+
+class LoginNeeded(Exception):
+    pass
+
+
+class Connection:
+    """What RtTicket needs of a session, with requests going through web."""
+
+    def __init__(self, rt: requests.Session):
+        self.rt = rt
+
+    def get(self, url, **kwargs) -> requests.Response:
+        resp = web.get(url, client=self.rt, **kwargs)
+        if needs_login(resp):
+            raise LoginNeeded(resp.text.split('\n', 1)[0])
+        # Anything else going wrong isn't the ticket being missing
+        resp.raise_for_status()
+        return resp
+
 
 def register(bot):
-    bot.listen(REGEX.pattern, show_ticket)
+    # Each reference is looked up separately (and at the same time as the
+    # others in the message), sharing one logged in session
+    bot.add_unfurler(REGEX.pattern, show_ticket, ping=True)
+
 
+def session(bot, stale: Optional[requests.Session] = None) -> requests.Session:
+    """Return the shared RT session, logging in if there isn't one or it's stale."""
+    global _session
+    with _session_lock:
+        if _session is None or _session is stale:
+            _session = rt_connection(user='create', password=bot.rt_password)
+        return _session
 
-def show_ticket(bot, msg):
+
+def show_ticket(bot, match):
     """Show RT ticket details."""
-    rt = rt_connection(user='create', password=bot.rt_password)
-    for ticket in REGEX.findall(msg.text):
+    number = int(match.group(1))
+    return tickets.get(number, lambda: ticket_info(bot, number))
+
+
+def ticket_info(bot, number):
+    # Only ever cache tickets after redacting them
+    t = fetch_ticket(bot, number)
+    if t is None:
+        return None
+    if t.queue == 'security':
+        t = t._replace(subject='(security ticket)')
+    return str(t)
+
+
+def fetch_ticket(bot, number) -> Optional[RtTicket]:
+    rt = session(bot)
+    try:
+        return read_ticket(rt, number)
+    except LoginNeeded:
+        # Sessions expire after a while, so log in again (once) and retry
         try:
-            t = RtTicket.from_number(rt, int(ticket))
-            if t.queue == 'security':
-                t = t._replace(subject='(security ticket)')
-            msg.respond(str(t))
-        except AssertionError:
-            pass
+            return read_ticket(session(bot, stale=rt), number)
+        except LoginNeeded as ex:
+            raise RuntimeError(f'RT rejected our login: {ex}')
+
+
+def read_ticket(rt, number) -> Optional[RtTicket]:
+    try:
+        t = RtTicket.from_number(Connection(rt), number)
+    except AssertionError:
+        return None
+    # Missing tickets still come back as 200 Ok, with "# Ticket 123 does not exist."
+    if t.subject is None:
+        return None
+    return t
+
+
+def needs_login(resp: requests.Response) -> bool:
+    return resp.status_code == 401 or '401 Credentials required' in resp.text.split('\n', 1)[0]
@@ -1,16 +1,42 @@
 """Print information about Stack Exchange links."""
-import functools
+import collections
+import json
 import re
+import threading
+import time
 import urllib.parse
 from datetime import datetime
 from typing import Dict
+from typing import Iterable
+from typing import List
 from typing import NamedTuple
+from typing import Optional
+from typing import Tuple
 
-import requests
+from ircbot import cache
+from ircbot import files
+from ircbot import web
 
 
 API = 'https://api.stackexchange.com/2.2'
 
+# Question and answer links, with the type of link and the ID
+REGEX = re.compile(r'https?://([^/\s]+)/(q|questions|a)/([0-9]+)(?=/|\s|$)')
+
+# The list of sites is kept here between restarts, and downloaded again
+# in the background once it's this old
+SITES_FILE = 'stack_exchange_sites.json'
+SITES_MAX_AGE_SECONDS = 24 * 60 * 60
+
+# Most IDs the API takes in one request
+MAX_IDS_PER_REQUEST = 100
+
+# Questions are looked up again after this long, to pick up new votes and answers
+QUESTION_TTL_SECONDS = 15 * 60
+
+# Questions and answers to remember, most recently used first
+MAX_CACHED_ITEMS = 512
+
 
 class Site(NamedTuple):
     api_name: str
@@ -25,74 +51,156 @@ class Question(NamedTuple):
     score: int
 
 
-class Answer(NamedTuple):
-    question_id: int
+# Sites by domain, and when they were downloaded
+_sites_map: Optional[Dict[str, Site]] = None
+_sites_fetched = 0.0
+_sites_lock = threading.Lock()
+_refresh_lock = threading.Lock()
 
+# Questions by (site, question ID)
+questions_cache = cache.namespace('stack_exchange_questions', ttl=QUESTION_TTL_SECONDS, max_size=MAX_CACHED_ITEMS)
 
-def register(bot):
-    # Don't want the bot to crash if we fail to load sites at start (or to
-    # delay startup by loading sites), so just listen for all links that look
-    # like a Stack Exchange question and filter later to the right domains.
-    bot.listen(r'https?://([^/]+)/q(?:uestions)?/([0-9]+)(?:/|$)', question)
-    bot.listen(r'https?://([^/]+)/a/([0-9]+)(?:/|$)', answer)
-
-
-@functools.lru_cache(maxsize=1)
-def _sites():
-    resp = requests.get(API + '/sites?pagesize=9999')
-    resp.raise_for_status()
-
-    domain_from_url = re.compile(r'^https://([^/]+)$')
-    sites: Dict[str, Site] = {}
-    for site in resp.json()['items']:
-        domain = domain_from_url.match(site['site_url'])
-        if domain is not None:
-            sites[domain.group(1)] = Site(api_name=site['api_site_parameter'], name=site['name'])
-    return sites
-
+# The question each answer is to, by (site, answer ID). These never change.
+answers_cache = cache.namespace('stack_exchange_answers', ttl=float('inf'), max_size=MAX_CACHED_ITEMS)
 
-def _question_info(site, question_id):
-    resp = requests.get(
-        '{}/questions/{}?{}'.format(
-            API,
-            question_id,
-            urllib.parse.urlencode({'site': site.api_name}),
-        ),
-    )
-    resp.raise_for_status()
-
-    questions = resp.json()['items']
-    if len(questions) != 1:
-        return None
-    question, = questions
-
-    return Question(
-        title=question['title'],
-        owner_name=question['owner']['display_name'],
-        creation_date=datetime.fromtimestamp(question['creation_date']),
-        answer_count=question['answer_count'],
-        score=question['score'],
-    )
 
+def register(bot):
+    # Don't want the bot to crash if we fail to load sites at start, so just
+    # listen for all links that look like a Stack Exchange question or
+    # answer and filter later to the right domains.
+    bot.add_unfurler(REGEX.pattern, show_links, batch=True)
+
+    bot.add_warmup(load_sites)
+
+
+def load_sites(bot):
+    """Read the list of sites from disk, and download it again if it's missing or old."""
+    global _sites_map, _sites_fetched
+    try:
+        with open(files.cache_path(SITES_FILE)) as f:
+            cached = json.load(f)
+        sites = {domain: Site(*site) for domain, site in cached['sites'].items()}
+    except FileNotFoundError:
+        pass
+    except (ValueError, KeyError, TypeError) as ex:
+        print(f'ignoring bad stack exchange sites cache: {ex!r}')
+    else:
+        with _sites_lock:
+            if _sites_map is None:
+                _sites_map = sites
+                _sites_fetched = cached['fetched']
+
+    if _sites_age() > SITES_MAX_AGE_SECONDS:
+        refresh_sites()
+
+
+def _sites_age() -> float:
+    with _sites_lock:
+        return float('inf') if _sites_map is None else time.time() - _sites_fetched
+
+
+def refresh_sites(wait: bool = False):
+    """Download the list of sites and save it.
+
+    If it's already being downloaded, this returns straight away, or with
+    wait, once that's done (and only downloads it if that failed).
+    """
+    global _sites_map, _sites_fetched
+    if not _refresh_lock.acquire(blocking=wait):
+        return
+    try:
+        if wait and _sites_age() <= SITES_MAX_AGE_SECONDS:
+            return
+        resp = web.get(API + '/sites', params={'pagesize': 9999})
+        resp.raise_for_status()
+
+        domain_from_url = re.compile(r'^https://([^/]+)$')
+        sites: Dict[str, Site] = {}
+        for site in resp.json()['items']:
+            domain = domain_from_url.match(site['site_url'])
+            if domain is not None:
+                sites[domain.group(1)] = Site(api_name=site['api_site_parameter'], name=site['name'])
+
+        fetched = time.time()
+        with _sites_lock:
+            _sites_map = sites
+            _sites_fetched = fetched
+        files.write_atomic(
+            files.cache_path(SITES_FILE),
+            json.dumps({'fetched': fetched, 'sites': sites}),
+        )
+    finally:
+        _refresh_lock.release()
+
+
+def _sites() -> Dict[str, Site]:
+    """Return sites by domain, downloading them first if we have none."""
+    with _sites_lock:
+        sites = _sites_map
+    if sites is None:
+        refresh_sites(wait=True)
+        with _sites_lock:
+            sites = _sites_map
+        assert sites is not None
+    elif _sites_age() > SITES_MAX_AGE_SECONDS:
+        threading.Thread(target=refresh_sites, name='stack_exchange', daemon=True).start()
+    return sites
 
-def _answer_info(site, answer_id):
-    resp = requests.get(
-        '{}/answers/{}?{}'.format(
-            API,
-            answer_id,
-            urllib.parse.urlencode({'site': site.api_name}),
-        ),
-    )
-    resp.raise_for_status()
-
-    answers = resp.json()['items']
-    if len(answers) != 1:
-        return None
-    answer, = answers
 
-    return Answer(
-        question_id=answer['question_id'],
-    )
+def _fetch(site: Site, kind: str, ids: Iterable[int]) -> List[dict]:
+    """Look up questions or answers by ID, in as few requests as possible."""
+    ids = sorted(set(ids))
+    items = []
+    for start in range(0, len(ids), MAX_IDS_PER_REQUEST):
+        batch = ';'.join(str(item_id) for item_id in ids[start:start + MAX_IDS_PER_REQUEST])
+        resp = web.get(
+            '{}/{}/{}?{}'.format(
+                API,
+                kind,
+                batch,
+                urllib.parse.urlencode({'site': site.api_name, 'pagesize': MAX_IDS_PER_REQUEST}),
+            ),
+        )
+        resp.raise_for_status()
+        items.extend(resp.json()['items'])
+    return items
+
+
+def _answer_questions(site: Site, answer_ids: List[int]) -> Dict[int, int]:
+    """Return the question ID of each answer that exists."""
+    found = {}
+    for answer_id in answer_ids:
+        cached, question_id = answers_cache.peek((site.api_name, answer_id))
+        if cached:
+            found[answer_id] = question_id
+    missing = [answer_id for answer_id in answer_ids if answer_id not in found]
+    if missing:
+        for answer in _fetch(site, 'answers', missing):
+            found[answer['answer_id']] = answer['question_id']
+            answers_cache.put((site.api_name, answer['answer_id']), answer['question_id'])
+    return found
+
+
+def _question_info(site: Site, question_ids: List[int]) -> Dict[int, Question]:
+    """Return each question that exists, by ID."""
+    found = {}
+    for question_id in question_ids:
+        cached, question = questions_cache.peek((site.api_name, question_id))
+        if cached:
+            found[question_id] = question
+    missing = [question_id for question_id in question_ids if question_id not in found]
+    if missing:
+        for question in _fetch(site, 'questions', missing):
+            info = Question(
+                title=question['title'],
+                owner_name=question['owner']['display_name'],
+                creation_date=datetime.fromtimestamp(question['creation_date']),
+                answer_count=question['answer_count'],
+                score=question['score'],
+            )
+            found[question['question_id']] = info
+            questions_cache.put((site.api_name, question['question_id']), info)
+    return found
 
 
 def _format_question(question, site):
@@ -109,20 +217,38 @@ def _format_question(question, site):
     )
 
 
-def question(bot, msg):
-    """Provide information about a Stack Exchange question."""
-    domain, question_id = msg.match.groups()
-    site = _sites().get(domain)
-    if site is not None:
-        question = _question_info(site, question_id)
-        msg.respond(_format_question(question, site), ping=False)
-
-
-def answer(bot, msg):
-    """Provide information about a Stack Exchange answer (or really just the question)."""
-    domain, answer_id = msg.match.groups()
-    site = _sites().get(domain)
-    if site is not None:
-        answer = _answer_info(site, answer_id)
-        question = _question_info(site, answer.question_id)
-        msg.respond(_format_question(question, site), ping=False)
+def show_links(bot, matches):
+    """Provide information about Stack Exchange questions (for answers, the question they're to)."""
+    sites = _sites()
+    links = [
+        (sites.get(match.group(1)), match.group(2) == 'a', int(match.group(3)))
+        for match in matches
+    ]
+
+    # Look up all the answers on each site at once, then all the questions
+    by_site = collections.defaultdict(list)
+    for site, is_answer, item_id in links:
+        if site is not None:
+            by_site[site].append((is_answer, item_id))
+    found: Dict[Site, Tuple[Dict[int, int], Dict[int, Question]]] = {}
+    for site, site_links in by_site.items():
+        answers = _answer_questions(site, [item_id for is_answer, item_id in site_links if is_answer])
+        question_ids = [answers.get(item_id) if is_answer else item_id for is_answer, item_id in site_links]
+        found[site] = (answers, _question_info(site, [q for q in question_ids if q is not None]))
+
+    # Show each question once, for the first link to it
+    previews: List[Optional[str]] = []
+    shown = set()
+    for site, is_answer, item_id in links:
+        question = None
+        if site is not None:
+            answers, questions = found[site]
+            question_id = answers.get(item_id) if is_answer else item_id
+            if (site, question_id) not in shown:
+                question = questions.get(question_id) if question_id is not None else None
+        if question is None:
+            previews.append(None)
+        else:
+            shown.add((site, question_id))
+            previews.append(_format_question(question, site))
+    return previews
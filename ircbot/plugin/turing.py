@@ -1,109 +1,94 @@
 """Is create turing complete?"""
 import re
+import threading
+from traceback import format_exc
+from typing import Optional
 
-import markovify
+from ircbot.markov import SentenceWorker
 
-from ircbot import db
+# How long to wait for a sentence when none are ready
+SENTENCE_WAIT_SECONDS = 1
 
-final_model = None
+# How long to wait for a sentence about a particular word, which isn't made ahead of time
+SEEDED_WAIT_SECONDS = 5
+
+# Sentences are made ahead of time by a separate process, so that working
+# out a good one doesn't hold up the rest of the bot
+worker: Optional[SentenceWorker] = None
+
+# Held while rebuilding the model from scratch
+rebuild_lock = threading.Lock()
 
 
 def register(bot):
-    bot.listen(r'^turing$', markov, flags=re.IGNORECASE, require_mention=True)
-    bot.listen(r'^!t$', markov, flags=re.IGNORECASE)
-    bot.listen(r'^turing regen(?:erate)?$', generate_model, flags=re.IGNORECASE, require_mention=True)
+    global worker
+    worker = SentenceWorker(bot.mysql_password)
 
-    generate_model(bot)
+    bot.listen(r'^turing(?:\s+(?!regen(?:erate)?$)(\S+))?$', markov, flags=re.IGNORECASE, require_mention=True)
+    bot.listen(r'^!t(?:\s+(\S+))?$', markov, flags=re.IGNORECASE)
+    bot.listen(r'^turing regen(?:erate)?$', regenerate, flags=re.IGNORECASE, require_mention=True)
+
+    # Building the model means reading every quote, so don't wait for it
+    bot.add_warmup(load_model)
 
 
 def markov(bot, msg):
-    """Return the best quote ever."""
-    if final_model:
-        # This tries to generate a sentence that doesn't "overlap", or
-        # share too much similarity with seeded text.
-        # Read more here: https://github.com/jsvine/markovify#basic-usage
-        sentence = final_model.make_sentence(tries=200)
-        if sentence:
-            # Put a zero width space in every word to prevent pings.
-            # This is also much simpler than using crazy IRC nick regex.
-            # Put it in the middle of the word since nicks are quoted
-            # using "<@keur>" syntax.  Additionally, remove any -slack at
-            # the end of a nick, to avoid inserting a space like
-            # abcde|-slack (thus pinging abcde).
-            def insert_space(w):
-                halfway = len(re.sub(r'-slack([^A-Za-z0-9_\-\\\[\]{}^`|]|\Z)', r'\1', w)) // 2
-                return w[:halfway] + '\u2060' + w[halfway:]
-            msg.respond(
-                ' '.join(map(insert_space, sentence.split())),
-                ping=False,
-            )
-        else:
-            # This has never happened, but just in case...
-            msg.respond(
-                'Could not generate sentence. Please try again.',
-                ping=True,
-            )
-
-
-def generate_model(bot, msg=None):
-    """Set models equal to final_model global variable."""
-    global final_model
-    final_model = build_model(bot.mysql_password, model_weights=[2, 2, 0.5])
-
-
-def build_model(db_passwd, model_weights=[1, 1, 1]):
-    """Rebuild the markov model using quotes, inspire, and rants databases as seeds."""
-    with db.cursor(password=db_passwd) as c:
-        # Fetch quote data
-        c.execute('SELECT quote FROM quotes WHERE is_deleted = 0')
-        quotes = c.fetchall()
-
-        # Fetch inspire data
-        c.execute('SELECT text FROM inspire')
-        inspirations = c.fetchall()
-
-        # Fetch iconic FOSS rants
-        c.execute('SELECT text FROM markov_rants')
-        rants = c.fetchall()
-
-    # Normalize the quote data... Get rid of IRC junk
-    clean_quotes = [normalize_quote(d['quote']) for d in quotes]
-
-    # Normalize the inspire data... Just lightly prune authors
-    clean_inspirations = [normalize_inspiration(d['text']) for d in inspirations]
-
-    # Normalize the rant data... just remove ending punctuation
-    clean_rants = [normalize_rant(d['text']) for d in rants]
-
-    # Create the three models, and combine them.
-    # More heavily weight our quotes and rants
-    rants_model = markovify.NewlineText('\n'.join(clean_rants))
-    quotes_model = markovify.NewlineText('\n'.join(clean_quotes))
-    inspire_model = markovify.NewlineText('\n'.join(clean_inspirations))
-    return markovify.combine([quotes_model, rants_model, inspire_model], model_weights)
-
-
-def normalize_quote(q):
-    # Remove timestamps
-    cleaned = re.sub(r'\[?\d{2}:\d{2}(:?:\d{2})?\]?', '', q)
-    # Remove "\\" newline separators
-    cleaned = re.sub(r'\\\s*', '', cleaned)
-    # Trim punctuation from end of quotes
-    cleaned = re.sub(r'(\.|\?|!)$', '', cleaned)
-    return cleaned
-
-
-def normalize_inspiration(q):
-    # Remove fancy en dash or double dash that start author clause
-    cleaned = re.sub('—.*$', '', q)
-    cleaned = re.sub('--.*$', '', cleaned)
-    # Remove "\\" newline separators
-    cleaned = re.sub(r'\\\s', '', cleaned)
-    return cleaned.strip()
-
-
-def normalize_rant(r):
-    # Remove sentence ends because we need the newline model
-    # so this will match up with our other datasets
-    cleaned = re.sub(r'(\.|\?|!)$', '', r)
-    return cleaned.strip()
+    """Return the best quote ever. Give a word to hear about that in particular."""
+    assert worker is not None
+    word = msg.match.group(1)
+    # Sentences come ready with zero width spaces in every word, to prevent pings
+    if word:
+        sentence = worker.sentence_about(word, timeout=SEEDED_WAIT_SECONDS)
+    else:
+        sentence = worker.sentence(timeout=SENTENCE_WAIT_SECONDS)
+
+    if sentence:
+        msg.respond(sentence, ping=False)
+    elif word:
+        msg.respond(f"Couldn't come up with anything about {word}.", ping=True)
+    else:
+        msg.respond('Still thinking, try again in a bit.', ping=True)
+
+
+def load_model(bot):
+    """Start the worker, which loads the model from the cache, then rebuild it in case anything changed."""
+    generate_model(bot)
+
+
+def regenerate(bot, msg):
+    """Rebuild the model from scratch."""
+    if rebuild_lock.locked():
+        msg.respond('Already regenerating, hang on.')
+        return
+    msg.respond('Regenerating in the background.')
+    thread = threading.Thread(target=regenerate_in_background, args=(bot, msg), daemon=True)
+    thread.start()
+
+
+def regenerate_in_background(bot, msg):
+    try:
+        generate_model(bot)
+    except Exception as ex:
+        msg.respond(f'Could not regenerate the model: {ex}', ping=False)
+        bot.handle_error(f'ircbot exception regenerating turing model: {ex}\n\n{format_exc()}')
+    else:
+        msg.respond('Regenerated the model.', ping=False)
+
+
+def generate_model(bot):
+    """Rebuild the model from the database, unless a rebuild is already running."""
+    assert worker is not None
+    if not rebuild_lock.acquire(blocking=False):
+        return
+    try:
+        worker.rebuild()
+    finally:
+        rebuild_lock.release()
+
+
+def add_quote(bot, quote):
+    """Add a new quote to the model, without rebuilding it."""
+    # The worker takes commands in order, so a quote added during a rebuild
+    # still ends up in the new model
+    assert worker is not None
+    worker.add_quote(quote)
@@ -2,18 +2,22 @@
 import html
 from functools import lru_cache
 
-import requests
+from ircbot import cache
+from ircbot import web
 
 TWITTER_API = 'https://api.twitter.com'
 
+# Tweets can't be edited, but they can be deleted or made private
+tweets = cache.namespace('twitter', ttl=60 * 60, negative_ttl=10 * 60)
+
 
 def register(bot):
-    bot.listen(r'https?://(?:mobile\.|www\.|m\.)?twitter\.com/[^/]+/status/([0-9]+)', show_tweet)
+    bot.add_unfurler(r'https?://(?:mobile\.|www\.|m\.)?twitter\.com/[^/]+/status/([0-9]+)', show_tweet)
 
 
 @lru_cache(maxsize=1)
 def _get_token(apikeys):
-    resp = requests.post(
+    resp = web.post(
         f'{TWITTER_API}/oauth2/token',
         data={'grant_type': 'client_credentials'},
         auth=apikeys,
@@ -28,7 +32,7 @@ def _get_token(apikeys):
 def _get_tweet(apikeys, status_id, retry=True):
     bearer_token = _get_token(apikeys)
 
-    resp = requests.get(
+    resp = web.get(
         '{}/1.1/statuses/show.json?id={}&tweet_mode=extended'.format(
             TWITTER_API,
             status_id,
@@ -77,8 +81,8 @@ def _format_tweet(tweet):
     )
 
 
-def show_tweet(bot, msg):
+def show_tweet(bot, match):
     """Show the user and content of a linked tweet."""
-    tweet = _get_tweet(bot.twitter_apikeys, msg.match.group(1))
-    if tweet:
-        msg.respond(_format_tweet(tweet), ping=False)
+    status_id = match.group(1)
+    tweet = tweets.get(status_id, lambda: _get_tweet(bot.twitter_apikeys, status_id))
+    return _format_tweet(tweet) if tweet else None
@@ -1,8 +1,32 @@
 """Show the weather."""
 from bisect import bisect
+from concurrent.futures import ThreadPoolExecutor
 
 import requests
 
+from ircbot import cache
+from ircbot import web
+
+# Each lookup makes several requests against our OpenWeatherMap quota
+MAX_CONCURRENT_JOBS = 2
+
+# OpenWeatherMap only updates every ten minutes or so, so a summary is
+# reused for that long
+SUMMARY_TTL_SECONDS = 10 * 60
+
+# Places to remember the coordinates of. Places don't move, so these never expire.
+MAX_CACHED_PLACES = 256
+
+# Summaries by (location, unit)
+summaries = cache.namespace('weather', ttl=SUMMARY_TTL_SECONDS)
+
+# Coordinates and name of each location asked for
+places = cache.namespace('weather_places', ttl=float('inf'), max_size=MAX_CACHED_PLACES)
+
+# The UV index and air quality are fetched alongside each other (and the
+# current weather, when the coordinates are known)
+_fetcher = ThreadPoolExecutor(max_workers=2 * MAX_CONCURRENT_JOBS, thread_name_prefix='weather')
+
 
 def register(bot):
     bot.listen(r'^(?:weather|hot|cold)\s*(-c)?\s?(.*)$', weather, require_mention=True)
@@ -130,11 +154,38 @@ def calculate_aqi(conc):
 
 
 def get_summary(api_key, location, unit='f'):
+    """Return a summary of the weather at location, or None if it can't be found."""
+    return summaries.get((location.casefold(), unit), lambda: fetch_summary(api_key, location, unit))
+
+
+def fetch_summary(api_key, location, unit):
+    _, place = places.peek(location.casefold())
+    j = None
+    if place is None:
+        # The UV index and air quality are looked up by coordinates, so
+        # the current weather has to come first this time
+        j = fetch_weather(api_key, unit, q=location)
+        if j is None:
+            return None
+        place = (j['coord'], j['name'])
+        places.put(location.casefold(), place)
+
+    coord, name = place
+    uv = _fetcher.submit(fetch_uv, api_key, coord)
+    aqi = _fetcher.submit(fetch_aqi, api_key, coord)
+    if j is None:
+        j = fetch_weather(api_key, unit, **coord)
+        assert j is not None
+    return format_summary(name, j, uv.result(), aqi.result(), unit)
+
+
+def fetch_weather(api_key, unit, **where):
+    """Return the current weather at a place (q=name, or lat and lon), or None if it doesn't exist."""
     translation = {'c': 'metric', 'f': 'imperial'}
-    req = requests.get(
+    req = web.get(
         'https://api.openweathermap.org/data/2.5/weather',
         params={
-            'q': location,
+            **where,
             'units': translation[unit],
             'APPID': api_key,
         },
@@ -143,29 +194,34 @@ def get_summary(api_key, location, unit='f'):
         return None
 
     assert req.status_code == 200, req.status_code
-    j = req.json()
+    return req.json()
+
 
-    req_uv = requests.get(
+def fetch_uv(api_key, coord):
+    req_uv = web.get(
         'https://api.openweathermap.org/data/2.5/uvi',
         params={
-            **j['coord'],
+            **coord,
             'APPID': api_key,
         },
     )
     assert req_uv.status_code == 200, req_uv.status_code
-    j_uv = req_uv.json()
+    return req_uv.json()
 
-    req_aqi = requests.get(
+
+def fetch_aqi(api_key, coord):
+    req_aqi = web.get(
         'http://api.openweathermap.org/data/2.5/air_pollution',
         params={
-            **j['coord'],
+            **coord,
             'APPID': api_key,
         },
     )
     assert req_aqi.status_code == 200, req_aqi.status_code
-    j_aqi = req_aqi.json()
+    return req_aqi.json()
+
 
-    name = j['name']
+def format_summary(name, j, j_uv, j_aqi, unit):
     temp = j['main']['temp']
     ico = icon(temp, unit=unit)
 
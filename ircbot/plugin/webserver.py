@@ -5,17 +5,20 @@ import os
 from collections import defaultdict
 from types import ModuleType
 from typing import TYPE_CHECKING
+from typing import Union
 
 from flask import Flask
 from flask import render_template
+from flask import Response
 
 if TYPE_CHECKING:
     from ircbot.ircbot import Listener
+    from ircbot.unfurl import Unfurler
 
 app = Flask(__name__)
 
 # Bot plugins, needed for the / route
-bot_plugins: list[tuple[ModuleType, set[Listener]]] = []
+bot_plugins: list[tuple[ModuleType, set[Union[Listener, Unfurler]]]] = []
 
 
 def register(bot):
@@ -28,9 +31,12 @@ def route_base():
 
     if not bot_plugins:
         # Compute and cache the bot's plugins
-        bot_plugin_set: defaultdict[ModuleType, set[Listener]] = defaultdict(set)
-        for listener in app.bot.listeners:
-            bot_plugin_set[app.bot.plugins[listener.plugin_name]].add(listener)
+        bot_plugin_set: defaultdict[ModuleType, set[Union[Listener, Unfurler]]] = defaultdict(set)
+        bot = app.bot
+        for listener in [*bot.listeners, *bot.unfurls.unfurlers]:
+            # The listener running the unfurlers isn't part of a plugin
+            if listener.plugin_name in bot.plugins:
+                bot_plugin_set[bot.plugins[listener.plugin_name]].add(listener)
 
         bot_plugins = sorted(bot_plugin_set.items(), key=lambda p: p[0].__name__)
 
@@ -48,6 +54,14 @@ def route_macros():
     )
 
 
+@app.route('/metrics', methods=['GET'])
+def route_metrics():
+    return Response(
+        app.bot.metrics.render(),
+        mimetype='text/plain; version=0.0.4',
+    )
+
+
 def start_server(bot):
     port = os.getenv('HTTP_PORT', 8888)
     app.bot = bot
@@ -0,0 +1,210 @@
+"""Previews of links and references (like rt#123), looked up together for each message.
+
+Plugins register an unfurler for each kind of reference with
+bot.add_unfurler, instead of a listener. For each message, every reference
+is found in one pass, the ones already previewed in that channel recently
+are dropped, and the rest are looked up at the same time. Previews are
+sent in the order the references appear, so a message full of links takes
+about as long as its slowest lookup.
+"""
+import collections
+import concurrent.futures
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from textwrap import dedent
+from traceback import format_exc
+from typing import Callable
+from typing import Counter
+from typing import DefaultDict
+from typing import Dict
+from typing import Hashable
+from typing import List
+from typing import Match
+from typing import NamedTuple
+from typing import Pattern
+from typing import Tuple
+
+# Don't preview the same reference in a channel again for this long
+REPEAT_SECONDS = 10 * 60
+
+# How long all the lookups for one message can take. Previews that aren't
+# ready by then are dropped.
+BUDGET_SECONDS = 15
+
+# Lookups running at once, across all messages
+MAX_WORKERS = 8
+
+# Messages being unfurled at once. Each one takes a listener worker while it
+# waits for its lookups, so this is its own budget, rather than the limit
+# for one plugin's listeners that every kind of reference would share.
+MAX_MESSAGES = 8
+
+# References to remember for each channel, so a busy channel doesn't grow forever
+MAX_RECENT_PER_CHANNEL = 256
+
+
+class Unfurler(NamedTuple):
+    """A kind of reference, and how to look it up.
+
+    fn is called as fn(bot, match) and returns the preview to send, or None.
+    If batch is set, it's instead called as fn(bot, matches) with every
+    reference of this kind in the message, and returns a list of previews
+    (or Nones) in the same order.
+    """
+    pattern: Pattern
+    fn: Callable
+    batch: bool
+    ping: bool
+
+    # Never set, but unfurlers are shown on the help page alongside listeners
+    require_mention: bool = False
+    require_oper: bool = False
+    require_privileged_oper: bool = False
+
+    @property
+    def help(self) -> str:
+        return self.fn.__doc__ or ''
+
+    @property
+    def plugin_name(self) -> str:
+        return self.fn.__module__
+
+    @property
+    def metric_labels(self) -> Dict[str, str]:
+        return {'plugin': self.plugin_name, 'function': self.fn.__name__}
+
+    def key(self, match: Match) -> Hashable:
+        """What counts as the same reference: the same kind, with the same groups."""
+        return (self.plugin_name, self.fn.__name__, match.groups())
+
+
+class Reference(NamedTuple):
+    unfurler: Unfurler
+    match: Match
+
+
+class UnfurlStage:
+    """Every registered unfurler, and the listener that runs them."""
+
+    def __init__(self, max_workers: int = MAX_WORKERS, max_messages: int = MAX_MESSAGES):
+        self.unfurlers: List[Unfurler] = []
+        self.max_messages = max_messages
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='unfurl')
+        self.lock = threading.Lock()
+        # When each reference was last previewed, by channel, oldest first
+        self.recent: DefaultDict[str, 'collections.OrderedDict[Hashable, float]'] = collections.defaultdict(
+            collections.OrderedDict,
+        )
+
+    def add(self, pattern, fn, flags=0, batch=False, ping=False):
+        self.unfurlers.append(Unfurler(pattern=re.compile(pattern, flags), fn=fn, batch=batch, ping=ping))
+
+    def pattern(self) -> str:
+        """Return a pattern matching any reference, to listen for."""
+        return '|'.join(f'(?:{unfurler.pattern.pattern})' for unfurler in self.unfurlers)
+
+    def references(self, text: str) -> List[Reference]:
+        """Find every reference in text, in order, without repeats."""
+        found: Dict[Hashable, Tuple[int, Reference]] = {}
+        for unfurler in self.unfurlers:
+            for match in unfurler.pattern.finditer(text):
+                key = unfurler.key(match)
+                if key not in found:
+                    found[key] = (match.start(), Reference(unfurler, match))
+        return [reference for _, reference in sorted(found.values(), key=lambda item: item[0])]
+
+    def claim(self, channel: str, references: List[Reference]) -> List[Reference]:
+        """Return the references not previewed in channel recently, and mark them as previewed."""
+        now = time.monotonic()
+        fresh = []
+        with self.lock:
+            recent = self.recent[channel]
+            while recent and next(iter(recent.values())) < now - REPEAT_SECONDS:
+                recent.popitem(last=False)
+            for reference in references:
+                key = reference.unfurler.key(reference.match)
+                if key not in recent:
+                    fresh.append(reference)
+                    recent[key] = now
+            while len(recent) > MAX_RECENT_PER_CHANNEL:
+                recent.popitem(last=False)
+        return fresh
+
+    def forget(self, channel: str, reference: Reference):
+        """Allow a reference to be previewed again, after failing to preview it."""
+        with self.lock:
+            self.recent[channel].pop(reference.unfurler.key(reference.match), None)
+
+    def unfurl(self, bot, msg):
+        """Show previews of links and references."""
+        found = self.references(msg.text)
+        references = self.claim(msg.channel, found)
+        for reference in found:
+            if reference not in references:
+                labels = reference.unfurler.metric_labels
+                bot.metrics.inc('ircbot_unfurls_total', labels={**labels, 'outcome': 'repeat'})
+        deadline = time.monotonic() + BUDGET_SECONDS
+
+        # Batched unfurlers are called once, and their previews shared out
+        futures = []
+        batches: Dict[Unfurler, concurrent.futures.Future] = {}
+        batch_sizes: Counter[Unfurler] = collections.Counter()
+        for reference in references:
+            unfurler = reference.unfurler
+            if not unfurler.batch:
+                futures.append(self.pool.submit(unfurler.fn, bot, reference.match))
+                continue
+            if unfurler not in batches:
+                matches = [other.match for other in references if other.unfurler == unfurler]
+                batches[unfurler] = self.pool.submit(unfurler.fn, bot, matches)
+            futures.append(self._nth(batches[unfurler], batch_sizes[unfurler]))
+            batch_sizes[unfurler] += 1
+
+        for reference, future in zip(references, futures):
+            labels = reference.unfurler.metric_labels
+            try:
+                preview = future.result(timeout=max(0, deadline - time.monotonic()))
+            except concurrent.futures.TimeoutError:
+                bot.metrics.inc('ircbot_unfurls_total', labels={**labels, 'outcome': 'timeout'})
+                self.forget(msg.channel, reference)
+                continue
+            except Exception as ex:
+                bot.metrics.inc('ircbot_unfurls_total', labels={**labels, 'outcome': 'error'})
+                self.forget(msg.channel, reference)
+                bot.handle_error(
+                    dedent(
+                        """
+                    ircbot exception unfurling {reference} in {plugin}/{function}: {exception}
+
+                    {traceback}
+                    """,
+                    ).format(
+                        reference=reference.match.group(0),
+                        plugin=labels['plugin'],
+                        function=labels['function'],
+                        exception=ex,
+                        traceback=format_exc(),
+                    ),
+                )
+                continue
+
+            if preview is None:
+                bot.metrics.inc('ircbot_unfurls_total', labels={**labels, 'outcome': 'missing'})
+            else:
+                bot.metrics.inc('ircbot_unfurls_total', labels={**labels, 'outcome': 'shown'})
+                msg.respond(preview, ping=reference.unfurler.ping)
+
+    def _nth(self, batch: concurrent.futures.Future, index: int) -> concurrent.futures.Future:
+        """Return a future for one preview out of a batch."""
+        future: concurrent.futures.Future = concurrent.futures.Future()
+
+        def done(batch):
+            try:
+                future.set_result(batch.result()[index])
+            except Exception as ex:
+                future.set_exception(ex)
+
+        batch.add_done_callback(done)
+        return future
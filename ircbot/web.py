@@ -0,0 +1,121 @@
+"""A shared HTTP client for plugins, with connections kept open between requests.
+
+Plugins should use get, post, or request here instead of calling requests
+directly. These take the same arguments as requests does, but go through
+one Session, so repeat requests to a host skip the DNS lookup and TCP and
+TLS handshakes. Every request gets a timeout, and only so many run at
+once, so a slow upstream can't tie up every listener thread.
+"""
+import collections
+import threading
+import time
+import urllib.parse
+from typing import DefaultDict
+from typing import Dict
+from typing import Optional
+from typing import Tuple
+
+import requests
+import requests.adapters
+
+# Seconds to wait to connect, and for each read, unless a request says otherwise
+CONNECT_TIMEOUT_SECONDS = 5
+READ_TIMEOUT_SECONDS = 15
+
+# Most requests in flight at once, across every plugin
+MAX_CONCURRENT_REQUESTS = 8
+
+# How long a request waits for one of the others to finish before giving up
+QUEUE_TIMEOUT_SECONDS = 10
+
+# Hosts to keep connections to, and connections kept to each one
+POOL_HOSTS = 16
+POOL_MAX_SIZE = 4
+
+HEADERS = {
+    'User-Agent': 'ocf-ircbot (+https://github.com/ocf/ircbot)',
+    # requests decompresses these for us
+    'Accept-Encoding': 'gzip, deflate',
+}
+
+
+class HostStats:
+    """Requests made to one host, for metrics."""
+
+    def __init__(self):
+        # Requests by outcome: the status class (like 2xx), or error
+        self.requests: DefaultDict[str, int] = collections.defaultdict(int)
+        self.seconds = 0.0
+
+
+_session: Optional[requests.Session] = None
+_session_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(MAX_CONCURRENT_REQUESTS)
+_in_flight = 0
+_hosts: DefaultDict[str, HostStats] = collections.defaultdict(HostStats)
+_stats_lock = threading.Lock()
+
+
+def session() -> requests.Session:
+    """Return the shared Session, creating it if needed."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            _session.headers.update(HEADERS)
+            adapter = requests.adapters.HTTPAdapter(pool_connections=POOL_HOSTS, pool_maxsize=POOL_MAX_SIZE)
+            _session.mount('https://', adapter)
+            _session.mount('http://', adapter)
+        return _session
+
+
+def request(method: str, url: str, client: Optional[requests.Session] = None, **kwargs) -> requests.Response:
+    """Make a request through the shared Session, like requests.request.
+
+    Plugins with a Session of their own (like one that's logged in
+    somewhere) can pass it as client, to still be counted and limited here.
+    """
+    global _in_flight
+    kwargs.setdefault('timeout', (CONNECT_TIMEOUT_SECONDS, READ_TIMEOUT_SECONDS))
+    host = urllib.parse.urlsplit(url).hostname or ''
+
+    if not _slots.acquire(timeout=QUEUE_TIMEOUT_SECONDS):
+        raise requests.exceptions.Timeout(f'too many requests in flight to make one to {host}')
+    with _stats_lock:
+        _in_flight += 1
+    start = time.perf_counter()
+    outcome = 'error'
+    try:
+        resp = (client or session()).request(method, url, **kwargs)
+        outcome = f'{resp.status_code // 100}xx'
+        return resp
+    finally:
+        seconds = time.perf_counter() - start
+        _slots.release()
+        with _stats_lock:
+            _in_flight -= 1
+            stats = _hosts[host]
+            stats.requests[outcome] += 1
+            stats.seconds += seconds
+
+
+def get(url: str, **kwargs) -> requests.Response:
+    return request('GET', url, **kwargs)
+
+
+def post(url: str, **kwargs) -> requests.Response:
+    return request('POST', url, **kwargs)
+
+
+def in_flight() -> int:
+    with _stats_lock:
+        return _in_flight
+
+
+def host_stats() -> Dict[str, Tuple[Dict[str, int], float]]:
+    """Return requests so far by host: a count for each outcome, and the total seconds they took."""
+    with _stats_lock:
+        return {
+            host: (dict(stats.requests), stats.seconds)
+            for host, stats in _hosts.items()
+        }
@@ -0,0 +1,19 @@
+-- Owners and members of each notify group, one per row. This replaces the
+-- space-separated owners and members columns of the notify table.
+--
+-- Run once, as a user allowed to change the schema:
+--
+--     mysql -h mysql.ocf.berkeley.edu -p ocfircbot < sql/notify_members.sql
+--
+-- Until it has been, the bot keeps using the old columns. Once it has, the
+-- bot moves groups out of the old columns (and sets them to NULL) when it
+-- starts, and whenever a group that still has them is changed.
+CREATE TABLE IF NOT EXISTS notify_members (
+    id INT UNSIGNED NOT NULL AUTO_INCREMENT,
+    slug VARCHAR(191) NOT NULL,
+    target VARCHAR(191) NOT NULL,
+    role ENUM('owner', 'member') NOT NULL,
+    PRIMARY KEY (id),
+    UNIQUE KEY slug_target (slug, target),
+    KEY target (target)
+) DEFAULT CHARSET=utf8mb4;
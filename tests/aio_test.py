@@ -0,0 +1,141 @@
+import asyncio
+import threading
+
+import pytest
+
+from ircbot.aio import _on_loop
+from ircbot.aio import AsyncCreateBot
+from ircbot.ircbot import CreateBot
+from ircbot.ircbot import Listener
+from ircbot.ircbot import MatchedMessage
+
+
+@pytest.fixture
+def bot(monkeypatch):
+    # Nothing to connect to, and no plugins
+    for name in ('warm_up_db', 'register_plugins', 'start_warmup'):
+        monkeypatch.setattr(CreateBot, name, lambda self: None)
+    bot = AsyncCreateBot(*[None] * 9)
+    loop = bot.reactor.loop
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    yield bot
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join(5)
+
+
+def on_loop(bot, fn, *args):
+    """Call fn on the bot's event loop (like IRC events are) and return what it returns."""
+    async def call():
+        return fn(*args)
+    return asyncio.run_coroutine_threadsafe(call(), bot.reactor.loop).result(5)
+
+
+def listener(fn):
+    return Listener(
+        pattern=None,
+        fn=fn,
+        help_text='',
+        require_mention=False,
+        require_oper=False,
+        require_privileged_oper=False,
+    )
+
+
+def message(respond):
+    return MatchedMessage(
+        channel='#channel',
+        text='',
+        raw_text='',
+        match=None,
+        is_oper=False,
+        nick='someone',
+        respond=respond,
+    )
+
+
+def wait_for(condition):
+    for _ in range(500):
+        if condition():
+            return
+        threading.Event().wait(0.01)
+    raise AssertionError('timed out')
+
+
+def test_async_listener_runs_on_loop(bot):
+    ran_on_loop = []
+
+    async def fn(bot, msg):
+        ran_on_loop.append(_on_loop(bot.reactor.loop))
+        msg.respond('hi')
+
+    sent = []
+    assert on_loop(bot, bot.schedule_listener, listener(fn), message(sent.append))
+    wait_for(lambda: sent)
+    assert ran_on_loop == [True]
+    assert sent == ['hi']
+    wait_for(lambda: not bot.listener_tasks)
+    assert not bot.executor.orderer.tickets
+
+
+def test_responses_in_order_across_sync_and_async_listeners(bot):
+    release = threading.Event()
+    sync_done = threading.Event()
+
+    async def slow(bot, msg):
+        await asyncio.get_running_loop().run_in_executor(None, release.wait)
+        msg.respond('slow')
+
+    def fast(bot, msg):
+        msg.respond('fast')
+        sync_done.set()
+
+    sent = []
+    assert on_loop(bot, bot.schedule_listener, listener(slow), message(sent.append))
+    assert on_loop(bot, bot.schedule_listener, listener(fast), message(sent.append))
+
+    # The fast one finished first, but waits for the slow one to respond
+    assert sync_done.wait(5)
+    assert sent == []
+    release.set()
+    wait_for(lambda: len(sent) == 2)
+    assert sent == ['slow', 'fast']
+
+
+def test_send_raw_from_worker_thread(bot, monkeypatch):
+    loop = bot.reactor.loop
+    handed_over = []
+    call_soon_threadsafe = loop.call_soon_threadsafe
+
+    def record_call_soon_threadsafe(callback, *args):
+        if getattr(callback, '__name__', None) == 'send_raw':
+            handed_over.append(args)
+        return call_soon_threadsafe(callback, *args)
+
+    monkeypatch.setattr(loop, 'call_soon_threadsafe', record_call_soon_threadsafe)
+
+    written = []
+
+    class Transport:
+        def write(self, data):
+            written.append((data, _on_loop(loop)))
+
+    bot.connection.transport = Transport()
+
+    # From a worker thread, it's handed over to the loop
+    threading.Thread(target=bot.connection.send_raw, args=('PRIVMSG #channel :from a thread',)).start()
+    wait_for(lambda: written)
+    assert handed_over == [('PRIVMSG #channel :from a thread',)]
+    assert written == [(b'PRIVMSG #channel :from a thread\r\n', True)]
+
+    # On the loop, it's sent straight away
+    on_loop(bot, bot.connection.send_raw, 'PRIVMSG #channel :from the loop')
+    assert handed_over == [('PRIVMSG #channel :from a thread',)]
+    assert written[1] == (b'PRIVMSG #channel :from the loop\r\n', True)
+
+
+def test_scheduler_runs_on_loop(bot):
+    ran_on_loop = []
+    bot.reactor.scheduler.execute_after(0, lambda: ran_on_loop.append(_on_loop(bot.reactor.loop)))
+    wait_for(lambda: ran_on_loop)
+    assert ran_on_loop == [True]
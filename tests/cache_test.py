@@ -0,0 +1,43 @@
+import threading
+
+from ircbot.cache import Cache
+
+
+def test_caches_values_and_misses():
+    cache = Cache('test', ttl=60, negative_ttl=60)
+    assert cache.get('a', lambda: 1) == 1
+    assert cache.get('a', lambda: 2) == 1
+    assert cache.get('b', lambda: None) is None
+    assert cache.get('b', lambda: 3) is None
+    assert cache.stats()['hits'] == 2
+
+
+def test_evicts_least_recently_used():
+    cache = Cache('test', ttl=60, max_size=2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    cache.peek('a')
+    cache.put('c', 3)
+    assert cache.peek('b') == (False, None)
+    assert cache.peek('a') == (True, 1)
+
+
+def test_invalidate_during_lookup_isnt_undone():
+    cache = Cache('test', ttl=60)
+    started = threading.Event()
+    finish = threading.Event()
+
+    def slow_fetch():
+        started.set()
+        finish.wait(5)
+        return 'stale'
+
+    thread = threading.Thread(target=cache.get, args=('key', slow_fetch))
+    thread.start()
+    assert started.wait(5)
+    cache.invalidate('key')
+    finish.set()
+    thread.join(5)
+
+    assert cache.peek('key') == (False, None)
+    assert cache.get('key', lambda: 'fresh') == 'fresh'
@@ -0,0 +1,16 @@
+import re
+
+from ircbot.dispatch import LiteralMatcher
+from ircbot.dispatch import required_literals
+
+
+def test_required_literals():
+    assert required_literals(re.compile(r'^!notify (\S+)')) == (['!notify '], True)
+    assert required_literals(re.compile(r'(?:rt#|ocf.io/rt/)([0-9]+)')) == (['ocf', 'rt#'], False)
+
+
+def test_literal_matcher_finds_overlapping_literals():
+    matcher = LiteralMatcher(['rt#', 't#', 'abc', 'ab', 'xkcd.com/'])
+    assert matcher.find('see rt#5 and abc') == {'rt#', 't#', 'abc', 'ab'}
+    assert matcher.find('xkcd.com/927') == {'xkcd.com/'}
+    assert matcher.find('nothing here') == set()
@@ -0,0 +1,72 @@
+import threading
+
+from ircbot.executor import ListenerExecutor
+from ircbot.executor import ResponseOrderer
+
+
+def test_responds_in_order_of_tickets():
+    orderer = ResponseOrderer()
+    sent = []
+    first = orderer.ticket('#channel')
+    second = orderer.ticket('#channel')
+
+    orderer.wrap('#channel', second, sent.append)('second')
+    assert sent == []
+    orderer.wrap('#channel', first, sent.append)('first')
+    assert sent == ['first']
+
+    orderer.finish('#channel', first)
+    assert sent == ['first', 'second']
+    orderer.finish('#channel', second)
+    assert not orderer.tickets
+
+
+def test_responds_after_finishing():
+    orderer = ResponseOrderer()
+    sent = []
+    ticket = orderer.ticket('#channel')
+    respond = orderer.wrap('#channel', ticket, sent.append)
+    orderer.finish('#channel', ticket)
+
+    # Like a listener that started a background thread which responds later
+    respond('later')
+    assert sent == ['later']
+
+
+def test_responds_after_finishing_behind_a_slow_command():
+    orderer = ResponseOrderer()
+    sent = []
+    slow = orderer.ticket('#channel')
+    fast = orderer.ticket('#channel')
+    respond = orderer.wrap('#channel', fast, sent.append)
+    orderer.finish('#channel', fast)
+
+    # Still waiting on the slow command, so this is held back
+    respond('fast')
+    assert sent == []
+    orderer.finish('#channel', slow)
+    assert sent == ['fast']
+
+    respond('even later')
+    assert sent == ['fast', 'even later']
+
+
+def test_executor_responds_from_background_thread():
+    executor = ListenerExecutor(max_workers=2, max_pending=10)
+    sent = []
+    done = threading.Event()
+
+    def listener(respond):
+        def later():
+            listener_finished.wait()
+            respond('from thread')
+            done.set()
+        threading.Thread(target=later).start()
+
+    listener_finished = threading.Event()
+    assert executor.submit(plugin='test', limit=4, channel='#channel', respond=sent.append, fn=listener)
+    while executor.pending:
+        threading.Event().wait(0.01)
+    listener_finished.set()
+    assert done.wait(5)
+    assert sent == ['from thread']
@@ -0,0 +1,23 @@
+from markovify.chain import BEGIN
+from markovify.chain import END
+
+from ircbot.markov import CompactChain
+
+
+def test_random_state_with_ignores_case():
+    chain = CompactChain.from_model(
+        {
+            (BEGIN, BEGIN): {'Hello': 1.0, 'hello': 1.0},
+            (BEGIN, 'Hello'): {'world': 1.0},
+            (BEGIN, 'hello'): {'there': 1.0},
+            ('Hello', 'world'): {END: 1.0},
+            ('hello', 'there'): {END: 1.0},
+        },
+        state_size=2,
+    )
+    assert 'Hello' in chain.random_state_with('Hello')
+    assert {'Hello', 'hello'} & set(chain.random_state_with('HELLO'))
+    assert chain.random_state_with('nope') is None
+
+    chain.add_runs([['Goodbye', 'now']], weight=1)
+    assert 'Goodbye' in chain.random_state_with('goodbye')
@@ -0,0 +1,64 @@
+import contextlib
+import time
+from types import SimpleNamespace
+
+from ircbot.plugin import notify
+
+
+class FakeCursor:
+    """Just enough of the notify table, before notify_members is created."""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.result = []
+
+    def execute(self, sql, args=()):
+        if sql.startswith('SELECT') and 'FROM notify' in sql:
+            self.result = [dict(row) for row in self.rows if not args or row['slug'] == args[0]]
+        elif sql.startswith('UPDATE notify SET owners'):
+            owners, members, slug = args
+            for row in self.rows:
+                if row['slug'] == slug:
+                    row.update(owners=owners, members=members)
+        else:
+            raise AssertionError(f'unexpected query: {sql}')
+
+    def fetchone(self):
+        return self.result[0] if self.result else None
+
+    def fetchall(self):
+        return self.result
+
+
+class FakeMessage:
+    def __init__(self, nick, text):
+        self.nick = nick
+        self.is_oper = False
+        self.match = SimpleNamespace(group=lambda n: text)
+        self.responses = []
+
+    def respond(self, text, ping=True):
+        self.responses.append(text)
+
+
+def test_group_created_elsewhere(monkeypatch):
+    # The graph was loaded before the group was created by someone else
+    monkeypatch.setattr(notify, '_graph', notify.NotifyGraph({}))
+    monkeypatch.setattr(notify, '_graph_loaded', time.monotonic())
+    monkeypatch.setattr(notify, '_members_table', False)
+    cursor = FakeCursor([{'slug': 'new', 'owners': 'alice', 'members': 'bob'}])
+    monkeypatch.setattr(notify.db, 'cursor', lambda password: contextlib.nullcontext(cursor))
+    bot = SimpleNamespace(mysql_password='')
+
+    assert notify.graph(bot).role('new', 'alice') is None
+
+    msg = FakeMessage('alice', 'new')
+    assert notify.check_group(bot, msg, cursor, 'new', 'add to')
+    assert msg.responses == []
+    assert notify.graph(bot).role('new', 'alice') == 'owner'
+
+    msg = FakeMessage('carol', 'new')
+    notify.addme(bot, msg)
+    assert msg.responses == ['Added you to new, as a member.']
+    assert notify.graph(bot).get('new') == {'owners': ['alice'], 'members': ['bob', 'carol']}
+    assert cursor.rows[0]['members'] == 'bob carol'
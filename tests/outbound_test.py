@@ -0,0 +1,27 @@
+from ircbot.outbound import OutboundQueue
+from ircbot.outbound import TokenBucket
+
+
+def test_token_bucket_charges_each_line():
+    bucket = TokenBucket(rate=2, burst=10)
+    assert bucket.delay(4) == 0
+    bucket.take(4)
+    assert bucket.delay(6) == 0
+    bucket.take(6)
+    assert 0.4 < bucket.delay() <= 0.5
+
+
+def test_token_bucket_groups_bigger_than_burst():
+    bucket = TokenBucket(rate=2, burst=10)
+    # Only waits for a full bucket, but the debt holds up what comes next
+    assert bucket.delay(15) == 0
+    bucket.take(15)
+    assert 2.9 < bucket.delay() <= 3
+
+
+def test_private_messages_share_a_label():
+    sent = []
+    queue = OutboundQueue(lambda target, lines: sent.append(target), rate=1000, burst=1000)
+    for target in ('#rebuild', 'alice', 'bob', '#rebuild'):
+        queue.put(target, ['PRIVMSG'])
+    assert queue.depths() == {'#rebuild': 2, 'private': 2}
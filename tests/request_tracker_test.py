@@ -0,0 +1,53 @@
+from types import SimpleNamespace
+
+from ircbot.plugin import request_tracker
+
+TICKET = """RT/4.4.3 200 Ok
+
+id: ticket/123
+Queue: help
+Owner: someone
+Subject: printer is on fire
+Status: open
+"""
+
+MISSING = """RT/4.4.3 200 Ok
+
+# Ticket 456 does not exist.
+"""
+
+EXPIRED = """RT/4.4.3 401 Credentials required
+"""
+
+
+class FakeSession:
+    """A logged in RT session, answering with each of replies in turn."""
+
+    def __init__(self, *replies):
+        self.replies = list(replies)
+        self.urls = []
+
+    def request(self, method, url, **kwargs):
+        self.urls.append(url)
+        return SimpleNamespace(status_code=200, text=self.replies.pop(0), raise_for_status=lambda: None)
+
+
+def test_logs_in_again_when_session_expires(monkeypatch):
+    sessions = [FakeSession(EXPIRED), FakeSession(TICKET, MISSING)]
+    logins = list(sessions)
+    monkeypatch.setattr(request_tracker, '_session', None)
+    monkeypatch.setattr(request_tracker, 'rt_connection', lambda user, password: logins.pop(0))
+    bot = SimpleNamespace(rt_password='')
+
+    ticket = request_tracker.fetch_ticket(bot, 123)
+    assert ticket == request_tracker.RtTicket(
+        number=123,
+        owner='someone',
+        subject='printer is on fire',
+        queue='help',
+        status='open',
+    )
+    assert not logins
+    assert sessions[1].urls == ['https://rt.ocf.berkeley.edu/REST/1.0/ticket/123/view']
+
+    assert request_tracker.fetch_ticket(bot, 456) is None